@@ -0,0 +1,378 @@
+"""
+Двухуровневый кеш: ограниченный LRU в памяти процесса перед общим
+(для всех воркеров gunicorn) бэкендом.
+
+Пример настройки::
+
+    CACHES = {
+        "default": {
+            "BACKEND": "mysite.cache.TieredCache",
+            "OPTIONS": {
+                "SHARED_ALIAS": "shared",
+                "LOCAL_MAX_ENTRIES": 1000,
+                "LOCAL_TIMEOUT": 5,
+                "LOCAL_EXCLUDE_PREFIXES": ["catalog_version"],
+            },
+        },
+        "shared": {...},
+    }
+
+Запись в локальный уровень живет не дольше LOCAL_TIMEOUT секунд, так как
+другие воркеры не могут его инвалидировать. Ключи с префиксами из
+LOCAL_EXCLUDE_PREFIXES (счетчики версий) всегда читаются из общего уровня.
+
+Пересчет значения в get_or_compute защищен блокировкой в общем уровне.
+add() и incr() FileBasedCache не атомарны (has_key или get, затем set),
+поэтому для него блокировка - файл рядом с записями кеша, созданный
+с O_CREAT | O_EXCL. Под такой же блокировкой выполняется incr().
+"""
+
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable
+from uuid import uuid4
+from zlib import crc32
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+
+from .instrumentation import record_cache_lookup
+
+_MISSING = object()
+
+# Значения этих типов неизменяемы и хранятся в локальном уровне как есть,
+# остальные - в виде pickle, чтобы запросы не делили один изменяемый объект
+IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+class _Pickled(bytes):
+    pass
+
+
+class SoftEntry:
+    """
+    Значение с мягким сроком годности: после soft_expires_at оно еще
+    отдается клиентам, пока один из них пересчитывает новое
+    """
+
+    __slots__ = ("value", "soft_expires_at")
+
+    def __init__(self, value, soft_expires_at: float):
+        self.value = value
+        self.soft_expires_at = soft_expires_at
+
+    @property
+    def is_stale(self) -> bool:
+        return time.time() >= self.soft_expires_at
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared_alias = options.get("SHARED_ALIAS", "shared")
+        self._local_max_entries = int(options.get("LOCAL_MAX_ENTRIES", 1000))
+        self._local_timeout = float(options.get("LOCAL_TIMEOUT", 5))
+        self._local_exclude = tuple(options.get("LOCAL_EXCLUDE_PREFIXES", ()))
+        self._lock_timeout = float(options.get("LOCK_TIMEOUT", 10))
+        self._lock_poll_interval = float(options.get("LOCK_POLL_INTERVAL", 0.05))
+
+        self._local: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self._local_lock = threading.RLock()
+        # блокировки пересчета внутри процесса (ключи распределяются по ним хешем)
+        self._compute_locks = [threading.Lock() for _ in range(64)]
+        self._counters = defaultdict(int)
+
+    @property
+    def shared(self) -> BaseCache:
+        return caches[self._shared_alias]
+
+    # Локальный уровень
+
+    def _use_local(self, key: str) -> bool:
+        return self._local_max_entries > 0 and not key.startswith(self._local_exclude)
+
+    def _local_get(self, local_key: str):
+        with self._local_lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._local[local_key]
+                return _MISSING
+            self._local.move_to_end(local_key)
+        if isinstance(value, _Pickled):
+            return pickle.loads(value)
+        return value
+
+    def _local_set(self, local_key: str, value, timeout) -> None:
+        ttl = self._local_timeout
+        if timeout is not None:
+            ttl = min(ttl, timeout)
+        if ttl <= 0:
+            self._local_delete(local_key)
+            return
+        if not isinstance(value, IMMUTABLE_TYPES):
+            value = _Pickled(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._local_lock:
+            self._local[local_key] = (value, time.monotonic() + ttl)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def _local_delete(self, local_key: str) -> None:
+        with self._local_lock:
+            self._local.pop(local_key, None)
+
+    # API бэкенда Django
+
+    def _lookup(self, key, version):
+        """
+        Значение (возможно, SoftEntry) из локального или общего уровня
+        """
+        local_key = self.make_and_validate_key(key, version=version)
+        use_local = self._use_local(key)
+        if use_local:
+            value = self._local_get(local_key)
+            if value is not _MISSING:
+                self._counters["local_hits"] += 1
+                record_cache_lookup(hit=True)
+                return value
+
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._counters["misses"] += 1
+            record_cache_lookup(hit=False)
+            return _MISSING
+        self._counters["shared_hits"] += 1
+        record_cache_lookup(hit=True)
+        if use_local:
+            self._local_set(local_key, value, None)
+        return value
+
+    def get(self, key, default=None, version=None):
+        value = self._lookup(key, version)
+        if value is _MISSING:
+            return default
+        if isinstance(value, SoftEntry):
+            return value.value
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        self.shared.set(key, value, timeout=timeout, version=version)
+        local_key = self.make_and_validate_key(key, version=version)
+        if self._use_local(key):
+            self._local_set(local_key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added and self._use_local(key):
+            self._local_set(self.make_and_validate_key(key, version=version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.touch(key, timeout=self.get_backend_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self._lookup(key, version) is not _MISSING
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        shared = self.shared
+        if not isinstance(shared, FileBasedCache):
+            return shared.incr(key, delta, version=version)
+        # incr() FileBasedCache - get, затем set: без блокировки одновременные
+        # увеличения счетчика версии теряются. Ждем не бесконечно: блокировка
+        # упавшего владельца истекает через LOCK_TIMEOUT
+        lock_key = f"{key}:incr-lock"
+        path = self._lock_file(shared, lock_key, version)
+        token = uuid4().hex
+        while not self._create_lock_file(path, token):
+            time.sleep(self._lock_poll_interval)
+        try:
+            return shared.incr(key, delta, version=version)
+        finally:
+            self._release_compute_lock(lock_key, token, version)
+
+    def clear(self):
+        with self._local_lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
+        # Общий уровень сам переводит таймаут в срок годности,
+        # здесь нужна только длительность в секундах
+        if timeout is DEFAULT_TIMEOUT:
+            return self.default_timeout
+        if timeout == 0:
+            return -1
+        return timeout
+
+    # Защита от одновременного пересчета
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.get_or_compute(key, default, timeout=timeout, version=version)
+
+    def get_or_compute(
+        self,
+        key,
+        compute: Callable[[], Any] | Any,
+        timeout=DEFAULT_TIMEOUT,
+        soft_timeout: float | None = None,
+        version=None,
+    ):
+        """
+        Возвращает значение по ключу, при отсутствии (или по истечении
+        soft_timeout) пересчитывает его. Пересчетом занимается один
+        процесс: остальные отдают устаревшее значение или ждут результат
+        """
+        value = self._lookup(key, version)
+        if value is not _MISSING and not (isinstance(value, SoftEntry) and value.is_stale):
+            return value.value if isinstance(value, SoftEntry) else value
+
+        stale = value.value if isinstance(value, SoftEntry) else _MISSING
+        lock_key = f"{key}:compute-lock"
+        local_key = self.make_and_validate_key(key, version=version)
+        local_lock = self._compute_locks[crc32(local_key.encode()) % len(self._compute_locks)]
+
+        with local_lock:
+            # пока ждали блокировку, значение мог пересчитать другой поток
+            value = self._lookup(key, version)
+            if value is not _MISSING and not (isinstance(value, SoftEntry) and value.is_stale):
+                self._counters["coalesced"] += 1
+                return value.value if isinstance(value, SoftEntry) else value
+
+            token = self._acquire_compute_lock(lock_key, version)
+            if token is not None:
+                try:
+                    return self._compute(key, compute, timeout, soft_timeout, version)
+                finally:
+                    self._release_compute_lock(lock_key, token, version)
+
+        # пересчитывает другой процесс; ждем без локальной блокировки, чтобы
+        # не задерживать потоки с другими ключами той же полосы
+        if stale is not _MISSING:
+            self._counters["stale_served"] += 1
+            return stale
+        value = self._wait_for_value(key, version)
+        if value is not _MISSING:
+            self._counters["coalesced"] += 1
+            return value
+        # не дождались: считаем сами, чужую блокировку не трогаем
+        return self._compute(key, compute, timeout, soft_timeout, version)
+
+    def _compute(self, key, compute, timeout, soft_timeout, version):
+        self._counters["computes"] += 1
+        new_value = compute() if callable(compute) else compute
+        if new_value is not None:
+            if soft_timeout is not None:
+                entry = SoftEntry(new_value, time.time() + soft_timeout)
+                self.set(key, entry, timeout=timeout, version=version)
+            else:
+                self.set(key, new_value, timeout=timeout, version=version)
+        return new_value
+
+    def _acquire_compute_lock(self, lock_key, version) -> str | None:
+        """
+        Токен владельца блокировки или None, если ее держит другой
+        """
+        token = uuid4().hex
+        shared = self.shared
+        if isinstance(shared, FileBasedCache):
+            acquired = self._create_lock_file(self._lock_file(shared, lock_key, version), token)
+        else:
+            acquired = shared.add(lock_key, token, timeout=self._lock_timeout, version=version)
+        return token if acquired else None
+
+    def _release_compute_lock(self, lock_key, token: str, version) -> None:
+        # блокировка могла истечь и достаться другому: удаляем только свою
+        shared = self.shared
+        if isinstance(shared, FileBasedCache):
+            path = self._lock_file(shared, lock_key, version)
+            try:
+                with open(path) as f:
+                    if f.read() == token:
+                        os.remove(path)
+            except FileNotFoundError:
+                pass
+        elif shared.get(lock_key, version=version) == token:
+            shared.delete(lock_key, version=version)
+
+    @staticmethod
+    def _lock_file(shared: FileBasedCache, lock_key, version) -> str:
+        # суффикс не .djcache: clear() и отсечение старых записей его не трогают
+        return os.path.splitext(shared._key_to_file(lock_key, version))[0] + ".lock"
+
+    def _create_lock_file(self, path: str, token: str) -> bool:
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                continue
+            except FileExistsError:
+                # владелец мог упасть, не сняв блокировку: она живет
+                # не дольше LOCK_TIMEOUT, как запись с таймаутом
+                try:
+                    if time.time() - os.path.getmtime(path) < self._lock_timeout:
+                        return False
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+            return True
+        return False
+
+    def _wait_for_value(self, key, version):
+        deadline = time.monotonic() + self._lock_timeout
+        self._counters["lock_waits"] += 1
+        while time.monotonic() < deadline:
+            time.sleep(self._lock_poll_interval)
+            value = self.shared.get(key, _MISSING, version=version)
+            if value is not _MISSING:
+                return value.value if isinstance(value, SoftEntry) else value
+        return _MISSING
+
+    # Метрики
+
+    def stats(self) -> dict:
+        """
+        Счетчики текущего процесса
+        """
+        with self._local_lock:
+            local_entries = len(self._local)
+        return {
+            **{
+                name: self._counters[name]
+                for name in (
+                    "local_hits",
+                    "shared_hits",
+                    "misses",
+                    "evictions",
+                    "computes",
+                    "coalesced",
+                    "stale_served",
+                    "lock_waits",
+                )
+            },
+            "local_entries": local_entries,
+            "local_max_entries": self._local_max_entries,
+        }
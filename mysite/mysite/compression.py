@@ -0,0 +1,377 @@
+"""
+Сжатие ответов: gzip, а также brotli и zstd, если установлены пакеты
+brotli и zstandard.
+
+Кодировка выбирается по Accept-Encoding (q-значения, "*") в порядке
+settings.COMPRESSION_LEVELS. Потоковые ответы (StreamingHttpResponse,
+FileResponse, в том числе асинхронные) сжимаются по частям по мере
+отдачи: тело не собирается в памяти, сжатые данные сбрасываются клиенту
+не реже чем через COMPRESSION_FLUSH_BYTES исходных байт. Не сжимаются
+уже сжатые форматы (изображения, архивы, видео), ответы с
+Content-Encoding и тела короче COMPRESSION_MIN_LENGTH.
+
+Защита от BREACH: HTML-страницы сжимаются gzip со случайной длиной
+заголовка (имя файла из 1..COMPRESSION_MAX_RANDOM_BYTES байт), как
+GZipMiddleware Django; если в странице есть CSRF-токен, brotli и zstd
+для нее не используются - у этих форматов нет места для такой добавки.
+
+Замеры: время CPU на сжатие обычного ответа и размеры до/после
+попадают в Server-Timing (compress;dur=...), итоги по кодировкам за
+время жизни процесса (включая потоковые ответы) - в compression_stats
+(страница admin/compression-stats/)
+"""
+
+import secrets
+import struct
+import threading
+import time
+import zlib
+from collections import defaultdict
+from typing import AsyncIterator, Iterator
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, HttpResponseBase
+from django.utils.cache import patch_vary_headers
+
+from .instrumentation import current_metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - зависит от окружения
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - зависит от окружения
+    zstandard = None
+
+# Уровни сжатия по умолчанию; порядок - предпочтение при равных q
+COMPRESSION_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+# Тела короче этого размера (байты) не сжимаются: выигрыш меньше затрат
+COMPRESSION_MIN_LENGTH = 1024
+# Потоковый ответ: сколько исходных байт копится в компрессоре до сброса
+COMPRESSION_FLUSH_BYTES = 16 * 1024
+# Верхняя граница случайной добавки к заголовку gzip для text/html
+COMPRESSION_MAX_RANDOM_BYTES = 100
+
+# Типы содержимого, которые уже сжаты
+COMPRESSED_TYPE_PREFIXES = ("image/", "video/", "audio/", "font/woff")
+COMPRESSED_TYPES = {
+    "application/gzip",
+    "application/x-gzip",
+    "application/zip",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/zstd",
+    "application/pdf",
+}
+# Сжимаемые типы среди COMPRESSED_TYPE_PREFIXES
+UNCOMPRESSED_TYPES = {"image/svg+xml", "image/bmp", "image/x-icon"}
+
+
+class GzipCompressor:
+    """
+    Заголовок и концевик gzip пишутся здесь, а не zlib: при
+    max_random_bytes > 0 в заголовок попадает имя файла случайной длины
+    """
+
+    def __init__(self, level: int, max_random_bytes: int = 0):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._crc = 0
+        self._size = 0
+        # FNAME, mtime 0, ОС "неизвестна" - как gzip.compress(mtime=0)
+        if max_random_bytes > 0:
+            filename = secrets.token_hex(max_random_bytes)[: secrets.randbelow(max_random_bytes) + 1]
+            self._header = b"\x1f\x8b\x08\x08\x00\x00\x00\x00\x00\xff" + filename.encode() + b"\x00"
+        else:
+            self._header = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+    def _take_header(self) -> bytes:
+        header, self._header = self._header, b""
+        return header
+
+    def compress(self, data: bytes) -> bytes:
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        return self._take_header() + self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._take_header() + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return (
+            self._take_header()
+            + self._compressor.flush(zlib.Z_FINISH)
+            + struct.pack("<II", self._crc, self._size & 0xFFFFFFFF)
+        )
+
+
+class BrotliCompressor:
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+COMPRESSORS = {"gzip": GzipCompressor}
+if brotli is not None:
+    COMPRESSORS["br"] = BrotliCompressor
+if zstandard is not None:
+    COMPRESSORS["zstd"] = ZstdCompressor
+
+
+def choose_encoding(accept_encoding: str, encodings) -> str | None:
+    """
+    Кодировка из encodings (в порядке предпочтения) с наибольшим q в
+    Accept-Encoding; None - клиент не принимает ни одну
+    """
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name] = weight
+    best, best_weight = None, 0.0
+    for name in encodings:
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = name, weight
+    return best
+
+
+class CompressionStats:
+    """
+    Итоги сжатия по кодировкам в процессе
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: {"responses": 0, "streamed": 0, "in": 0, "out": 0, "cpu": 0.0})
+
+    def record(self, encoding: str, size_in: int, size_out: int, cpu: float, streamed: bool) -> None:
+        with self._lock:
+            totals = self._totals[encoding]
+            totals["responses"] += 1
+            totals["streamed"] += streamed
+            totals["in"] += size_in
+            totals["out"] += size_out
+            totals["cpu"] += cpu
+
+    def snapshot(self, levels: dict[str, int]) -> dict:
+        with self._lock:
+            totals = {encoding: dict(values) for encoding, values in self._totals.items()}
+        return {
+            encoding: {
+                "level": levels.get(encoding),
+                "responses": values["responses"],
+                "streamed": values["streamed"],
+                "bytes_in": values["in"],
+                "bytes_out": values["out"],
+                "ratio": round(values["out"] / values["in"], 3) if values["in"] else None,
+                "cpu_ms": round(values["cpu"] * 1000, 1),
+                "cpu_ms_per_mb": round(values["cpu"] * 1000 / (values["in"] / 1e6), 2) if values["in"] else None,
+            }
+            for encoding, values in totals.items()
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals.clear()
+
+
+compression_stats = CompressionStats()
+
+
+def compression_levels() -> dict[str, int]:
+    """
+    Уровни доступных кодировок в порядке предпочтения
+    """
+    levels = getattr(settings, "COMPRESSION_LEVELS", COMPRESSION_LEVELS)
+    return {encoding: level for encoding, level in levels.items() if encoding in COMPRESSORS}
+
+
+def make_compressor(encoding: str, level: int, max_random_bytes: int = 0):
+    if encoding == "gzip":
+        return GzipCompressor(level, max_random_bytes)
+    return COMPRESSORS[encoding](level)
+
+
+class CompressedStream:
+    """
+    Сжатие частей потокового ответа с учетом времени CPU
+    """
+
+    def __init__(self, encoding: str, level: int, flush_bytes: int, max_random_bytes: int = 0):
+        self.encoding = encoding
+        self.compressor = make_compressor(encoding, level, max_random_bytes)
+        self.flush_bytes = flush_bytes
+        self.pending = 0
+        self.size_in = 0
+        self.size_out = 0
+        self.cpu = 0.0
+
+    def compress(self, chunk: bytes) -> bytes:
+        started = time.thread_time()
+        data = self.compressor.compress(chunk)
+        self.pending += len(chunk)
+        if self.pending >= self.flush_bytes:
+            data += self.compressor.flush()
+            self.pending = 0
+        self.cpu += time.thread_time() - started
+        self.size_in += len(chunk)
+        self.size_out += len(data)
+        return data
+
+    def finish(self) -> bytes:
+        started = time.thread_time()
+        data = self.compressor.finish()
+        self.cpu += time.thread_time() - started
+        self.size_out += len(data)
+        return data
+
+    def record(self) -> None:
+        compression_stats.record(self.encoding, self.size_in, self.size_out, self.cpu, streamed=True)
+
+    def iterate(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        try:
+            for chunk in chunks:
+                data = self.compress(chunk)
+                if data:
+                    yield data
+            yield self.finish()
+        finally:
+            self.record()
+
+    async def aiterate(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in chunks:
+                data = self.compress(chunk)
+                if data:
+                    yield data
+            yield self.finish()
+        finally:
+            self.record()
+
+
+def uses_csrf_token(request: HttpRequest) -> bool:
+    """
+    В ответ попал CSRF-токен (get_token) или выдается новая cookie
+    """
+    return bool(request.META.get("CSRF_COOKIE_USED") or request.META.get("CSRF_COOKIE_NEEDS_UPDATE"))
+
+
+class CompressionMiddleware:
+    """
+    Ставится сразу после ServerTimingMiddleware: сжатие обычных ответов
+    входит в замеры запроса
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.levels = compression_levels()
+        self.min_length = getattr(settings, "COMPRESSION_MIN_LENGTH", COMPRESSION_MIN_LENGTH)
+        self.flush_bytes = getattr(settings, "COMPRESSION_FLUSH_BYTES", COMPRESSION_FLUSH_BYTES)
+        self.max_random_bytes = getattr(settings, "COMPRESSION_MAX_RANDOM_BYTES", COMPRESSION_MAX_RANDOM_BYTES)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request: HttpRequest):
+        return self.process_response(request, await self.get_response(request))
+
+    def is_compressible(self, response: HttpResponseBase) -> bool:
+        if response.has_header("Content-Encoding") or response.status_code in (204, 206, 304):
+            return False
+        content_type = response.get("Content-Type", "").partition(";")[0].strip().lower()
+        if content_type in COMPRESSED_TYPES or (
+            content_type.startswith(COMPRESSED_TYPE_PREFIXES) and content_type not in UNCOMPRESSED_TYPES
+        ):
+            return False
+        if response.streaming:
+            # длина потока известна, например, у FileResponse
+            length = response.get("Content-Length")
+            return length is None or not length.isdigit() or int(length) >= self.min_length
+        return len(response.content) >= self.min_length
+
+    def process_response(self, request: HttpRequest, response: HttpResponseBase) -> HttpResponseBase:
+        if not self.levels or not self.is_compressible(response):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        is_html = response.get("Content-Type", "").partition(";")[0].strip().lower() == "text/html"
+        encodings = self.levels
+        if is_html and uses_csrf_token(request):
+            # BREACH: секрет в странице - только gzip со случайной добавкой
+            encodings = [encoding for encoding in self.levels if encoding == "gzip"]
+        encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""), encodings)
+        if encoding is None:
+            return response
+        level = self.levels[encoding]
+        max_random_bytes = self.max_random_bytes if is_html else 0
+
+        metrics = current_metrics()
+        if response.streaming:
+            stream = CompressedStream(encoding, level, self.flush_bytes, max_random_bytes)
+            if response.is_async:
+                response.streaming_content = stream.aiterate(response.streaming_content)
+            else:
+                response.streaming_content = stream.iterate(response.streaming_content)
+            # сжатая длина заранее неизвестна
+            del response.headers["Content-Length"]
+            if metrics is not None:
+                metrics.add_compression(encoding, level)
+        else:
+            started = time.thread_time()
+            compressor = make_compressor(encoding, level, max_random_bytes)
+            content = compressor.compress(response.content) + compressor.finish()
+            cpu = time.thread_time() - started
+            if metrics is not None:
+                metrics.add_compression(encoding, level, len(response.content), len(content), cpu)
+            compression_stats.record(encoding, len(response.content), len(content), cpu, streamed=False)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response.headers["Content-Length"] = str(len(content))
+
+        # как GZipMiddleware: сжатое тело отличается побайтно от исходного
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,90 @@
+"""
+JSON через orjson, если он установлен, иначе через модуль json.
+orjson - необязательная зависимость (extra fast-json в pyproject.toml)::
+
+    poetry install --extras fast-json
+
+dumps() и FastJSONRenderer дают тот же JSON, что json.dumps с
+DjangoJSONEncoder и JSONRenderer DRF соответственно: типы, которые
+orjson не знает или выводит иначе (Decimal, datetime, lazy-строки),
+передаются в default() того же кодировщика. Отступы (browsable API,
+Accept: application/json; indent=4) orjson не поддерживает, такие
+ответы строит JSONRenderer.
+
+Включение для API::
+
+    REST_FRAMEWORK = {
+        "DEFAULT_RENDERER_CLASSES": ["mysite.fastjson.FastJSONRenderer", ...],
+        "DEFAULT_PARSER_CLASSES": ["mysite.fastjson.FastJSONParser", ...],
+    }
+"""
+
+import json
+from typing import Any
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+# datetime/date/time - в default(): форматы кодировщиков отличаются от orjson
+ORJSON_OPTIONS = 0 if orjson is None else orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+_django_default = DjangoJSONEncoder().default
+
+
+def dumps(data: Any) -> bytes:
+    """
+    Компактный JSON в UTF-8, как json.dumps(..., cls=DjangoJSONEncoder,
+    separators=(",", ":"), ensure_ascii=False)
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=_django_default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # например, целые вне 64 бит
+            pass
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def loads(data: bytes | str) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # как JSONRenderer: JSON должен оставаться подмножеством JavaScript
+        return ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get("encoding", settings.DEFAULT_CHARSET)
+        # orjson читает только UTF-8 и, как strict-режим JSONParser, не
+        # принимает NaN/Infinity
+        if orjson is None or not self.strict or encoding.lower().replace("_", "-") not in ("utf-8", "utf8"):
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
@@ -0,0 +1,243 @@
+"""
+Замеры каждого запроса: количество и время SQL-запросов, попадания
+и промахи кеша, общее время обработки.
+
+Итоги отдаются в заголовке Server-Timing (видны во вкладке Network
+браузера) всем клиентам при SERVER_TIMING_HEADER = True, иначе только
+запросам с INTERNAL_IPS::
+
+    Server-Timing: app;dur=41.3, db;dur=12.8;desc="7 queries", cache;desc="3 hits / 1 misses"
+
+и, если ответ сжат (mysite.compression), compress;dur=...;desc="gzip level 6, ..."
+
+Запросы дольше SLOW_REQUEST_THRESHOLD_MS пишутся в лог записью с самыми
+повторяющимися SQL (отпечатки без значений параметров), по которым сразу
+видны N+1. Замеры дешевые: на каждый SQL-запрос - замер времени и
+увеличение счетчика, отпечатки строятся только для медленных запросов.
+
+Для потоковых ответов учитывается время до начала отдачи тела
+"""
+
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpRequest, HttpResponseBase
+
+log = logging.getLogger(__name__)
+
+# Порог медленного запроса по умолчанию, мс
+SLOW_REQUEST_THRESHOLD_MS = 500
+# Сколько отпечатков SQL попадает в запись о медленном запросе
+SLOW_REQUEST_TOP_QUERIES = 5
+
+# Значения в тексте SQL: строки, числа, списки параметров IN (...)
+_SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SQL_IN_LIST_RE = re.compile(r"\bIN \((?:\s*(?:%s|\?)\s*,?)+\)", re.IGNORECASE)
+_SPACES_RE = re.compile(r"\s+")
+
+
+def sql_fingerprint(sql: str) -> str:
+    """
+    Текст SQL без значений: запросы, отличающиеся только параметрами,
+    получают один отпечаток
+    """
+    sql = _SQL_STRING_RE.sub("?", sql)
+    sql = _SQL_NUMBER_RE.sub("?", sql)
+    sql = _SQL_IN_LIST_RE.sub("IN (...)", sql)
+    return _SPACES_RE.sub(" ", sql).strip()
+
+
+class RequestMetrics:
+    __slots__ = ("started", "queries", "db_time", "cache_hits", "cache_misses", "statements", "compression")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # текст SQL -> [количество, суммарное время]
+        self.statements: dict[str, list] = {}
+        # запись Server-Timing о сжатии ответа (mysite.compression)
+        self.compression: str | None = None
+
+    def add_query(self, sql: str, duration: float) -> None:
+        self.queries += 1
+        self.db_time += duration
+        statement = self.statements.get(sql)
+        if statement is None:
+            self.statements[sql] = [1, duration]
+        else:
+            statement[0] += 1
+            statement[1] += duration
+
+    def add_compression(
+        self,
+        encoding: str,
+        level: int,
+        size_in: int | None = None,
+        size_out: int | None = None,
+        cpu: float = 0.0,
+    ) -> None:
+        # размеры потокового ответа до отдачи заголовков неизвестны
+        if size_in is None:
+            self.compression = f'compress;desc="{encoding} level {level}, streamed"'
+        else:
+            self.compression = (
+                f"compress;dur={cpu * 1000:.1f};"
+                f'desc="{encoding} level {level}, {size_in} -> {size_out} bytes"'
+            )
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self, elapsed: float) -> str:
+        timing = (
+            f"app;dur={elapsed * 1000:.1f}, "
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+            f'cache;desc="{self.cache_hits} hits / {self.cache_misses} misses"'
+        )
+        if self.compression is not None:
+            timing += f", {self.compression}"
+        return timing
+
+    def top_queries(self, limit: int = SLOW_REQUEST_TOP_QUERIES) -> list[dict]:
+        """
+        Самые частые отпечатки SQL за запрос
+        """
+        counts, times = Counter(), Counter()
+        for sql, (count, duration) in self.statements.items():
+            fingerprint = sql_fingerprint(sql)
+            counts[fingerprint] += count
+            times[fingerprint] += duration
+        return [
+            {"count": count, "ms": round(times[fingerprint] * 1000, 1), "sql": fingerprint}
+            for fingerprint, count in counts.most_common(limit)
+        ]
+
+
+_current: ContextVar[RequestMetrics | None] = ContextVar("request_metrics", default=None)
+
+
+def current_metrics() -> RequestMetrics | None:
+    return _current.get()
+
+
+def record_cache_lookup(hit: bool) -> None:
+    """
+    Учитывает чтение из кеша в замерах текущего запроса
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started)
+
+
+def install_execute_wrapper(connection, **kwargs) -> None:
+    # Обертка ставится на соединение навсегда: в отличие от контекстного
+    # connection.execute_wrapper(), она учитывает и запросы из других
+    # потоков (sync_to_async), куда контекст запроса копируется asgiref
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+connection_created.connect(install_execute_wrapper)
+
+
+class ServerTimingMiddleware:
+    """
+    Ставится первым в MIDDLEWARE, чтобы замеры охватывали все остальные
+    промежуточные слои
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, "SERVER_TIMING_HEADER", settings.DEBUG)
+        self.threshold = getattr(settings, "SLOW_REQUEST_THRESHOLD_MS", SLOW_REQUEST_THRESHOLD_MS)
+        # соединения, открытые до загрузки middleware
+        for connection in connections.all(initialized_only=True):
+            install_execute_wrapper(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.process_metrics(request, response, metrics)
+
+    async def __acall__(self, request: HttpRequest):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.process_metrics(request, response, metrics)
+
+    def process_metrics(
+        self,
+        request: HttpRequest,
+        response: HttpResponseBase,
+        metrics: RequestMetrics,
+    ) -> HttpResponseBase:
+        elapsed = metrics.elapsed()
+        if self.header or request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS:
+            response["Server-Timing"] = metrics.server_timing(elapsed)
+        if self.threshold is not None and elapsed * 1000 >= self.threshold:
+            self.log_slow_request(request, response, metrics, elapsed)
+        return response
+
+    @staticmethod
+    def log_slow_request(
+        request: HttpRequest,
+        response: HttpResponseBase,
+        metrics: RequestMetrics,
+        elapsed: float,
+    ) -> None:
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "ms": round(elapsed * 1000, 1),
+            "db_ms": round(metrics.db_time * 1000, 1),
+            "queries": metrics.queries,
+            "cache_hits": metrics.cache_hits,
+            "cache_misses": metrics.cache_misses,
+            "top_queries": metrics.top_queries(),
+        }
+        log.warning(
+            "Slow request %s",
+            json.dumps(record, ensure_ascii=False),
+            extra={"slow_request": record},
+        )
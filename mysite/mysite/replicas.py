@@ -0,0 +1,187 @@
+"""
+Чтение с реплик БД для read-only страниц и API.
+
+Представления, которые только читают данные (каталог, фиды, выгрузки),
+отмечаются декоратором replica_reads. GET/HEAD-запросы к ним
+ReplicaRoutingMiddleware направляет на одну из реплик из
+settings.DATABASE_REPLICAS, все остальное идет в default.
+
+Реплика отстает от основной БД (не больше REPLICA_MAX_LAG секунд),
+поэтому после записи клиент видит свои изменения так: запись в запросе
+переключает на default все последующие чтения этого запроса, а cookie
+PRIMARY_COOKIE оставляет клиента на default еще REPLICA_MAX_LAG секунд.
+Прочитанное с реплики кешируется не дольше REPLICA_MAX_LAG
+(replica_cache_timeout), иначе устаревшая страница попала бы в кеш
+под новой версией данных надолго.
+
+Для локальной проверки реплики - копии файла SQLite, которые обновляет
+команда sync_replicas
+"""
+
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpRequest, HttpResponseBase
+
+# Cookie со временем, до которого клиент читает из основной БД
+PRIMARY_COOKIE = "primary_until"
+# Наибольшее отставание реплик и время "прилипания" к основной БД
+# после записи по умолчанию, секунды
+REPLICA_MAX_LAG = 30
+
+SAFE_METHODS = ("GET", "HEAD")
+
+
+class RoutingState:
+    __slots__ = ("replica", "wrote")
+
+    def __init__(self):
+        # реплика для чтения в этом запросе (None - основная БД)
+        self.replica: str | None = None
+        self.wrote = False
+
+
+_state: ContextVar[RoutingState | None] = ContextVar("db_routing", default=None)
+
+
+def current_replica() -> str | None:
+    """
+    Реплика, с которой читает текущий запрос
+    """
+    state = _state.get()
+    if state is None or state.wrote:
+        return None
+    return state.replica
+
+
+def replica_cache_timeout(timeout: float | None) -> float | None:
+    """
+    Срок кеширования данных, прочитанных в текущем запросе: прочитанное
+    с реплики может быть устаревшим, поэтому хранится не дольше ее отставания
+    """
+    if current_replica() is None:
+        return timeout
+    max_lag = getattr(settings, "REPLICA_MAX_LAG", REPLICA_MAX_LAG)
+    return max_lag if timeout is None else min(timeout, max_lag)
+
+
+def replica_reads(view):
+    """
+    Отмечает представление (функцию или класс), GET/HEAD-запросы к которому
+    можно обслуживать с реплики
+    """
+    if isinstance(view, type):
+        view.replica_reads = True
+        return view
+
+    if iscoroutinefunction(view):
+
+        async def wrapper(*args, **kwargs):
+            return await view(*args, **kwargs)
+
+    else:
+
+        def wrapper(*args, **kwargs):
+            return view(*args, **kwargs)
+
+    wrapper = wraps(view)(wrapper)
+    wrapper.replica_reads = True
+    return wrapper
+
+
+def is_replica_view(view) -> bool:
+    # as_view() представлений Django и DRF хранит класс в view_class/cls
+    return any(
+        getattr(candidate, "replica_reads", False)
+        for candidate in (view, getattr(view, "view_class", None), getattr(view, "cls", None))
+    )
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return current_replica()
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики - копии основной БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, "REPLICA_MAX_LAG", REPLICA_MAX_LAG)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState()
+        _state.set(state)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            _state.set(None)
+            raise
+        return self.process_state(response, state)
+
+    async def __acall__(self, request: HttpRequest):
+        state = RoutingState()
+        _state.set(state)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            _state.set(None)
+            raise
+        return self.process_state(response, state)
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        replicas = settings.DATABASE_REPLICAS
+        if (
+            replicas
+            and request.method in SAFE_METHODS
+            and is_replica_view(view_func)
+            and not self.is_sticky(request)
+        ):
+            _state.get().replica = random.choice(replicas)
+        return None
+
+    def is_sticky(self, request: HttpRequest) -> bool:
+        try:
+            return float(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def process_state(self, response: HttpResponseBase, state: RoutingState) -> HttpResponseBase:
+        if state.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PRIMARY_COOKIE,
+                str(int(time.time()) + self.sticky_seconds),
+                max_age=self.sticky_seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        if response.streaming:
+            # тело потокового ответа читается из БД уже после возврата
+            # из middleware: реплика сбрасывается при закрытии ответа
+            response._resource_closers.append(lambda: _state.set(None))
+        else:
+            _state.set(None)
+        return response
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 from pathlib import Path
 from os import getenv
 import logging.config
+import sys
 
 from django.urls import reverse_lazy
 
@@ -56,7 +57,6 @@ INSTALLED_APPS = [
     "rest_framework",
     "django_filters",
     "drf_spectacular",
-    "debug_toolbar",
     "crispy_forms",
     "crispy_bootstrap5",
     "shopapp.apps.ShopappConfig",
@@ -64,6 +64,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "mysite.instrumentation.ServerTimingMiddleware",
+    "mysite.compression.CompressionMiddleware",
+    "mysite.replicas.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -71,9 +74,27 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+# debug toolbar только для отладки: в рабочем режиме замеры
+# запросов дает ServerTimingMiddleware
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
+# Заголовок Server-Timing с замерами запроса (время, SQL, кеш). Замеры
+# раскрывают устройство сайта, поэтому в рабочем режиме по умолчанию
+# заголовок получают только запросы с INTERNAL_IPS
+SERVER_TIMING_HEADER = getenv("DJANGO_SERVER_TIMING", "1" if DEBUG else "0") == "1"
+# Запросы дольше порога (мс) пишутся в лог с самыми частыми SQL
+SLOW_REQUEST_THRESHOLD_MS = float(getenv("DJANGO_SLOW_REQUEST_MS", "500"))
+
+# Сжатие ответов (mysite.compression): уровни по кодировкам в порядке
+# предпочтения (br и zstd - если установлены brotli и zstandard)
+# и минимальный размер сжимаемого тела, байты
+COMPRESSION_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+COMPRESSION_MIN_LENGTH = 1024
+
 ROOT_URLCONF = "mysite.urls"
 
 TEMPLATES = [
@@ -92,13 +113,44 @@ TEMPLATES = [
     },
 ]
 
+# Кеш двухуровневый: LRU в памяти каждого воркера перед общим файловым кешем.
+# Счетчики версий (каталог, товары, выгрузки заказов) и метки файлов карты
+# сайта всегда читаются из общего уровня, чтобы инвалидация сразу была
+# видна всем воркерам
+TIERED_CACHE_OPTIONS = {
+    "SHARED_ALIAS": "shared",
+    "LOCAL_MAX_ENTRIES": int(getenv("DJANGO_CACHE_LOCAL_MAX_ENTRIES", "1000")),
+    "LOCAL_TIMEOUT": 5,
+    "LOCAL_EXCLUDE_PREFIXES": [
+        "catalog_version",
+        "product_version_",
+        "orders_export_version_",
+        "sitemap_",
+    ],
+}
+
 CACHES = {
     'default': {
+        'BACKEND': 'mysite.cache.TieredCache',
+        'OPTIONS': TIERED_CACHE_OPTIONS,
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': (BASE_DIR / 'cache'),
-    }
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
 
+# Тесты не должны видеть и изменять файловый кеш проекта
+# (версии каталога и заказов, закешированные страницы)
+TESTING = "test" in sys.argv[1:2]
+if TESTING:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+
 
 WSGI_APPLICATION = "mysite.wsgi.application"
 
@@ -118,13 +170,58 @@ if DEBUG:
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# Один файл SQLite на все воркеры gunicorn (см. mysite/sqlite_backend):
+# - WAL: читатели не ждут писателя, synchronous=NORMAL в режиме WAL
+#   не нарушает целостность БД при сбое;
+# - mmap и кеш страниц 64 МБ на соединение, временные таблицы в памяти;
+# - транзакции начинаются с BEGIN IMMEDIATE: блокировка записи берется
+#   сразу, с ожиданием timeout секунд (busy_timeout), а не при первой
+#   записи, где SQLite отвечает "database is locked" без ожидания;
+# - запросы вне транзакции повторяются при блокировке (LOCK_RETRIES)
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "mysite.sqlite_backend",
         "NAME": DATABASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            "timeout": float(getenv("DJANGO_SQLITE_BUSY_TIMEOUT", "5")),
+            "transaction_mode": "IMMEDIATE",
+            "init_command": "; ".join(
+                f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()
+            ),
+            "LOCK_RETRIES": 5,
+            "LOCK_RETRY_DELAY": 0.05,
+        },
     }
 }
 
+# Реплики только для чтения (см. mysite/replicas.py). Локально - копии
+# файла основной БД, которые обновляет команда sync_replicas
+DATABASE_REPLICAS = []
+for number in range(1, int(getenv("DJANGO_DATABASE_REPLICAS", "0")) + 1):
+    DATABASES[f"replica{number}"] = {
+        **DATABASES["default"],
+        "NAME": DATABASE_DIR / f"db.replica{number}.sqlite3",
+        "OPTIONS": {
+            **DATABASES["default"]["OPTIONS"],
+            "init_command": DATABASES["default"]["OPTIONS"]["init_command"] + "; PRAGMA query_only=1",
+        },
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{number}")
+
+DATABASE_ROUTERS = ["mysite.replicas.ReplicaRouter"]
+# Наибольшее отставание реплик (интервал sync_replicas), секунды: столько же
+# клиент после записи читает из основной БД
+REPLICA_MAX_LAG = int(getenv("DJANGO_REPLICA_MAX_LAG", "30"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -205,6 +302,16 @@ logging.config.dictConfig({
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
+    # orjson, если установлен (см. mysite/fastjson.py)
+    "DEFAULT_RENDERER_CLASSES": [
+        "mysite.fastjson.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "mysite.fastjson.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
     ],
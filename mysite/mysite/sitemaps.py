@@ -1,5 +0,0 @@
-from shopapp.sitemap import ShopSitemap
-
-sitemaps = {
-    'product': ShopSitemap,
-}
@@ -0,0 +1,92 @@
+"""
+Бэкенд SQLite для нескольких воркеров gunicorn с одним файлом БД.
+
+PRAGMA (WAL и пр.) и режим транзакций задаются стандартными опциями
+init_command и transaction_mode (см. DATABASES в settings). Бэкенд
+добавляет повтор запросов с растущей задержкой при "database is locked":
+если блокировка не освободилась за busy_timeout, запрос повторяется
+до LOCK_RETRIES раз.
+
+Повторяются только запросы вне открытой транзакции: отдельные запросы
+в режиме autocommit и сам BEGIN IMMEDIATE, с которого начинается
+transaction.atomic(). Внутри транзакции блокировка записи уже получена
+(BEGIN IMMEDIATE), а повтор отдельного запроса мог бы нарушить ее
+целостность
+
+    "OPTIONS": {
+        "timeout": 5,
+        "transaction_mode": "IMMEDIATE",
+        "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL",
+        "LOCK_RETRIES": 5,
+        "LOCK_RETRY_DELAY": 0.05,
+    }
+"""
+
+import logging
+import random
+import time
+
+from django.db.backends.sqlite3 import base
+
+log = logging.getLogger(__name__)
+
+# Повторов запроса после "database is locked" и начальная задержка, секунды
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.05
+# Задержка между повторами не больше, секунды
+LOCK_RETRY_MAX_DELAY = 2.0
+
+
+def is_lock_error(exc: Exception) -> bool:
+    message = str(exc)
+    return "database is locked" in message or "database is busy" in message
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    def __init__(self, connection, retries: int, delay: float):
+        super().__init__(connection)
+        self.retries = retries
+        self.delay = delay
+
+    def execute(self, query, params=None):
+        return self.retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        # генератор параметров не пережил бы повтор
+        return self.retry(super().executemany, query, list(param_list))
+
+    def retry(self, method, *args):
+        attempt = 0
+        while True:
+            try:
+                return method(*args)
+            except base.Database.OperationalError as exc:
+                if (
+                    attempt >= self.retries
+                    or self.connection.in_transaction
+                    or not is_lock_error(exc)
+                ):
+                    raise
+            # случайная задержка: воркеры не повторяют запрос одновременно
+            delay = min(LOCK_RETRY_MAX_DELAY, self.delay * 2**attempt)
+            attempt += 1
+            log.debug("Database is locked, retry %s in %.3fs", attempt, delay)
+            time.sleep(random.uniform(delay / 2, delay))
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    lock_retries = LOCK_RETRIES
+    lock_retry_delay = LOCK_RETRY_DELAY
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.lock_retries = int(kwargs.pop("LOCK_RETRIES", LOCK_RETRIES))
+        self.lock_retry_delay = float(kwargs.pop("LOCK_RETRY_DELAY", LOCK_RETRY_DELAY))
+        return kwargs
+
+    def create_cursor(self, name=None):
+        return self.connection.cursor(
+            factory=lambda connection: SQLiteCursorWrapper(
+                connection, self.lock_retries, self.lock_retry_delay
+            )
+        )
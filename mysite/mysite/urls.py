@@ -17,7 +17,6 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
 from django.urls import path, include
 from django.views.generic.base import TemplateView
 from drf_spectacular.views import (
@@ -29,18 +28,21 @@ from shopapp.views import (
     ProductViewSet,
     OrderViewSet,
 )
-from .sitemaps import sitemaps
+from .views import cache_stats_view, compression_stats_view, sitemap_index_view, sitemap_shard_view
 
 router = DefaultRouter()
 router.register("products", ProductViewSet)
 router.register("orders", OrderViewSet)
 
 urlpatterns = [
+    path("admin/cache-stats/", cache_stats_view, name="cache_stats"),
+    path("admin/compression-stats/", compression_stats_view, name="compression_stats"),
     path("admin/", admin.site.urls),
     path("shop/", include("shopapp.urls")),
     path("myauth/", include("myauth.urls")),
 
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    path('sitemap.xml', sitemap_index_view, name='sitemap'),
+    path('sitemap-products-<int:shard>.xml', sitemap_shard_view, name='sitemap_shard'),
 
     path("", TemplateView.as_view(template_name="home.html"), name="home"),
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
@@ -0,0 +1,46 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.sitemaps.views import x_robots_tag
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpRequest, JsonResponse
+
+from shopapp.sitemap import sitemap_file
+
+from .compression import compression_levels, compression_stats
+
+
+@staff_member_required
+def cache_stats_view(request: HttpRequest) -> JsonResponse:
+    # Счетчики кеша воркера, обработавшего запрос
+    stats = cache.stats() if hasattr(cache, "stats") else {}
+    return JsonResponse({"cache": stats})
+
+
+@staff_member_required
+def compression_stats_view(request: HttpRequest) -> JsonResponse:
+    # Итоги сжатия ответов воркера, обработавшего запрос
+    return JsonResponse({"compression": compression_stats.snapshot(compression_levels())})
+
+
+def sitemap_response(request: HttpRequest, shard: int | None) -> FileResponse:
+    protocol, domain = request.scheme, request.get_host()
+    name = sitemap_file(shard, protocol, domain)
+    if name is None:
+        raise Http404("No such sitemap")
+    try:
+        file = default_storage.open(name, "rb")
+    except FileNotFoundError:
+        # файл удален после смены метки: строится по новой метке
+        file = default_storage.open(sitemap_file(shard, protocol, domain), "rb")
+    return FileResponse(file, content_type="application/xml")
+
+
+@x_robots_tag
+def sitemap_index_view(request: HttpRequest) -> FileResponse:
+    # Индекс карты сайта: ссылки на шарды (см. shopapp.sitemap)
+    return sitemap_response(request, None)
+
+
+@x_robots_tag
+def sitemap_shard_view(request: HttpRequest, shard: int) -> FileResponse:
+    return sitemap_response(request, shard)
@@ -1,13 +1,18 @@
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
 from django.db.models import QuerySet
-from django.http import HttpRequest, HttpResponse
-from django.shortcuts import render, redirect
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import path
+from django.utils import timezone
 
-from .common import save_csv_products, save_csv_order
-from .models import Product, Order, ProductImage
+from .jobs import enqueue
+from .models import Product, Order, ProductImage, Job
+from .page_cache import bump_products_versions
+from .sitemap import invalidate_sitemap_shards
+from .totals import recalculate_order_totals
 from .admin_mixins import ExportAsCSVMixin
-from .forms import CSVImportForm
+from .forms import CSVImportForm, ProductCSVImportForm
 
 
 class OrderInline(admin.TabularInline):
@@ -22,14 +27,33 @@ class ProductInline(admin.StackedInline):
 def mark_archived(
         modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet
 ):
-    queryset.update(archived=True)
+    queryset.update(archived=True, updated_at=timezone.now())
+    # update() не отправляет сигналы, кеш страниц и карту сайта сбрасываем явно
+    pks = list(queryset.values_list("pk", flat=True))
+    bump_products_versions(pks)
+    invalidate_sitemap_shards(pks)
 
 
 @admin.action(description="Unarchive products")
 def mark_unarchived(
         modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet
 ):
-    queryset.update(archived=False)
+    queryset.update(archived=False, updated_at=timezone.now())
+    pks = list(queryset.values_list("pk", flat=True))
+    bump_products_versions(pks)
+    invalidate_sitemap_shards(pks)
+
+
+@admin.action(description="Export to CSV in background")
+def export_csv_background(
+        modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet
+):
+    job = enqueue(
+        "export_products_csv",
+        params={"pks": list(queryset.values_list("pk", flat=True))},
+        user=request.user,
+    )
+    return redirect("admin:shopapp_job_progress", job.pk)
 
 
 @admin.register(Product)
@@ -39,6 +63,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         mark_archived,
         mark_unarchived,
         "export_csv",
+        export_csv_background,
     ]
     inlines = [
         OrderInline,
@@ -53,7 +78,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         (
             None,
             {
-                "fields": ("name", "description"),
+                "fields": ("name", "sku", "description"),
             },
         ),
         (
@@ -79,6 +104,13 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         ),
     ]
 
+    def save_related(self, request, form, formsets, change):
+        # OrderInline меняет связи напрямую, без m2m_changed
+        order_pks = set(form.instance.orders.values_list("pk", flat=True)) if change else set()
+        super().save_related(request, form, formsets, change)
+        order_pks.update(form.instance.orders.values_list("pk", flat=True))
+        recalculate_order_totals(order_pks)
+
     def description_short(self, obj: Product) -> str:
         if len(obj.description) < 48:
             return obj.description
@@ -86,25 +118,29 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 
     def import_csv(self, request: HttpRequest) -> HttpResponse:
         if request.method == "GET":
-            form = CSVImportForm()
+            form = ProductCSVImportForm()
             context = {
                 "form": form,
             }
             return render(request, "admin/csv_form.html", context)
-        form = CSVImportForm(request.POST, request.FILES)
+        form = ProductCSVImportForm(request.POST, request.FILES)
         if not form.is_valid():
             context = {
                 "form": form,
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        save_csv_products(
-            file=form.files["csv_file"].file,
-            encoding=request.encoding,
+        job = enqueue(
+            "import_products_csv",
+            params={
+                "encoding": request.encoding or "utf-8",
+                "upsert": form.cleaned_data["upsert"],
+            },
+            file=form.files["csv_file"],
+            user=request.user,
         )
-
-        self.message_user(request, "Data from CSV was imported")
-        return redirect("..")
+        self.message_user(request, f"Products import queued as job #{job.pk}")
+        return redirect("admin:shopapp_job_progress", job.pk)
 
     def get_urls(self):
         urls = super().get_urls()
@@ -124,11 +160,23 @@ class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     inlines = [
         ProductInline,
     ]
-    list_display = "delivery_address", "promocode", "created_at", "user_verbose"
+    list_display = (
+        "delivery_address",
+        "promocode",
+        "created_at",
+        "user_verbose",
+        "total_price",
+        "item_count",
+    )
 
     def get_queryset(self, request):
         return Order.objects.select_related("user").prefetch_related("products")
 
+    def save_related(self, request, form, formsets, change):
+        # ProductInline меняет связи напрямую, без m2m_changed
+        super().save_related(request, form, formsets, change)
+        recalculate_order_totals([form.instance.pk])
+
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
 
@@ -146,13 +194,14 @@ class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        save_csv_order(
-            file=form.files["csv_file"].file,
-            encoding=request.encoding,
+        job = enqueue(
+            "import_orders_csv",
+            params={"encoding": request.encoding or "utf-8"},
+            file=form.files["csv_file"],
+            user=request.user,
         )
-
-        self.message_user(request, "Data from CSV was imported")
-        return redirect("..")
+        self.message_user(request, f"Orders import queued as job #{job.pk}")
+        return redirect("admin:shopapp_job_progress", job.pk)
 
     def get_urls(self):
         urls = super().get_urls()
@@ -160,3 +209,71 @@ class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             path("import-orders-csv/", self.import_csv, name="import_orders_csv"),
         ]
         return new_urls + urls
+
+
+@admin.action(description="Retry failed jobs")
+def retry_jobs(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
+    # обработанные строки не сбрасываются: импорт продолжится с места сбоя
+    queryset.filter(status=Job.Status.FAILED).update(
+        status=Job.Status.QUEUED,
+        attempts=0,
+        error="",
+        run_after=timezone.now(),
+        finished_at=None,
+    )
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    actions = [retry_jobs]
+    list_display = (
+        "pk",
+        "kind",
+        "status",
+        "progress",
+        "attempts",
+        "created_by",
+        "created_at",
+        "finished_at",
+    )
+    list_display_links = "pk", "kind"
+    list_filter = "status", "kind"
+    readonly_fields = [field.name for field in Job._meta.fields]
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        return False
+
+    def get_job(self, request: HttpRequest, object_id: int) -> Job:
+        job = get_object_or_404(Job, pk=object_id)
+        if not self.has_view_permission(request, job):
+            raise PermissionDenied
+        return job
+
+    def progress_view(self, request: HttpRequest, object_id: int) -> HttpResponse:
+        job = self.get_job(request, object_id)
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": f"Job #{job.pk}: {job.kind}",
+            "job": job,
+        }
+        return render(request, "admin/job_progress.html", context)
+
+    def status_view(self, request: HttpRequest, object_id: int) -> JsonResponse:
+        return JsonResponse(self.get_job(request, object_id).as_status())
+
+    def get_urls(self):
+        urls = super().get_urls()
+        new_urls = [
+            path(
+                "<int:object_id>/progress/",
+                self.admin_site.admin_view(self.progress_view),
+                name="shopapp_job_progress",
+            ),
+            path(
+                "<int:object_id>/status/",
+                self.admin_site.admin_view(self.status_view),
+                name="shopapp_job_status",
+            ),
+        ]
+        return new_urls + urls
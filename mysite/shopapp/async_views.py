@@ -0,0 +1,114 @@
+"""
+Асинхронные варианты read-only страниц каталога для запуска под ASGI
+(gunicorn с воркером uvicorn). Данные загружаются асинхронным ORM целиком
+до рендеринга шаблона, чтобы шаблон не обращался к БД синхронно
+"""
+
+import logging
+from typing import AsyncIterator
+
+from django.http import Http404, HttpRequest, HttpResponse, StreamingHttpResponse
+from django.shortcuts import render
+
+from mysite.fastjson import dumps
+from mysite.replicas import replica_reads
+
+from .conditional import aqueryset_validators, conditional_response, set_validators
+from .models import Product
+from .search import search_products
+from .views import LatestProductsFeed
+
+log = logging.getLogger(__name__)
+
+# Количество товаров, которое забирается из БД за один раз при выгрузке
+EXPORT_CHUNK_SIZE = 2000
+
+
+@replica_reads
+async def products_list_async(request: HttpRequest) -> HttpResponse:
+    log.info("Show products list (only not archived, async)")
+    queryset = Product.objects.filter(archived=False)
+    query = request.GET.get("q", "").strip()
+    if query:
+        queryset = search_products(queryset, query)
+
+    etag, last_modified = await aqueryset_validators(queryset, request.get_full_path())
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    products = [product async for product in queryset]
+    response = render(
+        request,
+        "shopapp/products-list.html",
+        context={"products": products, "query": query},
+    )
+    return set_validators(response, etag, last_modified)
+
+
+@replica_reads
+async def product_details_async(request: HttpRequest, pk: int) -> HttpResponse:
+    queryset = Product.objects.filter(pk=pk)
+    etag, last_modified = await aqueryset_validators(queryset)
+    if last_modified is None:
+        raise Http404("No product found matching the query")
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    product = await queryset.prefetch_related("images").aget()
+    log.info("Show details of %s (async)", product.name)
+    response = render(
+        request,
+        "shopapp/products-details.html",
+        context={"product": product, "object": product},
+    )
+    return set_validators(response, etag, last_modified)
+
+
+async def iter_products_json() -> AsyncIterator[bytes]:
+    """
+    JSON выгрузки товаров в формате ProductsDataExportView, частями
+    """
+    yield b'{"products":['
+    fields = ("pk", "name", "price", "archived")
+    queryset = Product.objects.order_by("pk").values(*fields)
+    first = True
+    async for row in queryset.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        chunk = dumps(row)
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]}"
+
+
+@replica_reads
+async def products_export_async(request: HttpRequest) -> StreamingHttpResponse:
+    return StreamingHttpResponse(iter_products_json(), content_type="application/json")
+
+
+class PrefetchedProductsFeed(LatestProductsFeed):
+    """
+    Лента с заранее загруженными товарами: генерация XML не обращается к БД
+    """
+
+    def __init__(self, items: list[Product]):
+        super().__init__()
+        self._items = items
+
+    def items(self):
+        return self._items
+
+
+@replica_reads
+async def latest_products_feed_async(request: HttpRequest) -> HttpResponse:
+    queryset = LatestProductsFeed().items()
+    etag, last_modified = await aqueryset_validators(queryset)
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    items = [product async for product in queryset]
+    feed = PrefetchedProductsFeed(items)
+    # Feed.__call__ без проверки валидаторов (уже выполнена выше)
+    response = super(LatestProductsFeed, feed).__call__(request)
+    return set_validators(response, etag, last_modified)
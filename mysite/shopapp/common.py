@@ -1,43 +1,369 @@
-from csv import DictReader
+import logging
+from csv import DictReader, writer
+from dataclasses import dataclass, field
+from functools import partial
 from io import TextIOWrapper
+from itertools import islice
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, Sequence
 
 from django.contrib.auth.models import User
-from django.db import transaction
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 
+from .exports import bump_orders_export_version
 from .models import Product, Order
+from .page_cache import bump_catalog_version, bump_products_versions
+from .search import index_products
+from .sitemap import invalidate_sitemap_shards
+from .totals import products_totals, recalculate_order_totals
 
+log = logging.getLogger(__name__)
 
-def save_csv_products(file, encoding):
+# Количество строк, которое забирается из курсора БД за один раз
+CSV_EXPORT_CHUNK_SIZE = 2000
+# Количество строк CSV, которое импортируется одной пачкой
+CSV_IMPORT_BATCH_SIZE = 500
+# Колонки CSV, которые переносятся в товар
+PRODUCT_CSV_FIELDS = ("name", "sku", "description", "price", "discount", "archived")
+
+
+@dataclass
+class CSVImportReport:
+    """
+    Итог импорта CSV: количество созданных и обновленных (upsert) записей
+    и ошибки по строкам (номер строки файла с учетом заголовка, текст ошибки)
+    """
+
+    created: int = 0
+    updated: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)
+    # (количество строк, секунды) по каждой пачке
+    batches: list[tuple[int, float]] = field(default_factory=list)
+
+    def add_error(self, line: int, message: str) -> None:
+        self.errors.append((line, message))
+
+    def add_batch(self, rows: int, seconds: float) -> None:
+        self.batches.append((rows, seconds))
+
+    @property
+    def rows_per_second(self) -> float:
+        seconds = sum(elapsed for _, elapsed in self.batches)
+        return self.processed / seconds if seconds else 0.0
+
+    @property
+    def processed(self) -> int:
+        return sum(count for count, _ in self.batches)
+
+    def as_dict(self) -> dict:
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "errors": [{"line": line, "error": error} for line, error in self.errors],
+            "batches": len(self.batches),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+class Echo:
+    """
+    Псевдо-буфер для csv.writer: вместо записи возвращает строку,
+    чтобы её можно было сразу отдать в StreamingHttpResponse
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_csv_rows(
+    queryset,
+    fields: Sequence[str],
+    chunk_size: int = CSV_EXPORT_CHUNK_SIZE,
+) -> Iterator[str]:
+    """
+    Построчно формирует CSV по queryset.
+    Строки забираются из БД кортежами порциями по chunk_size,
+    поэтому потребление памяти не зависит от размера выборки
+    """
+    csv_writer = writer(Echo())
+    yield csv_writer.writerow(fields)
+    rows: Iterable[tuple] = queryset.values_list(*fields).iterator(
+        chunk_size=chunk_size
+    )
+    for row in rows:
+        yield csv_writer.writerow(row)
+
+
+def save_csv_products(
+    file,
+    encoding,
+    batch_size: int = CSV_IMPORT_BATCH_SIZE,
+    upsert: bool = False,
+    on_batch: Callable[[CSVImportReport], None] | None = None,
+    skip_rows: int = 0,
+) -> CSVImportReport:
+    """
+    Потоковый импорт товаров из CSV пачками по batch_size строк.
+    Каждая строка проверяется отдельно, ошибочные попадают в отчет.
+    При upsert=True существующие товары обновляются по артикулу (sku).
+    on_batch вызывается после каждой пачки (прогресс фоновой задачи),
+    первые skip_rows строк данных пропускаются (продолжение импорта)
+    """
     csv_file = TextIOWrapper(
         file,
         encoding,
     )
     reader = DictReader(csv_file)
-    products = [Product(**row) for row in reader]
-    Product.objects.bulk_create(products)
-    return products
+    fields = [name for name in reader.fieldnames or [] if name in PRODUCT_CSV_FIELDS]
+    if upsert and "sku" not in fields:
+        raise ValueError("Upsert requires the 'sku' column")
+
+    report = CSVImportReport()
+    rows = islice(enumerate(reader, start=2), skip_rows, None)
+    for batch in iter_batches(rows, batch_size):
+        started = perf_counter()
+        products: dict[int, Product] = {}
+        for line, row in batch:
+            product = _build_product(row, fields, line, report)
+            if product is not None:
+                products[line] = product
+
+        if upsert:
+            updated_pks = _upsert_products(products, fields, report)
+            # обновленные товары могли уже быть в кеше страниц и в заказах
+            bump_products_versions(updated_pks)
+            affected_orders = Order.objects.filter(products__in=updated_pks)
+            recalculate_order_totals(affected_orders.values_list("pk", flat=True).distinct())
+        else:
+            _insert_products(products, report)
+            report.created += len(products)
+            bump_catalog_version()
+        # bulk_create не отправляет post_save, индекс поиска
+        # и карту сайта обновляем явно
+        index_products(products.values())
+        invalidate_sitemap_shards(product.pk for product in products.values())
+
+        report.add_batch(len(batch), perf_counter() - started)
+        log.info(
+            "Products CSV batch: %s rows, %.0f rows/s",
+            len(batch),
+            report.batches[-1][0] / max(report.batches[-1][1], 1e-9),
+        )
+        if on_batch is not None:
+            on_batch(report)
+
+    return report
+
+
+def _insert_products(products: dict[int, Product], report: CSVImportReport) -> None:
+    try:
+        with transaction.atomic():
+            Product.objects.bulk_create(products.values())
+    except IntegrityError:
+        # Конфликт в пачке (например, повторный артикул): вставляем построчно,
+        # чтобы отсечь только ошибочные строки
+        for line, product in list(products.items()):
+            try:
+                with transaction.atomic():
+                    product.save(force_insert=True)
+            except IntegrityError as exc:
+                report.add_error(line, str(exc))
+                del products[line]
+
+
+def _upsert_products(products: dict[int, Product], fields: list[str], report: CSVImportReport) -> list[int]:
+    """
+    Создает или обновляет товары пачки по артикулу. Строки без артикула
+    и повторы артикула внутри пачки попадают в отчет.
+    Возвращает pk обновленных товаров
+    """
+    first_lines: dict[str, int] = {}
+    for line, product in list(products.items()):
+        if not product.sku:
+            report.add_error(line, "sku: This field is required for upsert.")
+            del products[line]
+        elif product.sku in first_lines:
+            report.add_error(line, f"sku: Duplicate of line {first_lines[product.sku]}.")
+            del products[line]
+        else:
+            first_lines[product.sku] = line
+    if not products:
+        return []
 
+    existing = dict(Product.objects.filter(sku__in=first_lines).values_list("sku", "pk"))
+    upsert = partial(
+        Product.objects.bulk_create,
+        update_conflicts=True,
+        unique_fields=["sku"],
+        update_fields=[name for name in fields if name != "sku"] + ["updated_at"],
+    )
+    try:
+        with transaction.atomic():
+            upsert(products.values())
+    except IntegrityError:
+        # как в _insert_products: построчно, чтобы отсечь только ошибочные строки
+        for line, product in list(products.items()):
+            try:
+                with transaction.atomic():
+                    upsert([product])
+            except IntegrityError as exc:
+                report.add_error(line, str(exc))
+                del products[line]
+
+    updated_pks = [existing[product.sku] for product in products.values() if product.sku in existing]
+    report.updated += len(updated_pks)
+    report.created += len(products) - len(updated_pks)
+    return updated_pks
+
+
+def _build_product(row: dict, fields: list[str], line: int, report: CSVImportReport):
+    values = {name: row[name] for name in fields if row[name] not in ("", None)}
+    for name in ("name", "description"):
+        values.setdefault(name, "")
+    product = Product(**values)
+    try:
+        product.clean_fields(exclude=["preview"])
+    except ValidationError as exc:
+        report.add_error(line, _validation_message(exc))
+        return None
+    return product
+
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(f"{name}: {' '.join(errors)}" for name, errors in exc.message_dict.items())
 
-def save_csv_order(file, encoding):
+
+def iter_batches(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def save_csv_order(
+    file,
+    encoding,
+    batch_size: int = CSV_IMPORT_BATCH_SIZE,
+    on_batch: Callable[[CSVImportReport], None] | None = None,
+    skip_rows: int = 0,
+) -> CSVImportReport:
+    """
+    Импорт заказов из CSV (delivery_address, promocode, user, products).
+    Строки обрабатываются пачками: пользователи и товары пачки загружаются
+    парой запросов, заказы и связи с товарами создаются через bulk_create.
+    Ошибочные строки пропускаются и попадают в отчет.
+    on_batch и skip_rows - как в save_csv_products
+    """
     csv_file = TextIOWrapper(
         file,
         encoding,
     )
     reader = DictReader(csv_file)
-    orders: list[Order] = list()
+    report = CSVImportReport()
+    # Первая строка файла - заголовок
+    rows = islice(enumerate(reader, start=2), skip_rows, None)
+
+    for batch in iter_batches(rows, batch_size):
+        started = perf_counter()
+        report.created += _save_orders_batch(batch, report)
+        report.add_batch(len(batch), perf_counter() - started)
+        if on_batch is not None:
+            on_batch(report)
+
+    return report
+
 
-    for row in reader:
+def _save_orders_batch(batch: list[tuple[int, dict]], report: CSVImportReport) -> int:
+    usernames = {row.get("user") for _, row in batch}
+    product_pks: set[int] = set()
+    parsed: list[tuple[int, dict, list[int]]] = []
+    for line, row in batch:
+        try:
+            pks = [int(pk) for pk in (row.get("products") or "").split(",") if pk.strip()]
+        except ValueError:
+            report.add_error(line, f"invalid product list {row.get('products')!r}")
+            continue
+        product_pks.update(pks)
+        parsed.append((line, row, pks))
+
+    users = dict(
+        User.objects.filter(username__in=usernames).values_list("username", "pk")
+    )
+    # pk -> (цена, скидка) для итогов заказа
+    existing_products = {
+        pk: (price, discount)
+        for pk, price, discount in Product.objects.filter(pk__in=product_pks).values_list(
+            "pk", "price", "discount"
+        )
+    }
+
+    # номер строки -> (заказ, pk товаров)
+    orders: dict[int, tuple[Order, list[int]]] = {}
+    for line, row, pks in parsed:
+        user_id = users.get(row.get("user"))
+        if user_id is None:
+            report.add_error(line, f"user {row.get('user')!r} does not exist")
+            continue
+        missing = [pk for pk in pks if pk not in existing_products]
+        if missing:
+            report.add_error(line, f"products {missing} do not exist")
+            continue
+        # дубликаты товара в строке не нарушают уникальность связи
+        pks = list(dict.fromkeys(pks))
+        total_price, total_discount, item_count = products_totals(
+            existing_products[pk] for pk in pks
+        )
+        order = Order(
+            delivery_address=row.get("delivery_address"),
+            promocode=row.get("promocode") or "",
+            user_id=user_id,
+            total_price=total_price,
+            total_discount=total_discount,
+            item_count=item_count,
+        )
+        try:
+            # чек к заказу прикладывается отдельно, в CSV его нет
+            order.clean_fields(exclude=["user", "products", "receipt"])
+        except ValidationError as exc:
+            report.add_error(line, _validation_message(exc))
+            continue
+        orders[line] = (order, pks)
+
+    if not orders:
+        return 0
+
+    _insert_orders(orders, report)
+
+    # bulk_create не отправляет сигналы, поэтому кеш выгрузок сбрасываем явно
+    for user_id in {order.user_id for order, _ in orders.values()}:
+        bump_orders_export_version(user_id)
+
+    return len(orders)
+
+
+def _insert_orders(orders: dict[int, tuple[Order, list[int]]], report: CSVImportReport) -> None:
+    try:
         with transaction.atomic():
-            order: Order = Order(
-                delivery_address=row["delivery_address"],
-                promocode=row["promocode"],
-                user=User.objects.get(username=row["user"]),
-            )
-            order.save()
-            for pk_product in row["products"].split(","):
-                product: Product = Product.objects.get(pk=pk_product)
-                order.products.add(product)
-
-            orders.append(order)
-
-    return orders
\ No newline at end of file
+            _bulk_create_orders(orders.values())
+    except IntegrityError:
+        # как в _insert_products: построчно, чтобы отсечь только ошибочные строки
+        for line, (order, pks) in list(orders.items()):
+            # pk из откаченной вставки пачки
+            order.pk = None
+            try:
+                with transaction.atomic():
+                    _bulk_create_orders([(order, pks)])
+            except IntegrityError as exc:
+                report.add_error(line, str(exc))
+                del orders[line]
+
+
+def _bulk_create_orders(orders: Iterable[tuple[Order, list[int]]]) -> None:
+    orders = list(orders)
+    Order.objects.bulk_create(order for order, _ in orders)
+    through = Order.products.through
+    through.objects.bulk_create(
+        through(order_id=order.pk, product_id=pk)
+        for order, pks in orders
+        for pk in pks
+    )
@@ -0,0 +1,154 @@
+from datetime import datetime
+from hashlib import md5
+
+from django.db.models import Count, Max, QuerySet
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+# Меняется при изменении формата ответов, чтобы старые ETag стали недействительны
+REPRESENTATION_VERSION = "1"
+
+
+def make_etag(*parts) -> str:
+    raw = ":".join(str(part) for part in (REPRESENTATION_VERSION, *parts))
+    return quote_etag(md5(raw.encode()).hexdigest())
+
+
+def queryset_validators(queryset: QuerySet, *extra) -> tuple[str, datetime | None]:
+    """
+    ETag и Last-Modified для выборки одним агрегирующим запросом:
+    время последнего изменения и количество записей (учитывает удаления)
+    """
+    if not queryset.query.is_sliced:
+        queryset = queryset.order_by()
+    state = queryset.aggregate(last=Max("updated_at"), count=Count("pk"))
+    return _validators(queryset, state, extra)
+
+
+async def aqueryset_validators(queryset: QuerySet, *extra) -> tuple[str, datetime | None]:
+    """
+    Асинхронный вариант queryset_validators
+    """
+    if not queryset.query.is_sliced:
+        queryset = queryset.order_by()
+    state = await queryset.aaggregate(last=Max("updated_at"), count=Count("pk"))
+    return _validators(queryset, state, extra)
+
+
+def page_validators(queryset: QuerySet, *extra) -> str:
+    """
+    ETag страницы keyset-пагинации по pk и updated_at ее строк: запрос
+    ограничен размером страницы, агрегат по всей выборке не нужен.
+    Last-Modified не отдается: строка, выбывшая со страницы, может
+    уменьшить максимум updated_at, и If-Modified-Since дал бы ложный 304
+    """
+    rows = list(queryset.values_list("pk", "updated_at"))
+    last_modified = max((updated_at for _, updated_at in rows), default=None)
+    return make_etag(
+        queryset.model._meta.label,
+        ",".join(str(pk) for pk, _ in rows),
+        last_modified.isoformat() if last_modified else "",
+        *extra,
+    )
+
+
+def _validators(queryset: QuerySet, state: dict, extra) -> tuple[str, datetime | None]:
+    last_modified = state["last"]
+    etag = make_etag(
+        queryset.model._meta.label,
+        state["count"],
+        last_modified.isoformat() if last_modified else "",
+        *extra,
+    )
+    return etag, last_modified
+
+
+def conditional_response(
+    request: HttpRequest,
+    etag: str | None,
+    last_modified: datetime | None,
+    response: HttpResponse | None = None,
+) -> HttpResponse | None:
+    """
+    Ответ 304/412, если клиент прислал подходящие If-None-Match/If-Modified-Since,
+    иначе response
+    """
+    return get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+        response=response,
+    )
+
+
+def set_validators(response, etag: str | None, last_modified: datetime | None):
+    if etag and not response.has_header("ETag"):
+        response["ETag"] = etag
+    if last_modified and not response.has_header("Last-Modified"):
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Условный GET для list/retrieve ModelViewSet: валидаторы считаются
+    агрегирующим запросом до сериализации, при совпадении отдается 304.
+    Страницы ?cursor= (KeysetPagination) проверяются по самой странице
+    после выборки: агрегат по всей выборке вернул бы O(N) на каждую страницу
+    """
+
+    # параметры, с которыми ответ зависит не только от updated_at выборки
+    # (?expand= - данные связанных моделей): условный GET не применяется
+    unconditional_params = ("expand",)
+
+    def is_conditional(self, request) -> bool:
+        return not any(request.GET.get(name) for name in self.unconditional_params)
+
+    def is_keyset_request(self, request) -> bool:
+        is_keyset_request = getattr(self.paginator, "is_keyset_request", None)
+        return is_keyset_request is not None and is_keyset_request(request)
+
+    def get_list_validators(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        return queryset_validators(
+            queryset,
+            request.get_full_path(),
+            request.META.get("HTTP_ACCEPT", ""),
+        )
+
+    def get_object_validators(self, request):
+        lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        return queryset_validators(
+            self.get_queryset().filter(**lookup),
+            request.get_full_path(),
+            request.META.get("HTTP_ACCEPT", ""),
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_conditional(request):
+            return super().list(request, *args, **kwargs)
+        if self.is_keyset_request(request):
+            response = super().list(request, *args, **kwargs)
+            page_queryset = getattr(self.paginator, "page_queryset", None)
+            if page_queryset is None:
+                return response
+            etag = page_validators(page_queryset, request.get_full_path(), request.META.get("HTTP_ACCEPT", ""))
+            return conditional_response(request, etag, None, set_validators(response, etag, None))
+        etag, last_modified = self.get_list_validators(request)
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        response = super().list(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.is_conditional(request):
+            return super().retrieve(request, *args, **kwargs)
+        etag, last_modified = self.get_object_validators(request)
+        if last_modified is not None:
+            not_modified = conditional_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+        response = super().retrieve(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
@@ -0,0 +1,139 @@
+"""
+Форма ответа API: ?fields= и ?expand=.
+
+?fields=pk,name оставляет в ответе только перечисленные поля,
+?expand=products,user заменяет pk связанных объектов вложенными
+объектами (сериализаторы из Meta.expandable). По сериализатору с
+выбранной формой plan_queryset строит select_related, prefetch_related
+и only(): связи "к одному" читаются тем же запросом, связи "ко многим" -
+одним запросом на страницу, из БД читаются только нужные столбцы.
+Количество запросов не зависит от размера страницы
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable
+
+from django.db.models import Model, Prefetch, QuerySet
+from rest_framework import serializers
+
+
+class ExpandableModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer с выбором полей (fields) и раскрытием связей (expand).
+    Meta.expandable: поле -> класс сериализатора связанной модели
+    """
+
+    def __init__(self, *args, fields: Iterable[str] | None = None, expand: Iterable[str] = (), **kwargs):
+        self.requested_fields = None if fields is None else set(fields)
+        self.expand = tuple(expand)
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.requested_fields is not None:
+            fields = {name: field for name, field in fields.items() if name in self.requested_fields}
+        opts = self.Meta.model._meta
+        for name in self.expand:
+            model_field = opts.get_field(name)
+            fields[name] = self.Meta.expandable[name](
+                many=model_field.many_to_many or model_field.one_to_many,
+                read_only=True,
+            )
+        return fields
+
+
+@lru_cache
+def field_names(serializer_class: type[serializers.Serializer]) -> tuple[str, ...]:
+    return tuple(name for name, field in serializer_class().fields.items() if not field.write_only)
+
+
+@dataclass(frozen=True)
+class Shape:
+    """
+    Форма ответа: fields=None - все поля сериализатора
+    """
+
+    fields: tuple[str, ...] | None = None
+    expand: tuple[str, ...] = ()
+
+    @property
+    def serializer_kwargs(self) -> dict:
+        return {"fields": self.fields, "expand": self.expand}
+
+
+def parse_shape(query_params, serializer_class: type[serializers.Serializer]) -> Shape:
+    """
+    Форма ответа из параметров запроса; неизвестные поля - ошибка 400
+    """
+    if not issubclass(serializer_class, ExpandableModelSerializer):
+        return Shape()
+    expandable = getattr(serializer_class.Meta, "expandable", {})
+    expand = _split(query_params.get("expand", ""))
+    unknown = [name for name in expand if name not in expandable]
+    if unknown:
+        raise serializers.ValidationError({"expand": [f"Unknown relations: {', '.join(unknown)}"]})
+
+    fields = _split(query_params.get("fields", ""))
+    if not fields:
+        return Shape(expand=expand)
+    known = field_names(serializer_class)
+    unknown = [name for name in fields if name not in known and name not in expandable]
+    if unknown:
+        raise serializers.ValidationError({"fields": [f"Unknown fields: {', '.join(unknown)}"]})
+    # раскрываемая связь выводится, даже если ее нет в fields
+    return Shape(fields=tuple(sorted(set(fields) | set(expand))), expand=expand)
+
+
+def _split(value: str) -> tuple[str, ...]:
+    return tuple(dict.fromkeys(name for name in (part.strip() for part in value.split(",")) if name))
+
+
+def plan_queryset(queryset: QuerySet, serializer: serializers.BaseSerializer, extra: Iterable[str] = ()) -> QuerySet:
+    """
+    select_related/prefetch_related/only() под поля serializer.
+    extra - дополнительные поля модели (например, поля сортировки для
+    курсора пагинации), которые тоже нужно прочитать
+    """
+    only, select_related, prefetch = _plan(queryset.model, serializer)
+    concrete = {field.name for field in queryset.model._meta.concrete_fields}
+    only += [name for name in extra if name in concrete]
+    return queryset.select_related(*select_related).prefetch_related(*prefetch).only(*only)
+
+
+def _plan(model: type[Model], serializer: serializers.BaseSerializer, prefix: str = "") -> tuple[list, list, list]:
+    # источники полей ModelSerializer - поля модели
+    serializer = getattr(serializer, "child", serializer)
+    opts = model._meta
+    only, select_related, prefetch = [prefix + opts.pk.name], [], []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == "pk":
+            continue
+        model_field = opts.get_field(field.source)
+        lookup = prefix + field.source
+        if isinstance(field, serializers.BaseSerializer):
+            if model_field.many_to_many or model_field.one_to_many:
+                related_only, related_select, related_prefetch = _plan(model_field.related_model, field)
+                if model_field.one_to_many:
+                    # внешний ключ, по которому объекты раскладываются по родителям
+                    related_only.append(model_field.field.name)
+                related = (
+                    model_field.related_model._default_manager.select_related(*related_select)
+                    .prefetch_related(*related_prefetch)
+                    .only(*related_only)
+                )
+                prefetch.append(Prefetch(lookup, queryset=related))
+            else:
+                related_only, related_select, related_prefetch = _plan(
+                    model_field.related_model, field, prefix=f"{lookup}__"
+                )
+                only += [lookup, *related_only]
+                select_related += [lookup, *related_select]
+                prefetch += related_prefetch
+        elif isinstance(field, serializers.ManyRelatedField):
+            related_opts = model_field.related_model._meta
+            related = model_field.related_model._default_manager.only(related_opts.pk.name)
+            prefetch.append(Prefetch(lookup, queryset=related))
+        else:
+            only.append(lookup)
+    return only, select_related, prefetch
@@ -0,0 +1,79 @@
+import zlib
+from typing import Iterable, Iterator
+
+from django.core.cache import cache
+
+from mysite.fastjson import dumps
+from mysite.replicas import replica_cache_timeout
+
+from .models import Order
+from .fast_serializers import fast_serializer
+from .serializers import OrderSerializer
+from .versioning import get_version, bump_version
+
+# Время жизни выгрузки заказов в кеше, секунды
+ORDERS_EXPORT_TIMEOUT = 300
+# Количество заказов, которое забирается из БД за один раз
+ORDERS_EXPORT_CHUNK_SIZE = 500
+
+
+def orders_export_version_key(user_id: int) -> str:
+    return f"orders_export_version_{user_id}"
+
+
+def orders_export_version(user_id: int) -> int:
+    return get_version(orders_export_version_key(user_id))
+
+
+def bump_orders_export_version(user_id: int) -> None:
+    """
+    Инвалидирует выгрузку заказов пользователя
+    """
+    bump_version(orders_export_version_key(user_id))
+
+
+def orders_export_cache_key(user_id: int, version: int) -> str:
+    return f"orders_export_{user_id}_v{version}"
+
+
+def iter_user_orders_json(user_id: int) -> Iterator[bytes]:
+    """
+    Отдает JSON с заказами пользователя частями.
+    При попадании в кеш отдается сохраненный результат, иначе заказы
+    сериализуются частями (FastSerializer), а собранный результат сохраняется в кеш
+    под текущей версией пользователя
+    """
+    cache_key = orders_export_cache_key(user_id, orders_export_version(user_id))
+    cached = cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    queryset = Order.objects.filter(user_id=user_id).order_by("pk")
+    orders = fast_serializer(OrderSerializer).iter_representation(
+        queryset, chunk_size=ORDERS_EXPORT_CHUNK_SIZE
+    )
+    chunks: list[bytes] = [b'{"orders":[']
+    yield chunks[0]
+    for index, order in enumerate(orders):
+        chunk = dumps(order)
+        if index:
+            chunk = b"," + chunk
+        chunks.append(chunk)
+        yield chunk
+    chunks.append(b"]}")
+    yield chunks[-1]
+
+    cache.set(cache_key, b"".join(chunks), replica_cache_timeout(ORDERS_EXPORT_TIMEOUT))
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Потоково сжимает части ответа в формат gzip
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
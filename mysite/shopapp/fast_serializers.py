@@ -0,0 +1,317 @@
+"""
+Быстрая сериализация для чтения: list/retrieve API и выгрузки.
+
+ModelSerializer на каждый объект создает экземпляр модели, обходит поля,
+вызывает get_attribute и to_representation каждого поля, а для
+ManyRelatedField делает по запросу на объект. Здесь по полям
+сериализатора один раз строится план: список (ключ, столбец,
+преобразование) с функциями под конкретный тип поля. Данные читаются
+через values() (только нужные столбцы), связи many-to-many - одним
+запросом на страницу.
+
+Результат совпадает с результатом сериализатора побайтно (после
+JSONRenderer), это проверяют тесты. Поля, для которых нет быстрого
+преобразования, обрабатываются to_representation самого поля; вложенные
+сериализаторы и вычисляемые поля не поддерживаются
+"""
+
+import decimal
+from collections import defaultdict
+from typing import Callable, Iterable, Iterator
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import QuerySet
+from django.http import Http404
+from rest_framework import serializers
+from rest_framework.fields import ISO_8601
+from rest_framework.permissions import BasePermission
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .expand import Shape, parse_shape, plan_queryset
+
+Converter = Callable[[object], object]
+
+
+def _decimal_converter(field: serializers.DecimalField) -> Converter | None:
+    coerce_to_string = getattr(field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+        return None
+    exponent = decimal.Decimal(".1") ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        # DecimalField.quantize() + '{:f}'.format()
+        return format(value.quantize(exponent, rounding=rounding, context=context), "f")
+
+    return convert
+
+
+def _datetime_converter(field: serializers.DateTimeField) -> Converter | None:
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601 or hasattr(field, "timezone"):
+        return None
+    # DateTimeField.enforce_timezone() для значений из БД (всегда aware при USE_TZ)
+    field_timezone = field.default_timezone()
+    if field_timezone is None:
+        return None
+
+    def convert(value):
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+
+    return convert
+
+
+def _file_converter(field: serializers.FileField, model_field, context: dict) -> Converter:
+    storage = model_field.storage
+    use_url = getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL)
+    request = context.get("request")
+
+    def convert(name):
+        # FileField.to_representation(): пустой файл - None
+        if not name:
+            return None
+        if not use_url:
+            return name
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    return convert
+
+
+class FastSerializer:
+    """
+    Сериализация строк values() по полям ModelSerializer serializer_class
+    """
+
+    def __init__(
+        self,
+        serializer_class: type[serializers.ModelSerializer],
+        fields: Iterable[str] | None = None,
+    ):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        opts = self.model._meta
+        # fields - подмножество полей сериализатора (?fields=, см. shopapp.expand)
+        self.fields = [
+            (name, field)
+            for name, field in serializer_class().fields.items()
+            if not field.write_only and (fields is None or name in fields)
+        ]
+        # столбцы для values(); pk нужен для связей many-to-many
+        self.columns = ["pk"]
+        # ключ -> (поле many-to-many модели, сортировка связанной модели)
+        self.many_to_many = {}
+        for name, field in self.fields:
+            if isinstance(field, serializers.ManyRelatedField):
+                model_field = opts.get_field(field.source)
+                if not isinstance(field.child_relation, serializers.PrimaryKeyRelatedField):
+                    raise ImproperlyConfigured(f"{serializer_class.__name__}.{name}: only pk relations")
+                related_ordering = model_field.related_model._meta.ordering
+                self.many_to_many[name] = (model_field, related_ordering)
+                continue
+            if isinstance(field, (serializers.BaseSerializer, serializers.SerializerMethodField)):
+                raise ImproperlyConfigured(f"{serializer_class.__name__}.{name} is not supported")
+            if isinstance(field, serializers.RelatedField) and not isinstance(
+                field, serializers.PrimaryKeyRelatedField
+            ):
+                raise ImproperlyConfigured(f"{serializer_class.__name__}.{name}: only pk relations")
+            if field.source not in self.columns:
+                self.columns.append(field.source)
+
+    def plan(self, context: dict) -> list[tuple[str, str, Converter | None]]:
+        """
+        (ключ, столбец, преобразование) для каждого поля; None - значение
+        из БД выводится как есть. Строится на каждый вызов: результат
+        зависит от запроса (абсолютные URL файлов) и текущего часового пояса
+        """
+        serializer = self.serializer_class(context=context)
+        fields = serializer.fields
+        plan = []
+        for name, _ in self.fields:
+            field = fields[name]
+            source = name if name in self.many_to_many else field.source
+            plan.append((name, source, self.converter(field, context)))
+        return plan
+
+    def converter(self, field: serializers.Field, context: dict) -> Converter | None:
+        if isinstance(field, serializers.ManyRelatedField):
+            return None
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            # values() отдает значение внешнего ключа
+            return None if field.pk_field is None else field.pk_field.to_representation
+        if isinstance(field, serializers.BooleanField):
+            return None
+        if isinstance(field, (serializers.IntegerField, serializers.CharField)):
+            # int()/str() от значений, которые уже этого типа
+            return None
+        if isinstance(field, serializers.DecimalField):
+            return _decimal_converter(field) or field.to_representation
+        if isinstance(field, serializers.DateTimeField):
+            return _datetime_converter(field) or field.to_representation
+        if isinstance(field, serializers.FileField):
+            return _file_converter(field, self.model._meta.get_field(field.source), context)
+        return field.to_representation
+
+    def values(self, queryset: QuerySet, *extra: str) -> QuerySet:
+        """
+        Выборка строк для сериализации; extra - дополнительные столбцы
+        (например, поля сортировки для курсора пагинации)
+        """
+        columns = self.columns + [name for name in extra if name not in self.columns]
+        return queryset.values(*columns)
+
+    def related_pks(self, name: str, pks: list) -> dict:
+        """
+        pk связанных объектов для каждого из pks одним запросом, в порядке
+        сортировки связанной модели (как instance.<поле>.all())
+        """
+        model_field, related_ordering = self.many_to_many[name]
+        through = model_field.remote_field.through
+        source, target = model_field.m2m_field_name(), model_field.m2m_reverse_field_name()
+        ordering = []
+        for field in related_ordering:
+            sign, field = ("-", field[1:]) if field.startswith("-") else ("", field)
+            ordering.append(f"{sign}{target}__{field}")
+        links = defaultdict(list)
+        rows = (
+            through.objects.filter(**{f"{source}__in": pks})
+            .order_by(*ordering, f"{target}_id")
+            .values_list(f"{source}_id", f"{target}_id")
+        )
+        for pk, related_pk in rows:
+            links[pk].append(related_pk)
+        return links
+
+    def to_representation(self, rows: Iterable[dict], context: dict | None = None) -> list[dict]:
+        rows = list(rows)
+        plan = self.plan(context or {})
+        if self.many_to_many and rows:
+            pks = [row["pk"] for row in rows]
+            for name in self.many_to_many:
+                links = self.related_pks(name, pks)
+                for row in rows:
+                    row[name] = links.get(row["pk"], [])
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, source, convert in plan:
+                value = row[source]
+                item[name] = value if convert is None or value is None else convert(value)
+            data.append(item)
+        return data
+
+    def iter_representation(
+        self,
+        queryset: QuerySet,
+        context: dict | None = None,
+        chunk_size: int = 2000,
+    ) -> Iterator[dict]:
+        """
+        Сериализует выборку частями по chunk_size строк
+        """
+        chunk = []
+        for row in self.values(queryset).iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield from self.to_representation(chunk, context)
+                chunk = []
+        if chunk:
+            yield from self.to_representation(chunk, context)
+
+
+_fast_serializers: dict[tuple, FastSerializer] = {}
+
+
+def fast_serializer(
+    serializer_class: type[serializers.ModelSerializer],
+    fields: tuple[str, ...] | None = None,
+) -> FastSerializer:
+    """
+    FastSerializer для класса сериализатора и набора полей (план полей
+    строится один раз)
+    """
+    key = (serializer_class, fields)
+    fast = _fast_serializers.get(key)
+    if fast is None:
+        fast = _fast_serializers[key] = FastSerializer(serializer_class, fields)
+    return fast
+
+
+def ordering_columns(queryset: QuerySet) -> list[str]:
+    return [
+        field.lstrip("-")
+        for field in (queryset.query.order_by or queryset.model._meta.ordering)
+        if isinstance(field, str)
+    ]
+
+
+class FastReadMixin:
+    """
+    list/retrieve ModelViewSet через FastSerializer для serializer_class,
+    с учетом ?fields=. С ?expand= (вложенные сериализаторы) и при
+    объектных правах (has_object_permission проверяется на экземпляре
+    модели) ответ строит сам сериализатор, по выборке из plan_queryset
+    """
+
+    read_actions = ("list", "retrieve")
+
+    def get_shape(self) -> Shape:
+        if not hasattr(self, "_shape"):
+            self._shape = parse_shape(self.request.query_params, self.get_serializer_class())
+        return self._shape
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in self.read_actions:
+            kwargs = {**self.get_shape().serializer_kwargs, **kwargs}
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.read_actions and self.get_shape().expand:
+            # поля сортировки нужны курсору KeysetPagination
+            queryset = plan_queryset(queryset, self.get_serializer(), ordering_columns(queryset))
+        return queryset
+
+    def get_fast_serializer(self) -> FastSerializer:
+        return fast_serializer(self.get_serializer_class(), self.get_shape().fields)
+
+    def list(self, request, *args, **kwargs):
+        if self.get_shape().expand:
+            return super().list(request, *args, **kwargs)
+        fast = self.get_fast_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        # поля сортировки нужны курсору KeysetPagination
+        queryset = fast.values(queryset, *ordering_columns(queryset))
+        page = self.paginate_queryset(queryset)
+        context = self.get_serializer_context()
+        if page is not None:
+            return self.get_paginated_response(fast.to_representation(page, context))
+        return Response(fast.to_representation(queryset, context))
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.get_shape().expand or any(
+            type(permission).has_object_permission is not BasePermission.has_object_permission
+            for permission in self.get_permissions()
+        ):
+            return super().retrieve(request, *args, **kwargs)
+        fast = self.get_fast_serializer()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            # как generics.get_object_or_404: неверное значение - 404
+            rows = list(
+                fast.values(queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}))[:1]
+            )
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        if not rows:
+            raise Http404
+        return Response(fast.to_representation(rows, self.get_serializer_context())[0])
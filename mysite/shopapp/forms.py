@@ -49,3 +49,10 @@ class OrderForm(forms.ModelForm):
 
 class CSVImportForm(forms.Form):
     csv_file = forms.FileField()
+
+
+class ProductCSVImportForm(CSVImportForm):
+    upsert = forms.BooleanField(
+        required=False,
+        help_text="Update existing products with the same SKU",
+    )
@@ -0,0 +1,153 @@
+"""
+Уменьшенные копии (варианты) изображений товаров.
+
+Для каждого загруженного изображения строятся варианты из IMAGE_VARIANTS
+в форматах WebP и JPEG. Сведения о них хранятся в JSON-поле модели
+(Product.preview_variants, ProductImage.variants):
+
+    {"card": {"width": 480, "height": 360, "webp": "<имя>", "jpeg": "<имя>"}, ...}
+
+По ним шаблонный тег responsive_image выводит <picture> с srcset.
+Масштабирование нагружает процессор, поэтому варианты загруженных через
+формы изображений строит фоновая задача build_image_variants (см.
+shopapp.jobs), а команда build_image_variants обрабатывает изображения
+параллельно в пуле процессов. Процессы пула запускаются методом spawn и
+настраивают Django заново: fork из многопоточного процесса может
+унаследовать захваченные блокировки и открытые соединения с БД
+"""
+
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+from typing import Iterable
+
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.fields.files import FieldFile
+from PIL import Image, ImageOps
+
+log = logging.getLogger(__name__)
+
+# Вариант -> наибольшая сторона, px
+IMAGE_VARIANTS = {
+    "thumb": 160,
+    "card": 480,
+    "full": 1200,
+}
+# Формат -> (формат Pillow, параметры сохранения)
+IMAGE_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+# Количество процессов пула (0 - обработка в текущем процессе)
+IMAGE_PROCESSES = min(4, os.cpu_count() or 1)
+
+_pool: Executor | None = None
+
+
+def _init_process() -> None:
+    # DJANGO_SETTINGS_MODULE передается дочернему процессу в окружении
+    django.setup()
+
+
+def _get_pool() -> Executor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(IMAGE_PROCESSES, mp_context=get_context("spawn"), initializer=_init_process)
+    return _pool
+
+
+def variant_name(name: str, variant: str, ext: str) -> str:
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return f"{directory}/variants/{stem}_{variant}.{ext}"
+
+
+def build_variants(name: str) -> dict:
+    """
+    Строит варианты изображения из хранилища и возвращает сведения о них.
+    Исходник меньше варианта не увеличивается, совпадающие по размеру
+    варианты не дублируются
+    """
+    with default_storage.open(name, "rb") as file:
+        with Image.open(file) as source:
+            image = ImageOps.exif_transpose(source)
+            image.load()
+
+    variants = {}
+    seen_sizes = set()
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if resized.size in seen_sizes:
+            continue
+        seen_sizes.add(resized.size)
+
+        info = {"width": resized.width, "height": resized.height}
+        for ext, (image_format, options) in IMAGE_FORMATS.items():
+            buffer = BytesIO()
+            _convert(resized, image_format).save(buffer, image_format, **options)
+            target = variant_name(name, variant, ext)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            info[ext] = default_storage.save(target, ContentFile(buffer.getvalue()))
+        variants[variant] = info
+    return variants
+
+
+def _convert(image: Image.Image, image_format: str) -> Image.Image:
+    if image_format == "JPEG" and image.mode != "RGB":
+        # у JPEG нет прозрачности: подкладываем белый фон
+        background = Image.new("RGB", image.size, "white")
+        rgba = image.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    if image.mode not in ("RGB", "RGBA"):
+        return image.convert("RGBA" if "transparency" in image.info else "RGB")
+    return image
+
+
+def _build_variants_safe(name: str) -> dict:
+    try:
+        return build_variants(name)
+    except (OSError, ValueError):
+        log.exception("Failed to build variants of %s", name)
+        return {}
+
+
+def build_variants_many(names: Iterable[str]) -> list[dict]:
+    """
+    Строит варианты для нескольких изображений; порядок результата
+    совпадает с names, для испорченных изображений - пустой словарь
+    """
+    names = list(names)
+    if IMAGE_PROCESSES <= 0 or len(names) < 2:
+        return [_build_variants_safe(name) for name in names]
+    return list(_get_pool().map(_build_variants_safe, names))
+
+
+def build_product_variants(product, images: Iterable = (), preview: bool = True) -> None:
+    """
+    Строит варианты новых изображений галереи и, если preview=True,
+    превью товара (задача build_image_variants после загрузки через
+    формы товара). Изображения обрабатываются в текущем процессе:
+    параллельно работают процессы run_worker
+    """
+    images = [image for image in images if image.image]
+    files: list[FieldFile] = [image.image for image in images]
+    preview = preview and bool(product.preview)
+    if preview:
+        files.append(product.preview)
+    if not files:
+        return
+
+    results = [_build_variants_safe(file.name) for file in files]
+    for image, variants in zip(images, results):
+        image.variants = variants
+        image.save(update_fields=["variants"])
+    if preview:
+        product.preview_variants = results[-1]
+        product.save(update_fields=["preview_variants", "updated_at"])
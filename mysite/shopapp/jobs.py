@@ -0,0 +1,330 @@
+"""
+Очередь фоновых задач в БД, без внешнего брокера.
+
+Задача ставится функцией enqueue и выполняется командой run_worker.
+Воркер забирает задачу условным UPDATE (queued -> running), поэтому одну
+задачу не выполнят два процесса даже на SQLite, где нет SELECT ... FOR UPDATE.
+Упавшая задача повторяется с растущей задержкой, пока не исчерпает
+max_attempts; ошибки в данных (PERMANENT_ERRORS) не повторяются
+"""
+
+import csv
+import logging
+import os
+import socket
+import tempfile
+import time
+from datetime import timedelta
+from typing import Callable
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .common import (
+    CSV_EXPORT_CHUNK_SIZE,
+    PRODUCT_CSV_FIELDS,
+    CSVImportReport,
+    iter_csv_rows,
+    save_csv_order,
+    save_csv_products,
+)
+from .images import build_product_variants
+from .models import Job, Product
+
+log = logging.getLogger(__name__)
+
+# Задержка перед повтором, секунды (удваивается с каждой попыткой)
+JOB_RETRY_DELAY = 30
+# Задача в статусе running, по которой воркер не отмечался (heartbeat)
+# дольше этого времени, считается брошенной (воркер упал) и возвращается
+# в очередь, секунды. Обработчики отмечаются после каждой пачки
+JOB_LOCK_TIMEOUT = 3600
+# Пауза между проверками пустой очереди, секунды
+JOB_POLL_INTERVAL = 1.0
+# Ошибки в данных: повтор задачи не поможет
+PERMANENT_ERRORS = (ValueError, UnicodeDecodeError, csv.Error)
+
+# Реестр обработчиков: вид задачи -> функция, возвращающая результат (JSON)
+JOB_HANDLERS: dict[str, Callable[[Job], dict | None]] = {}
+
+
+def job_handler(kind: str):
+    """
+    Регистрирует обработчик задач вида kind
+    """
+
+    def decorator(func: Callable[[Job], dict | None]):
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+def enqueue(kind: str, params: dict | None = None, file=None, user=None) -> Job:
+    """
+    Ставит задачу в очередь. Загруженный файл сохраняется в MEDIA_ROOT/jobs/
+    и удаляется после успешного выполнения
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    job = Job(
+        kind=kind,
+        params=params or {},
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    if file is not None:
+        job.file.save(os.path.basename(file.name), file, save=False)
+    job.save()
+    log.info("Job %s (%s) queued", job.pk, kind)
+    return job
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_job(worker: str) -> Job | None:
+    """
+    Забирает очередную задачу. Если задачу одновременно забрал другой
+    воркер, UPDATE не найдет строку в статусе queued и берется следующая
+    """
+    now = timezone.now()
+    candidates = (
+        Job.objects.filter(status=Job.Status.QUEUED, run_after__lte=now)
+        .order_by("run_after", "pk")
+        .values_list("pk", flat=True)[:10]
+    )
+    for pk in candidates:
+        claimed = Job.objects.filter(pk=pk, status=Job.Status.QUEUED).update(
+            status=Job.Status.RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+class JobLockLost(Exception):
+    """
+    Задачу вернули в очередь как брошенную, и ее мог забрать другой воркер
+    """
+
+
+def owned(job: Job):
+    """
+    Строка задачи, пока она выполняется забравшим ее воркером
+    """
+    return Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING, locked_by=job.locked_by)
+
+
+def heartbeat(job: Job, **fields) -> None:
+    """
+    Сохраняет fields и продлевает блокировку задачи (locked_at), чтобы
+    requeue_stale_jobs не вернул долгую задачу в очередь
+    """
+    if not owned(job).update(locked_at=timezone.now(), **fields):
+        raise JobLockLost(f"Job {job.pk} is no longer locked by {job.locked_by}")
+
+
+def requeue_stale_jobs(timeout: float = JOB_LOCK_TIMEOUT) -> int:
+    """
+    Возвращает в очередь задачи упавших воркеров
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.Status.RUNNING,
+        locked_at__lt=now - timedelta(seconds=timeout),
+    )
+    stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.Status.FAILED,
+        error="Worker lost",
+        finished_at=now,
+    )
+    return stale.update(
+        status=Job.Status.QUEUED,
+        locked_by="",
+        locked_at=None,
+        run_after=now,
+    )
+
+
+def run_job(job: Job) -> Job:
+    """
+    Выполняет забранную воркером задачу и сохраняет ее итог
+    """
+    started = time.perf_counter()
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind {job.kind!r}")
+        result = handler(job)
+    except JobLockLost:
+        log.warning("Job %s lost its lock, result discarded", job.pk)
+    except Exception as exc:
+        _job_failed(job, exc)
+    else:
+        job.status = Job.Status.DONE
+        job.result = result
+        job.progress = 100
+        job.error = ""
+        job.finished_at = timezone.now()
+        if not _save_if_owned(job, "status", "result", "progress", "processed", "error", "finished_at"):
+            log.warning("Job %s lost its lock, result discarded", job.pk)
+            return job
+        if job.file:
+            job.file.delete(save=True)
+        log.info("Job %s done in %.1fs", job.pk, time.perf_counter() - started)
+    return job
+
+
+def _save_if_owned(job: Job, *fields: str) -> bool:
+    # итог пишет только воркер, который все еще держит задачу
+    values = {field: getattr(job, field) for field in fields}
+    saved = owned(job).update(locked_by="", **values)
+    if saved:
+        job.locked_by = ""
+    return bool(saved)
+
+
+def _job_failed(job: Job, exc: Exception) -> None:
+    log.exception("Job %s failed (attempt %s)", job.pk, job.attempts)
+    job.error = f"{type(exc).__name__}: {exc}"
+    if isinstance(exc, PERMANENT_ERRORS) or job.attempts >= job.max_attempts:
+        job.status = Job.Status.FAILED
+        job.finished_at = timezone.now()
+    else:
+        job.status = Job.Status.QUEUED
+        delay = JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.run_after = timezone.now() + timedelta(seconds=delay)
+    if not _save_if_owned(job, "error", "status", "finished_at", "run_after"):
+        log.warning("Job %s lost its lock, failure not recorded", job.pk)
+
+
+def work(
+    worker: str | None = None,
+    burst: bool = False,
+    poll_interval: float = JOB_POLL_INTERVAL,
+    should_stop: Callable[[], bool] = lambda: False,
+) -> int:
+    """
+    Цикл воркера: выполняет задачи по одной, пока should_stop() не вернет
+    True. В режиме burst завершается, как только очередь пуста.
+    Возвращает количество выполненных задач
+    """
+    worker = worker or worker_id()
+    done = 0
+    while not should_stop():
+        close_old_connections()
+        job = claim_job(worker)
+        if job is None:
+            if requeue_stale_jobs():
+                continue
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        log.info("Worker %s runs job %s (%s)", worker, job.pk, job.kind)
+        run_job(job)
+        done += 1
+    return done
+
+
+class ImportProgress:
+    """
+    Сохраняет прогресс импорта после каждой пачки. Пачки фиксируются
+    в БД по одной, поэтому повторная попытка пропускает уже обработанные
+    строки и дополняет отчет предыдущей попытки
+    """
+
+    def __init__(self, job: Job):
+        self.job = job
+        self.skip_rows = job.processed
+        self.previous = job.result or {}
+        self.size = job.file.size
+
+    def __call__(self, report: CSVImportReport) -> None:
+        job = self.job
+        job.processed = self.skip_rows + report.processed
+        job.result = self.merge(report)
+        if self.size:
+            job.progress = min(99, job.file.file.tell() * 100 // self.size)
+        heartbeat(job, processed=job.processed, progress=job.progress, result=job.result)
+
+    def merge(self, report: CSVImportReport) -> dict:
+        result = report.as_dict()
+        result["created"] += self.previous.get("created", 0)
+        result["updated"] += self.previous.get("updated", 0)
+        result["errors"] = self.previous.get("errors", []) + result["errors"]
+        result["batches"] += self.previous.get("batches", 0)
+        return result
+
+
+@job_handler("import_products_csv")
+def import_products_csv(job: Job) -> dict:
+    progress = ImportProgress(job)
+    with job.file.open("rb"):
+        report = save_csv_products(
+            file=job.file.file,
+            encoding=job.params.get("encoding", "utf-8"),
+            upsert=job.params.get("upsert", False),
+            on_batch=progress,
+            skip_rows=progress.skip_rows,
+        )
+    return progress.merge(report)
+
+
+@job_handler("import_orders_csv")
+def import_orders_csv(job: Job) -> dict:
+    progress = ImportProgress(job)
+    with job.file.open("rb"):
+        report = save_csv_order(
+            file=job.file.file,
+            encoding=job.params.get("encoding", "utf-8"),
+            on_batch=progress,
+            skip_rows=progress.skip_rows,
+        )
+    return progress.merge(report)
+
+
+@job_handler("export_products_csv")
+def export_products_csv(job: Job) -> dict:
+    """
+    Выгрузка товаров (всех или params["pks"]) в CSV-файл в MEDIA_ROOT
+    """
+    queryset = Product.objects.order_by("pk")
+    if job.params.get("pks"):
+        queryset = queryset.filter(pk__in=job.params["pks"])
+    total = queryset.count()
+
+    rows = 0
+    with tempfile.TemporaryFile() as output:
+        for line in iter_csv_rows(queryset, PRODUCT_CSV_FIELDS):
+            output.write(line.encode())
+            rows += 1
+            if rows % CSV_EXPORT_CHUNK_SIZE == 0:
+                heartbeat(job, processed=rows - 1, progress=min(99, rows * 100 // (total + 1)))
+        output.seek(0)
+        name = default_storage.save(f"jobs/exports/products-{job.pk}.csv", File(output))
+
+    job.processed = rows - 1
+    return {"rows": rows - 1, "url": default_storage.url(name)}
+
+
+@job_handler("build_image_variants")
+def build_image_variants(job: Job) -> dict:
+    """
+    Варианты изображений товара params["product"]: галереи params["images"]
+    и, если params["preview"], превью (после загрузки через формы товара)
+    """
+    product = Product.objects.filter(pk=job.params["product"]).first()
+    if product is None:
+        # товар удалили, пока задача ждала в очереди
+        return {"images": 0}
+    images = list(product.images.filter(pk__in=job.params.get("images", [])).order_by("pk"))
+    build_product_variants(product, images, preview=job.params.get("preview", True))
+    return {"images": len(images) + bool(job.params.get("preview", True) and product.preview)}
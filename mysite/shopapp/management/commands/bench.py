@@ -0,0 +1,310 @@
+import json
+import logging
+import platform
+import re
+import sqlite3
+import statistics
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+
+from myauth.models import Profile
+from shopapp.models import Order, Product
+from shopapp.seeding import ShopSeeder
+
+# Пространства имен URL, маршруты которых проверяются
+BENCH_NAMESPACES = ("shopapp", "myauth")
+# Маршруты API (DefaultRouter) без пространства имен
+API_ROUTE_RE = re.compile(r"^(api-root|[\w-]+-(list|detail))$")
+# Маршруты, которые нельзя вызывать GET-запросом в цикле
+SKIPPED_ROUTES = {"myauth:logout"}
+# Адрес клиента не из INTERNAL_IPS, чтобы не включалась debug toolbar
+BENCH_REMOTE_ADDR = "192.0.2.10"
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Заполняет БД синтетическими данными и вызывает все страницы и маршруты
+    API shopapp/myauth в текущем процессе через тестовый клиент. Для каждого
+    маршрута выводит в JSON задержки p50/p95/p99, запросы в секунду,
+    количество SQL-запросов и пиковую память Python одного "теплого"
+    запроса, чтобы два прогона можно было сравнить (см. --compare).
+    Данные откатываются, кеш - отдельный, в памяти процесса
+
+        manage.py bench --output before.json
+        manage.py bench --output after.json --compare before.json
+    """
+
+    help = "Замеры всех маршрутов магазина в текущем процессе"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=2000)
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--orders", type=int, default=1000)
+        parser.add_argument(
+            "--products-per-order",
+            type=float,
+            default=3,
+            help="среднее количество товаров в заказе",
+        )
+        parser.add_argument("--requests", type=int, default=30, help="замеряемых запросов на маршрут")
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument("--only", default="", help="только маршруты, содержащие этот текст")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--output", help="записать отчет JSON в этот файл")
+        parser.add_argument("--compare", help="предыдущий отчет JSON для сравнения")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=10.0,
+            help="рост p50 в %%, считающийся регрессией",
+        )
+        parser.add_argument(
+            "--min-delta-ms",
+            type=float,
+            default=1.0,
+            help="не учитывать изменения p50 меньше этого (шум таймера)",
+        )
+
+    def handle(self, *args, **options):
+        shared = {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "bench",
+        }
+        bench_caches = {**settings.CACHES}
+        bench_caches["shared" if "shared" in bench_caches else "default"] = shared
+
+        # 4xx ответы django.request пишет с уровнем WARNING
+        logging.disable(logging.WARNING)
+        try:
+            with override_settings(CACHES=bench_caches), warnings.catch_warnings():
+                # асинхронные потоковые ответы через синхронный тестовый клиент
+                warnings.filterwarnings("ignore", "StreamingHttpResponse must consume")
+                with transaction.atomic():
+                    report = self.run(options)
+                    raise Rollback
+        except Rollback:
+            pass
+        finally:
+            logging.disable(logging.NOTSET)
+
+        data = json.dumps(report, indent=2, ensure_ascii=False)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(data)
+            self.stdout.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(data)
+
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                self.compare(json.load(file), report, options)
+
+    def run(self, options) -> dict:
+        started = time.perf_counter()
+        fixtures = self.seed(options)
+        self.stderr.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+        admin = fixtures["admin"]
+        anonymous = Client(HTTP_HOST="127.0.0.1", REMOTE_ADDR=BENCH_REMOTE_ADDR)
+        staff = Client(HTTP_HOST="127.0.0.1", REMOTE_ADDR=BENCH_REMOTE_ADDR)
+        staff.force_login(admin)
+
+        routes, skipped = {}, []
+        for name, kwargs in self.iter_routes(fixtures):
+            if options["only"] and options["only"] not in name:
+                continue
+            if kwargs is None:
+                skipped.append(name)
+                continue
+            url = reverse(name, kwargs=kwargs)
+            for client_name, client in (("anon", anonymous), ("staff", staff)):
+                result = self.measure(client, url, options["requests"], options["warmup"])
+                if result["status"] == 405:
+                    # маршрут без GET (например, upload_csv)
+                    break
+                if client_name == "anon" and result["status"] in (302, 401, 403):
+                    continue
+                routes[f"{name} [{client_name}]"] = {"url": url, **result}
+                self.stderr.write(
+                    f"{name} [{client_name}]: p50 {result['p50_ms']:.2f} ms, "
+                    f"{result['queries']} queries"
+                )
+
+        return {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "database": connection.vendor,
+                "dataset": {
+                    "products": options["products"],
+                    "users": options["users"],
+                    "orders": options["orders"],
+                    "products_per_order": options["products_per_order"],
+                },
+                "requests_per_route": options["requests"],
+            },
+            "routes": routes,
+            "skipped": skipped,
+        }
+
+    def seed(self, options) -> dict:
+        seeder = ShopSeeder(seed=options["seed"], prefix="bench")
+        admin = User.objects.create_superuser("bench-admin", password="bench")
+        Profile.objects.create(user=admin)
+        users = seeder.create_users(options["users"], password="bench")
+        if not users:
+            seeder.user_pks.append(admin.pk)
+        seeder.create_products(options["products"])
+        seeder.create_orders(options["orders"], products_per_order=options["products_per_order"])
+        seeder.finish()
+
+        product_pks = seeder.product_pks
+        order = (
+            Order.objects.filter(user_id__in=seeder.user_pks)
+            .select_related("user")
+            .order_by("pk")
+            .first()
+        )
+        return {
+            "admin": admin,
+            "user": order.user if order else admin,
+            "product": (
+                Product.objects.get(pk=product_pks[len(product_pks) // 2]) if product_pks else None
+            ),
+            "order": order,
+        }
+
+    def iter_routes(self, fixtures: dict):
+        """
+        (имя маршрута, kwargs) для всех проверяемых GET-маршрутов;
+        kwargs=None, если значения параметров подобрать не удалось
+        """
+        seen = set()
+        for name, params in self.iter_patterns(get_resolver().url_patterns):
+            if name in seen or name in SKIPPED_ROUTES or "format" in params:
+                continue
+            namespace = name.split(":")[0] if ":" in name else None
+            if namespace not in BENCH_NAMESPACES and not (
+                namespace is None and API_ROUTE_RE.match(name)
+            ):
+                continue
+            seen.add(name)
+            yield name, self.route_kwargs(name, params, fixtures)
+
+    def iter_patterns(self, patterns, namespace: str | None = None):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                nested = namespace
+                if pattern.namespace:
+                    nested = f"{namespace}:{pattern.namespace}" if namespace else pattern.namespace
+                yield from self.iter_patterns(pattern.url_patterns, nested)
+            elif isinstance(pattern, URLPattern) and pattern.name:
+                name = f"{namespace}:{pattern.name}" if namespace else pattern.name
+                yield name, list(pattern.pattern.regex.groupindex)
+
+    @staticmethod
+    def route_kwargs(name: str, params: list[str], fixtures: dict) -> dict | None:
+        admin, user = fixtures["admin"], fixtures["user"]
+        kwargs = {}
+        for param in params:
+            if param == "user_id" or (param == "pk" and name == "myauth:user_details"):
+                kwargs[param] = user.pk
+            elif param == "pk" and name == "myauth:update_about_me":
+                kwargs[param] = admin.profile.pk
+            elif param == "pk" and "order" in name and fixtures["order"]:
+                kwargs[param] = fixtures["order"].pk
+            elif param == "pk" and "product" in name and fixtures["product"]:
+                kwargs[param] = fixtures["product"].pk
+            else:
+                return None
+        return kwargs
+
+    @staticmethod
+    def measure(client: Client, url: str, requests: int, warmup: int) -> dict:
+        for _ in range(warmup):
+            response = client.get(url)
+        status = response.status_code if warmup else client.get(url).status_code
+
+        timings = []
+        started = time.perf_counter()
+        for _ in range(requests):
+            request_started = time.perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                b"".join(response)
+            timings.append(time.perf_counter() - request_started)
+        elapsed = time.perf_counter() - started
+
+        # Количество запросов к БД и пиковая память - по одному "теплому"
+        # запросу: трассировка памяти сильно замедляет выполнение
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+                if response.streaming:
+                    b"".join(response)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        if len(timings) >= 2:
+            quantiles = statistics.quantiles(timings, n=100)
+            p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+        else:
+            p50 = p95 = p99 = timings[0] if timings else 0.0
+        return {
+            "status": status,
+            "requests": requests,
+            "rps": round(requests / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(p50 * 1000, 3),
+            "p95_ms": round(p95 * 1000, 3),
+            "p99_ms": round(p99 * 1000, 3),
+            "queries": len(queries),
+            "peak_memory_kb": round(peak / 1024, 1),
+        }
+
+    def compare(self, before: dict, after: dict, options: dict) -> None:
+        self.stdout.write(
+            f"{'route':<48} {'p50 before':>11} {'p50 after':>10} {'change':>8} {'queries':>9}"
+        )
+        regressions = 0
+        for name, new in after["routes"].items():
+            old = before["routes"].get(name)
+            if old is None:
+                self.stdout.write(f"{name:<48} {'-':>11} {new['p50_ms']:>10.2f} {'new':>8}")
+                continue
+            change = (new["p50_ms"] / old["p50_ms"] - 1) * 100 if old["p50_ms"] else 0.0
+            line = (
+                f"{name:<48} {old['p50_ms']:>11.2f} {new['p50_ms']:>10.2f} "
+                f"{change:>+7.1f}% {old['queries']:>4}->{new['queries']:<4}"
+            )
+            slower = (
+                change > options["threshold"]
+                and new["p50_ms"] - old["p50_ms"] > options["min_delta_ms"]
+            )
+            if slower or new["queries"] > old["queries"]:
+                regressions += 1
+                line = self.style.WARNING(line + " REGRESSION")
+            self.stdout.write(line)
+        for name in sorted(before["routes"].keys() - after["routes"].keys()):
+            if options["only"] in name:
+                self.stdout.write(f"{name:<48} missing in the new report")
+        if regressions:
+            raise CommandError(f"{regressions} route(s) regressed")
@@ -0,0 +1,102 @@
+import resource
+import time
+import tracemalloc
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from shopapp.common import iter_csv_rows
+from shopapp.models import Product
+
+EXPORT_FIELDS = ["name", "description", "price", "discount"]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Пиковая память потоковой выгрузки товаров в CSV для каталогов
+    растущего размера. Созданные товары в конце откатываются
+    """
+
+    help = "Замер памяти потоковой выгрузки товаров в CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[10_000, 100_000, 1_000_000],
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--with-buffered",
+            action="store_true",
+            help="для сравнения замерить и прежнюю выгрузку в памяти",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Seeded products rolled back")
+
+    def run(self, options):
+        self.stdout.write(
+            f"{'products':>10} {'mode':>10} {'peak, KiB':>12} "
+            f"{'maxrss, KiB':>12} {'seconds':>8}"
+        )
+        created = Product.objects.count()
+        for size in sorted(options["sizes"]):
+            self.seed(size - created, options["batch_size"])
+            created = max(created, size)
+
+            queryset = Product.objects.all()
+            self.report(size, "stream", lambda: self.consume_stream(queryset))
+            if options["with_buffered"]:
+                self.report(size, "buffered", lambda: self.consume_buffered(queryset))
+
+    def seed(self, count: int, batch_size: int):
+        while count > 0:
+            batch = min(count, batch_size)
+            Product.objects.bulk_create(
+                Product(
+                    name=f"Product {i}",
+                    description="Benchmark product description",
+                    price="99.99",
+                    discount=i % 50,
+                )
+                for i in range(batch)
+            )
+            count -= batch
+
+    @staticmethod
+    def consume_stream(queryset) -> int:
+        size = 0
+        for line in iter_csv_rows(queryset, EXPORT_FIELDS):
+            size += len(line)
+        return size
+
+    @staticmethod
+    def consume_buffered(queryset) -> int:
+        lines = [
+            ",".join(str(getattr(product, field)) for field in EXPORT_FIELDS)
+            for product in queryset.only(*EXPORT_FIELDS)
+        ]
+        return len("\n".join(lines))
+
+    def report(self, size: int, mode: str, func):
+        tracemalloc.start()
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(
+            f"{size:>10} {mode:>10} {peak // 1024:>12} {maxrss:>12} {elapsed:>8.2f}"
+        )
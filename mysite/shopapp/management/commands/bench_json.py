@@ -0,0 +1,87 @@
+import time
+from io import BytesIO
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from mysite import fastjson
+from mysite.fastjson import FastJSONParser, FastJSONRenderer
+from shopapp.fast_serializers import fast_serializer
+from shopapp.models import Order, Product
+from shopapp.seeding import ShopSeeder
+from shopapp.serializers import OrderSerializer, ProductSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Скорость формирования и разбора JSON ответов API: JSONRenderer/JSONParser
+    DRF (стандартный json) против FastJSONRenderer/FastJSONParser
+    (mysite/fastjson.py, orjson, если установлен). Данные - списки товаров
+    и заказов из синтетических данных, которые затем откатываются
+
+        manage.py bench_json --rows 1000
+    """
+
+    help = "Замер формирования и разбора JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000, help="объектов в одном ответе")
+        parser.add_argument("--repeat", type=int, default=20, help="лучший из N прогонов")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                seeder = ShopSeeder(seed=options["seed"], prefix="bench-json")
+                seeder.create_users(5)
+                seeder.create_products(options["rows"])
+                seeder.create_orders(options["rows"])
+                payloads = {
+                    "products": self.payload(ProductSerializer, Product, options["rows"]),
+                    "orders": self.payload(OrderSerializer, Order, options["rows"]),
+                }
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f"orjson: {'yes' if fastjson.orjson is not None else 'no (stdlib fallback)'}")
+        self.stdout.write(f"{'payload':<10} {'operation':<10} {'json MB/s':>10} {'fast MB/s':>10} {'speedup':>8}")
+        for name, data in payloads.items():
+            body = JSONRenderer().render(data)
+            runs = {
+                "render": (
+                    lambda: JSONRenderer().render(data),
+                    lambda: FastJSONRenderer().render(data),
+                ),
+                "parse": (
+                    lambda: JSONParser().parse(BytesIO(body)),
+                    lambda: FastJSONParser().parse(BytesIO(body)),
+                ),
+            }
+            for operation, (stdlib, fast) in runs.items():
+                slow_rate = len(body) / self.best(stdlib, options["repeat"]) / 1e6
+                fast_rate = len(body) / self.best(fast, options["repeat"]) / 1e6
+                self.stdout.write(
+                    f"{name:<10} {operation:<10} {slow_rate:>10.1f} {fast_rate:>10.1f} "
+                    f"{fast_rate / slow_rate:>7.1f}x"
+                )
+
+    @staticmethod
+    def payload(serializer_class, model, rows: int) -> list[dict]:
+        fast = fast_serializer(serializer_class)
+        return fast.to_representation(fast.values(model.objects.order_by("pk")[:rows]))
+
+    @staticmethod
+    def best(run, repeat: int) -> float:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
@@ -0,0 +1,81 @@
+import statistics
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test import Client
+
+from shopapp.models import Product
+from shopapp.pagination import KeysetPagination
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает задержку дальней страницы /api/products/ при постраничном
+    выводе по номеру страницы и по курсору (keyset). Созданные товары
+    в конце откатываются
+    """
+
+    help = "Сравнение пагинации по номеру страницы и по курсору в API товаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--page", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--ordering", default="price")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Seeded products rolled back")
+
+    def run(self, options):
+        self.seed(options["products"])
+        client = Client(HTTP_HOST="127.0.0.1")
+        url = "/api/products/"
+        page, ordering = options["page"], options["ordering"]
+
+        offset = self.measure(
+            client, url, {"page": page, "ordering": ordering}, options["repeat"]
+        )
+        cursor = self.cursor_for_page(ordering, page)
+        keyset = self.measure(
+            client, url, {"cursor": cursor, "ordering": ordering}, options["repeat"]
+        )
+        self.stdout.write(f"page {page}, ordering={ordering!r}, median latency:")
+        self.stdout.write(f"  page number: {offset * 1000:8.2f} ms")
+        self.stdout.write(f"  keyset:      {keyset * 1000:8.2f} ms")
+
+    def seed(self, count: int, batch_size: int = 5000):
+        for start in range(0, count, batch_size):
+            Product.objects.bulk_create(
+                Product(name=f"Product {i}", price=i % 1000, discount=i % 50)
+                for i in range(start, min(start + batch_size, count))
+            )
+
+    @staticmethod
+    def cursor_for_page(ordering: str, page: int) -> str:
+        # Курсор страницы N строится по последней записи страницы N-1
+        paginator = KeysetPagination()
+        paginator.ordering = [ordering, "pk"]
+        last_row = Product.objects.order_by(*paginator.ordering)[
+            (page - 1) * paginator.page_size - 1
+        ]
+        return paginator.make_cursor(last_row, reverse=False)
+
+    @staticmethod
+    def measure(client: Client, url: str, params: dict, repeat: int) -> float:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(url, params)
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.status_code
+        return statistics.median(timings)
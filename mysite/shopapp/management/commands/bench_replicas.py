@@ -0,0 +1,176 @@
+import logging
+import os
+import random
+import tempfile
+import time
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from shopapp.models import Product
+from shopapp.seeding import ShopSeeder
+
+from .sync_replicas import copy_database
+
+# Адрес клиента не из INTERNAL_IPS, чтобы не включалась debug toolbar
+BENCH_REMOTE_ADDR = "192.0.2.10"
+# Без кеша каждый запрос читает из БД
+BENCH_CACHES = {
+    alias: {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+    for alias in settings.CACHES
+}
+
+
+class Command(BaseCommand):
+    """
+    Пропускная способность чтения API товаров с 0..N репликами. Копия БД
+    с синтетическими данными создается во временном каталоге, затем для
+    каждого числа реплик запускаются процессы-читатели (GET списка и
+    карточек товаров тестовым клиентом, маршрутизация -
+    ReplicaRoutingMiddleware) и процессы-писатели, изменяющие товары в
+    основной БД. Реплики - копии файла основной БД, как у sync_replicas.
+    Кеши отключены
+
+        manage.py bench_replicas --replicas 0 1 2 4 --readers 8 --writers 2
+    """
+
+    help = "Замер пропускной способности чтения с репликами"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--replicas", type=int, nargs="+", default=[0, 1, 2, 4])
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--duration", type=float, default=5.0, help="секунд на прогон")
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            primary = os.path.join(directory, "primary.sqlite3")
+            # схема - из основной БД, данные - синтетические
+            copy_database(settings.DATABASES["default"]["NAME"], primary)
+            connect("default", primary)
+            seeder = ShopSeeder(seed=options["seed"], prefix="bench-replicas")
+            seeder.create_products(options["products"])
+            product_pks = list(seeder.product_pks)
+            connections.close_all()
+
+            self.stdout.write(
+                f"{'replicas':>8} {'reads/s':>9} {'writes/s':>9} {'errors':>7} {'p95 read ms':>12}"
+            )
+            for count in options["replicas"]:
+                replicas = []
+                for number in range(1, count + 1):
+                    path = os.path.join(directory, f"replica{number}.sqlite3")
+                    copy_database(primary, path)
+                    replicas.append(path)
+                result = self.run(primary, replicas, product_pks, options)
+                self.stdout.write(
+                    f"{count:>8} {result['reads'] / options['duration']:>9.0f} "
+                    f"{result['writes'] / options['duration']:>9.0f} {result['errors']:>7} "
+                    f"{result['p95_read_ms']:>12.1f}"
+                )
+
+    def run(self, primary: str, replicas: list[str], product_pks: list[int], options: dict) -> dict:
+        context = get_context("fork")
+        queue = context.Queue()
+        # все процессы начинают одновременно, после запуска последнего
+        start = time.time() + 2
+        deadline = start + options["duration"]
+        workers = [
+            context.Process(
+                target=worker,
+                args=(primary, replicas, product_pks, role, start, deadline, queue),
+            )
+            for role, count in (("reader", options["readers"]), ("writer", options["writers"]))
+            for _ in range(count)
+        ]
+        for process in workers:
+            process.start()
+        results = [queue.get() for _ in workers]
+        for process in workers:
+            process.join()
+
+        latencies = sorted(ms for result in results for ms in result["latencies"])
+        return {
+            "reads": sum(result["ops"] for result in results if result["role"] == "reader"),
+            "writes": sum(result["ops"] for result in results if result["role"] == "writer"),
+            "errors": sum(result["errors"] for result in results),
+            "p95_read_ms": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        }
+
+
+def connect(alias: str, path: str, read_only: bool = False) -> None:
+    """
+    Подключение alias к файлу path с настройками основной БД
+    """
+    database = {**settings.DATABASES["default"], "NAME": path}
+    if read_only:
+        options = database["OPTIONS"]
+        database["OPTIONS"] = {
+            **options,
+            "init_command": options.get("init_command", "") + "; PRAGMA query_only=1",
+        }
+    connections.settings[alias] = connections.configure_settings({"default": database})["default"]
+    try:
+        del connections[alias]
+    except AttributeError:
+        pass
+
+
+def worker(
+    primary: str,
+    replicas: list[str],
+    product_pks: list[int],
+    role: str,
+    start: float,
+    deadline: float,
+    queue,
+) -> None:
+    ops = errors = 0
+    latencies = []
+    try:
+        connect("default", primary)
+        aliases = []
+        for number, path in enumerate(replicas, 1):
+            connect(f"replica{number}", path, read_only=True)
+            aliases.append(f"replica{number}")
+        # 4xx/5xx ответы django.request пишет в лог
+        logging.disable(logging.ERROR)
+        client = Client(HTTP_HOST="127.0.0.1", REMOTE_ADDR=BENCH_REMOTE_ADDR)
+        list_url = reverse("shopapp:product-list")
+        with override_settings(CACHES=BENCH_CACHES, DATABASE_REPLICAS=aliases):
+            if role == "reader":
+                # первый запрос импортирует и настраивает все слои
+                client.get(list_url)
+            time.sleep(max(0.0, start - time.time()))
+            while time.time() < deadline:
+                pk = random.choice(product_pks)
+                started = time.perf_counter()
+                try:
+                    if role == "reader":
+                        url = (
+                            list_url
+                            if ops % 2
+                            else reverse("shopapp:product-detail", kwargs={"pk": pk})
+                        )
+                        if client.get(url).status_code != 200:
+                            errors += 1
+                            continue
+                        latencies.append((time.perf_counter() - started) * 1000)
+                    else:
+                        with transaction.atomic():
+                            Product.objects.filter(pk=pk).update(price=F("price") + 1)
+                except OperationalError:
+                    errors += 1
+                    continue
+                ops += 1
+    finally:
+        # родитель ждет результат от каждого процесса
+        connections.close_all()
+        queue.put({"role": role, "ops": ops, "errors": errors, "latencies": latencies})
@@ -0,0 +1,86 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from shopapp.fast_serializers import fast_serializer
+from shopapp.seeding import ShopSeeder
+from shopapp.serializers import OrderFullSerializer, OrderSerializer, ProductSerializer
+
+# Сериализаторы и связи many-to-many, которые нужно подгрузить заранее
+BENCH_SERIALIZERS = {
+    "product": (ProductSerializer, ()),
+    "order": (OrderSerializer, ("products",)),
+    "order_full": (OrderFullSerializer, ("products",)),
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Объектов в секунду у сериализаторов чтения с выводом в JSON: DRF как
+    есть, DRF с prefetch_related связей many-to-many и FastSerializer
+    (shopapp/fast_serializers.py) на одних и тех же строках. Синтетические
+    данные затем откатываются
+
+        manage.py bench_serializers --products 5000 --orders 5000
+    """
+
+    help = "Сравнение сериализаторов DRF и FastSerializer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--orders", type=int, default=5000)
+        parser.add_argument("--rows", type=int, default=1000, help="объектов за прогон")
+        parser.add_argument("--repeat", type=int, default=3, help="лучший из N прогонов")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                seeder = ShopSeeder(seed=options["seed"], prefix="bench-serializers")
+                seeder.create_users(options["users"])
+                seeder.create_products(options["products"])
+                seeder.create_orders(options["orders"])
+                self.report(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def report(self, options: dict) -> None:
+        request = Request(RequestFactory().get("/api/"))
+        context = {"request": request}
+        renderer = JSONRenderer()
+        self.stdout.write(f"{'serializer':<12} {'mode':<14} {'objects/s':>10} {'speedup':>8}")
+        for name, (serializer_class, prefetch) in BENCH_SERIALIZERS.items():
+            model = serializer_class.Meta.model
+            queryset = model.objects.order_by("pk")[: options["rows"]]
+            fast = fast_serializer(serializer_class)
+            modes = {"drf": lambda: serializer_class(list(queryset), many=True, context=context).data}
+            if prefetch:
+                modes["drf+prefetch"] = lambda: serializer_class(
+                    list(queryset.prefetch_related(*prefetch)), many=True, context=context
+                ).data
+            modes["fast"] = lambda: fast.to_representation(fast.values(queryset), context)
+            baseline = None
+            for mode, serialize in modes.items():
+                best = min(
+                    self.measure(lambda: renderer.render(serialize()))
+                    for _ in range(options["repeat"])
+                )
+                rate = options["rows"] / best
+                baseline = baseline or rate
+                self.stdout.write(f"{name:<12} {mode:<14} {rate:>10.0f} {rate / baseline:>7.1f}x")
+
+    @staticmethod
+    def measure(run) -> float:
+        started = time.perf_counter()
+        run()
+        return time.perf_counter() - started
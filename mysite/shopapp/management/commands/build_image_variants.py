@@ -0,0 +1,56 @@
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from shopapp import images
+from shopapp.common import iter_batches
+from shopapp.models import Product, ProductImage
+from shopapp.page_cache import bump_products_versions
+
+
+class Command(BaseCommand):
+    """
+    Строит уменьшенные варианты WebP/JPEG для превью и изображений галереи
+    товаров, загруженных до появления вариантов
+    """
+
+    help = "Построить недостающие варианты изображений товаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="перестроить и существующие варианты")
+        parser.add_argument("--processes", type=int, default=images.IMAGE_PROCESSES)
+        parser.add_argument("--batch-size", type=int, default=50)
+
+    def handle(self, *args, **options):
+        images.IMAGE_PROCESSES = options["processes"]
+
+        products = Product.objects.exclude(preview="").exclude(preview__isnull=True)
+        gallery = ProductImage.objects.exclude(image="")
+        if not options["force"]:
+            products = products.filter(preview_variants={})
+            gallery = gallery.filter(variants={})
+
+        built = 0
+        for batch in iter_batches(products.order_by("pk").iterator(), options["batch_size"]):
+            results = images.build_variants_many(product.preview.name for product in batch)
+            now = timezone.now()
+            for product, variants in zip(batch, results):
+                product.preview_variants = variants
+                product.updated_at = now
+            Product.objects.bulk_update(batch, ["preview_variants", "updated_at"])
+            bump_products_versions(product.pk for product in batch)
+            built += len(batch)
+            self.stdout.write(f"Product previews: {built}")
+
+        built = 0
+        for batch in iter_batches(gallery.order_by("pk").iterator(), options["batch_size"]):
+            results = images.build_variants_many(image.image.name for image in batch)
+            for image, variants in zip(batch, results):
+                image.variants = variants
+            ProductImage.objects.bulk_update(batch, ["variants"])
+            product_pks = {image.product_id for image in batch}
+            Product.objects.filter(pk__in=product_pks).update(updated_at=timezone.now())
+            bump_products_versions(product_pks)
+            built += len(batch)
+            self.stdout.write(f"Gallery images: {built}")
+
+        self.stdout.write(self.style.SUCCESS("Image variants are up to date"))
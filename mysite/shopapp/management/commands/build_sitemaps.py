@@ -0,0 +1,30 @@
+import time
+from urllib.parse import urlsplit
+
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.sitemap import build_sitemaps
+
+
+class Command(BaseCommand):
+    """
+    Заранее формирует в хранилище индекс карты сайта и все ее части с
+    товарами для заданного адреса сайта, чтобы поисковые роботы не ждали
+    построения части. Актуальные файлы сохраняются, устаревшие
+    перестраиваются
+
+        manage.py build_sitemaps https://shop.example.com
+    """
+
+    help = "Сформировать части карты сайта для адреса сайта"
+
+    def add_arguments(self, parser):
+        parser.add_argument("base_url", help="адрес сайта, например https://shop.example.com")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["base_url"])
+        if url.scheme not in ("http", "https") or not url.netloc:
+            raise CommandError("base_url must look like https://shop.example.com")
+        started = time.perf_counter()
+        count = build_sitemaps(url.scheme, url.netloc)
+        self.stdout.write(f"Built {count} sitemap shards in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,37 @@
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.query_plans import HOT_QUERIES, plan_problems
+
+
+class Command(BaseCommand):
+    """
+    Выводит план (EXPLAIN QUERY PLAN в SQLite) каждого
+    зарегистрированного частого запроса и отмечает полный просмотр
+    таблиц и сортировку всего результата во временном B-дереве
+    """
+
+    help = "Планы частых запросов к товарам и заказам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fail-on-scan",
+            action="store_true",
+            help="завершиться с ошибкой, если частый запрос просматривает таблицу целиком или сортирует во временном B-дереве",
+        )
+
+    def handle(self, *args, **options):
+        scans = []
+        for name, build_queryset in HOT_QUERIES.items():
+            plan = build_queryset().explain()
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            problems = plan_problems(plan)
+            if problems:
+                scans.append(name)
+                self.stdout.write(self.style.WARNING(", ".join(problems)))
+            self.stdout.write("")
+
+        if not scans:
+            self.stdout.write(self.style.SUCCESS("No full table scans or temp B-tree sorts"))
+        elif options["fail_on_scan"]:
+            raise CommandError(f"Full table scans or temp B-tree sorts in: {', '.join(scans)}")
@@ -0,0 +1,33 @@
+from django.core.management import BaseCommand
+
+from shopapp.common import save_csv_order, CSV_IMPORT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Импорт заказов из CSV-файла (delivery_address, promocode, user, products)
+    """
+
+    help = "Массовый импорт заказов из CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--encoding", default="utf-8")
+        parser.add_argument("--batch-size", type=int, default=CSV_IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Import orders from {options['path']}")
+        with open(options["path"], "rb") as file:
+            report = save_csv_order(
+                file,
+                encoding=options["encoding"],
+                batch_size=options["batch_size"],
+            )
+
+        for line, error in report.errors:
+            self.stderr.write(f"Line {line}: {error}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Orders created: {report.created}, rows with errors: {len(report.errors)}"
+            )
+        )
@@ -0,0 +1,107 @@
+import http.client
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочное HTTP-тестирование запущенных серверов, например для
+    сравнения страниц каталога под WSGI (синхронный gunicorn) и ASGI
+    (воркер uvicorn):
+
+        manage.py load_test \\
+            --url wsgi=http://127.0.0.1:8000/shop/products/ \\
+            --url asgi=http://127.0.0.1:8001/shop/async/products/ \\
+            --concurrency 10 50 200
+    """
+
+    help = "Нагрузочный тест одного или нескольких адресов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            action="append",
+            required=True,
+            help="имя=адрес, можно указать несколько раз",
+        )
+        parser.add_argument("--concurrency", nargs="+", type=int, default=[10, 50, 100])
+        parser.add_argument("--duration", type=float, default=10.0, help="секунд на прогон")
+        parser.add_argument("--timeout", type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        targets = []
+        for item in options["url"]:
+            name, sep, url = item.partition("=")
+            if not sep or "://" in name:
+                name, url = item, item
+            targets.append((name, url))
+
+        self.stdout.write(
+            f"{'target':>10} {'conc':>6} {'req/s':>9} {'p50 ms':>9} "
+            f"{'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+        )
+        for concurrency in options["concurrency"]:
+            for name, url in targets:
+                result = self.run(url, concurrency, options["duration"], options["timeout"])
+                self.stdout.write(
+                    f"{name:>10} {concurrency:>6} {result['rps']:>9.1f} "
+                    f"{result['p50']:>9.1f} {result['p95']:>9.1f} "
+                    f"{result['p99']:>9.1f} {result['errors']:>7}"
+                )
+
+    def run(self, url: str, concurrency: int, duration: float, timeout: float) -> dict:
+        parts = urlsplit(url)
+        if parts.scheme != "http":
+            raise CommandError("Only http:// URLs are supported")
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        deadline = time.monotonic() + duration
+        latencies: list[float] = []
+        errors = 0
+        lock = threading.Lock()
+
+        def worker():
+            nonlocal errors
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+            local_latencies = []
+            local_errors = 0
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    connection.request("GET", path)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        local_errors += 1
+                    else:
+                        local_latencies.append(time.perf_counter() - started)
+                except (OSError, http.client.HTTPException):
+                    local_errors += 1
+                    connection.close()
+            connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                errors += local_errors
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+        elapsed = time.monotonic() - started
+
+        if len(latencies) >= 2:
+            quantiles = statistics.quantiles(latencies, n=100)
+            p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+        else:
+            p50 = p95 = p99 = latencies[0] if latencies else 0.0
+        return {
+            "rps": len(latencies) / elapsed,
+            "p50": p50 * 1000,
+            "p95": p95 * 1000,
+            "p99": p99 * 1000,
+            "errors": errors,
+        }
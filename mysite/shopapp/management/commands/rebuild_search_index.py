@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from shopapp.search import fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    """
+    Перестраивает полнотекстовый индекс поиска товаров
+    """
+
+    help = "Перестроить полнотекстовый индекс товаров"
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            self.stdout.write("Full-text index is available only on SQLite")
+            return
+        self.stdout.write("Rebuild products search index")
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed products: {count}"))
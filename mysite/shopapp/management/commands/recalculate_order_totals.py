@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+
+from shopapp.totals import recalculate_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает хранимые итоги заказов (total_price, total_discount,
+    item_count) по их товарам, например после изменения товаров SQL-запросом
+    """
+
+    help = "Пересчитать итоги заказов"
+
+    def handle(self, *args, **options):
+        fixed = recalculate_order_totals()
+        self.stdout.write(self.style.SUCCESS(f"Orders with fixed totals: {fixed}"))
@@ -0,0 +1,77 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management import BaseCommand
+from django.db import connections
+
+from shopapp.jobs import JOB_POLL_INTERVAL, work, worker_id
+
+
+def _run_process(stop, burst: bool, poll_interval: float) -> None:
+    # Ctrl+C приходит всей группе процессов: текущая задача дорабатывается
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    work(burst=burst, poll_interval=poll_interval, should_stop=stop.is_set)
+
+
+class Command(BaseCommand):
+    """
+    Выполняет фоновые задачи из очереди в БД (импорт и выгрузка CSV из
+    админки, варианты изображений). Каждый процесс берет по одной задаче,
+    SIGINT/SIGTERM останавливают процессы после текущей задачи
+    """
+
+    help = "Запустить обработчики фоновых задач"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1)
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="завершиться, когда очередь опустеет",
+        )
+        parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL)
+
+    def handle(self, *args, **options):
+        processes = max(1, options["processes"])
+        self.stdout.write(f"Starting {processes} worker process(es)")
+        if processes == 1:
+            stop = threading.Event()
+            previous = {
+                signum: signal.signal(signum, lambda *args: stop.set())
+                for signum in (signal.SIGINT, signal.SIGTERM)
+            }
+            try:
+                done = work(
+                    worker=worker_id(),
+                    burst=options["burst"],
+                    poll_interval=options["poll_interval"],
+                    should_stop=stop.is_set,
+                )
+            finally:
+                for signum, handler in previous.items():
+                    signal.signal(signum, handler)
+            self.stdout.write(self.style.SUCCESS(f"Jobs done: {done}"))
+            return
+
+        # соединения с БД не должны наследоваться дочерними процессами
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        stop = context.Event()
+        workers = [
+            context.Process(
+                target=_run_process,
+                args=(stop, options["burst"], options["poll_interval"]),
+                daemon=True,
+            )
+            for _ in range(processes)
+        ]
+        for process in workers:
+            process.start()
+
+        signal.signal(signal.SIGINT, lambda *args: stop.set())
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        for process in workers:
+            process.join()
+        self.stdout.write(self.style.SUCCESS("Workers stopped"))
@@ -0,0 +1,69 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.seeding import SEED_BATCH_SIZE, ShopSeeder
+
+
+class Command(BaseCommand):
+    """
+    Создает большой набор синтетических данных: пользователей с профилями,
+    товары и заказы с правдоподобным количеством товаров (см.
+    shopapp/seeding.py). Одинаковый --seed дает одинаковые данные
+
+        manage.py seed_shop --products 1000000 --users 5000 --orders 1000000
+    """
+
+    help = "Создать большой набор синтетических данных магазина"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--orders", type=int, default=10_000)
+        parser.add_argument(
+            "--products-per-order",
+            type=float,
+            default=3,
+            help="среднее количество товаров в заказе",
+        )
+        parser.add_argument("--max-products-per-order", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=SEED_BATCH_SIZE)
+        parser.add_argument("--prefix", default="seed", help="префикс имен пользователей")
+        parser.add_argument("--password", default="seed", help="пароль созданных пользователей")
+
+    def handle(self, *args, **options):
+        if options["orders"] and not options["users"]:
+            raise CommandError("Orders need at least one user (--users)")
+        if User.objects.filter(username__startswith=f"{options['prefix']}-user-").exists():
+            raise CommandError(
+                f"Users with prefix {options['prefix']!r} already exist, use another --prefix"
+            )
+
+        started = time.perf_counter()
+        seeder = ShopSeeder(
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            prefix=options["prefix"],
+            on_batch=lambda kind, created: self.progress(kind, created, started),
+        )
+        seeder.create_users(options["users"], password=options["password"])
+        seeder.create_products(options["products"])
+        links = seeder.create_orders(
+            options["orders"],
+            products_per_order=options["products_per_order"],
+            max_products_per_order=options["max_products_per_order"],
+        )
+        seeder.finish()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {options['users']} users, {options['products']} products, "
+                f"{options['orders']} orders with {links} order products "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+        )
+
+    def progress(self, kind: str, created: int, started: float) -> None:
+        self.stderr.write(f"{kind}: {created} ({time.perf_counter() - started:.1f}s)")
@@ -0,0 +1,187 @@
+import os
+import statistics
+import tempfile
+import time
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+STRESS_ALIAS = "stress"
+# Профили подключения: стандартный бэкенд Django и настройки проекта
+PROFILES = {
+    "default": {"ENGINE": "django.db.backends.sqlite3", "OPTIONS": {}},
+    "project": {
+        "ENGINE": settings.DATABASES["default"]["ENGINE"],
+        "OPTIONS": settings.DATABASES["default"].get("OPTIONS", {}),
+    },
+}
+SCHEMA = (
+    "CREATE TABLE stress_counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)",
+    "INSERT INTO stress_counter (id, value) VALUES (1, 0)",
+    "CREATE TABLE stress_session (id INTEGER PRIMARY KEY, data TEXT NOT NULL)",
+    "CREATE TABLE stress_order (id INTEGER PRIMARY KEY, worker INTEGER, payload TEXT)",
+)
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный тест профилей подключения к SQLite при одновременных
+    чтении и записи. Процессы-читатели и процессы-писатели (как воркеры
+    gunicorn) работают с одним файлом БД: писатели выполняют транзакции
+    "прочитать-изменить-записать" и обновления вне транзакции, читатели -
+    запросы списков. Для каждого профиля выводит пропускную способность,
+    ошибки "database is locked" и потерянные обновления счетчика
+
+        manage.py stress_sqlite --readers 8 --writers 4 --duration 10
+    """
+
+    help = "Сравнение профилей подключения к SQLite при одновременных чтении и записи"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--duration", type=float, default=5.0, help="секунд на профиль")
+        parser.add_argument(
+            "--profile",
+            action="append",
+            choices=sorted(PROFILES),
+            help="проверяемые профили (по умолчанию все)",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'profile':>8} {'reads/s':>9} {'writes/s':>9} {'errors':>7} "
+            f"{'p95 write ms':>13} {'lost updates':>13}"
+        )
+        for name in options["profile"] or PROFILES:
+            with tempfile.TemporaryDirectory() as directory:
+                result = self.run(PROFILES[name], os.path.join(directory, "stress.sqlite3"), options)
+            self.stdout.write(
+                f"{name:>8} {result['reads'] / options['duration']:>9.0f} "
+                f"{result['writes'] / options['duration']:>9.0f} {result['errors']:>7} "
+                f"{result['p95_write_ms']:>13.1f} {result['lost_updates']:>13}"
+            )
+
+    def run(self, profile: dict, path: str, options: dict) -> dict:
+        connect(profile, path)
+        with connections[STRESS_ALIAS].cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            cursor.executemany(
+                "INSERT INTO stress_session (id, data) VALUES (%s, %s)",
+                [(number, "") for number in range(options["writers"])],
+            )
+        connections.close_all()
+
+        context = get_context("fork")
+        queue = context.Queue()
+        # все процессы начинают одновременно, после запуска последнего
+        start = time.time() + 0.5
+        deadline = start + options["duration"]
+        workers = [
+            context.Process(
+                target=worker,
+                args=(profile, path, role, number, start, deadline, queue),
+            )
+            for role, count in (("reader", options["readers"]), ("writer", options["writers"]))
+            for number in range(count)
+        ]
+        for process in workers:
+            process.start()
+        results = [queue.get() for _ in workers]
+        for process in workers:
+            process.join()
+
+        writes = sum(result["ops"] for result in results if result["role"] == "writer")
+        transactions = sum(result["transactions"] for result in results)
+        latencies = [ms for result in results for ms in result["latencies"]]
+        connect(profile, path)
+        with connections[STRESS_ALIAS].cursor() as cursor:
+            cursor.execute("SELECT value FROM stress_counter WHERE id = 1")
+            counter = cursor.fetchone()[0]
+        connections[STRESS_ALIAS].close()
+        return {
+            "reads": sum(result["ops"] for result in results if result["role"] == "reader"),
+            "writes": writes,
+            "errors": sum(result["errors"] for result in results),
+            "p95_write_ms": (
+                statistics.quantiles(latencies, n=20)[18] if len(latencies) >= 2 else 0.0
+            ),
+            "lost_updates": transactions - counter,
+        }
+
+
+def connect(profile: dict, path: str) -> None:
+    """
+    Подключение STRESS_ALIAS к файлу path с настройками профиля
+    """
+    database = {**profile, "NAME": path}
+    connections.settings[STRESS_ALIAS] = connections.configure_settings(
+        {"default": database}
+    )["default"]
+    try:
+        # соединение со старыми настройками (предыдущий профиль)
+        del connections[STRESS_ALIAS]
+    except AttributeError:
+        pass
+
+
+def worker(
+    profile: dict,
+    path: str,
+    role: str,
+    number: int,
+    start: float,
+    deadline: float,
+    queue,
+) -> None:
+    connect(profile, path)
+    connection = connections[STRESS_ALIAS]
+    ops = errors = transactions = 0
+    latencies = []
+    time.sleep(max(0.0, start - time.time()))
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            if role == "reader":
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT count(*), max(id) FROM stress_order")
+                    cursor.fetchone()
+                    cursor.execute("SELECT * FROM stress_order ORDER BY id DESC LIMIT 20")
+                    cursor.fetchall()
+            elif ops % 2:
+                # запись вне транзакции (как сохранение сессии)
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "UPDATE stress_session SET data = %s WHERE id = %s",
+                        [str(ops), number],
+                    )
+            else:
+                # чтение и запись в одной транзакции (как get_or_create, update_or_create)
+                with transaction.atomic(using=STRESS_ALIAS), connection.cursor() as cursor:
+                    cursor.execute("SELECT value FROM stress_counter WHERE id = 1")
+                    value = cursor.fetchone()[0]
+                    cursor.execute("UPDATE stress_counter SET value = %s WHERE id = 1", [value + 1])
+                    cursor.execute(
+                        "INSERT INTO stress_order (worker, payload) VALUES (%s, %s)",
+                        [number, "x" * 200],
+                    )
+                transactions += 1
+        except OperationalError:
+            errors += 1
+            continue
+        ops += 1
+        if role == "writer":
+            latencies.append((time.perf_counter() - started) * 1000)
+    connection.close()
+    queue.put(
+        {
+            "role": role,
+            "ops": ops,
+            "errors": errors,
+            "transactions": transactions,
+            "latencies": latencies,
+        }
+    )
@@ -0,0 +1,54 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Копирует основную БД SQLite в локальные реплики для чтения
+    (settings.DATABASE_REPLICAS, см. mysite/replicas.py) через backup API,
+    поэтому читатели реплики не видят файл, скопированный наполовину.
+    С --interval копирует периодически, имитируя отставание репликации:
+
+        DJANGO_DATABASE_REPLICAS=2 manage.py sync_replicas --interval 10
+    """
+
+    help = "Скопировать основную БД SQLite в локальные реплики"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="повторять каждые N секунд (меньше REPLICA_MAX_LAG)",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured, set DJANGO_DATABASE_REPLICAS")
+        while True:
+            started = time.perf_counter()
+            for alias in settings.DATABASE_REPLICAS:
+                copy_database(settings.DATABASES["default"]["NAME"], settings.DATABASES[alias]["NAME"])
+            self.stdout.write(
+                f"Synced {len(settings.DATABASE_REPLICAS)} replicas "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
+
+
+def copy_database(source: str, target: str) -> None:
+    """
+    Копирует файл SQLite source в target через backup API: копия
+    согласованна, даже если в source в это время пишут
+    """
+    primary = sqlite3.connect(source)
+    replica = sqlite3.connect(target)
+    try:
+        primary.backup(replica)
+    finally:
+        replica.close()
+        primary.close()
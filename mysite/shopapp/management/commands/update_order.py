@@ -1,6 +1,7 @@
 from django.core.management import BaseCommand
 
 from shopapp.models import Order, Product
+from shopapp.order_lines import bulk_add_products
 
 
 class Command(BaseCommand):
@@ -10,12 +11,7 @@ class Command(BaseCommand):
             self.stdout.write("no order found")
             return
 
-        products = Product.objects.all()
-
-        for product in products:
-            order.products.add(product)
-
-        order.save()
+        bulk_add_products([order.pk], Product.objects.values_list("pk", flat=True))
 
         self.stdout.write(
             self.style.SUCCESS(
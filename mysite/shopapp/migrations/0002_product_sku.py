@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="sku",
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
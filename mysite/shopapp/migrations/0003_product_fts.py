@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_product_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    from shopapp.search import FTS_TABLE, create_index_sql
+
+    schema_editor.execute(create_index_sql())
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE}(rowid, name, description) "
+        "SELECT id, name, description FROM shopapp_product"
+    )
+
+
+def drop_product_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    from shopapp.search import FTS_TABLE
+
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0002_product_sku"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_product_fts, drop_product_fts),
+    ]
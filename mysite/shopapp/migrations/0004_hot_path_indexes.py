@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0003_product_fts"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "-created_at"], name="order_user_created_at_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["name", "price"], name="product_name_price_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("archived", False)),
+                fields=["name", "price"],
+                name="product_active_name_price_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["-created_at"], name="product_created_at_idx"),
+        ),
+    ]
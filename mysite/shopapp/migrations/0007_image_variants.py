@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0006_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="preview_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="productimage",
+            name="variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
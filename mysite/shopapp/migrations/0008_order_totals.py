@@ -0,0 +1,61 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_order_totals(apps, schema_editor):
+    from shopapp.totals import products_totals
+
+    Order = apps.get_model("shopapp", "Order")
+    through = Order.products.through
+    rows = {}
+    for order_id, price, discount in through.objects.values_list(
+        "order_id", "product__price", "product__discount"
+    ).iterator():
+        rows.setdefault(order_id, []).append((price, discount))
+
+    orders = []
+    for order in Order.objects.filter(pk__in=rows).only("pk"):
+        order.total_price, order.total_discount, order.item_count = products_totals(
+            rows[order.pk]
+        )
+        orders.append(order)
+    Order.objects.bulk_update(
+        orders, ["total_price", "total_discount", "item_count"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0007_image_variants"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="item_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total_discount",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total_price",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["total_price"], name="order_total_price_idx"),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
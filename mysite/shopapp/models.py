@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.shortcuts import reverse
+from django.utils import timezone
 
 def product_preview_directory_path(instance: "Product", filename: str) -> str:
     return "products/product_{pk}/preview/{filename}".format(
@@ -12,14 +13,31 @@ def product_preview_directory_path(instance: "Product", filename: str) -> str:
 class Product(models.Model):
     class Meta:
         ordering = ["name", "price"]
+        indexes = [
+            # сортировка по умолчанию (Meta.ordering, API)
+            models.Index(fields=["name", "price"], name="product_name_price_idx"),
+            # ProductsListView: только не архивные товары в порядке Meta.ordering
+            models.Index(
+                fields=["name", "price"],
+                condition=models.Q(archived=False),
+                name="product_active_name_price_idx",
+            ),
+            # LatestProductsFeed, ShopSitemap
+            models.Index(fields=["-created_at"], name="product_created_at_idx"),
+        ]
 
     name = models.CharField(max_length=100)
+    # Артикул - естественный ключ товара для обновления при импорте из CSV
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     description = models.TextField(null=False, blank=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
     discount = models.SmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     archived = models.BooleanField(default=False)
     preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path)
+    # уменьшенные копии превью (см. shopapp.images)
+    preview_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Product(pk={self.pk}, name={self.name!r})"
@@ -39,12 +57,84 @@ class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="images")
     image = models.ImageField(upload_to=product_images_directory_path)
     description = models.CharField(max_length=200, null=False, blank=True)
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
 
 class Order(models.Model):
+    class Meta:
+        indexes = [
+            # UserOrdersListView: заказы пользователя, новые первыми
+            models.Index(fields=["user", "-created_at"], name="order_user_created_at_idx"),
+            # API: сортировка и фильтр по сумме заказа
+            models.Index(fields=["total_price"], name="order_total_price_idx"),
+        ]
+
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     products = models.ManyToManyField(Product, related_name="orders")
     receipt = models.FileField(null=True, upload_to='orders/receipts/')
+    # итоги по товарам заказа, поддерживаются сигналами (см. shopapp.totals)
+    total_price = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    total_discount = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+
+
+class Job(models.Model):
+    """
+    Фоновая задача (импорт/экспорт CSV), выполняется командой run_worker
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = "queued"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            # выбор очередной задачи воркером
+            models.Index(fields=["status", "run_after"], name="job_status_run_after_idx"),
+        ]
+
+    kind = models.CharField(max_length=64)
+    params = models.JSONField(default=dict, blank=True)
+    file = models.FileField(null=True, blank=True, upload_to="jobs/")
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.QUEUED)
+    # обработано строк и процент выполнения
+    processed = models.PositiveIntegerField(default=0)
+    progress = models.PositiveSmallIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Job(pk={self.pk}, kind={self.kind!r}, status={self.status!r})"
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.Status.DONE, self.Status.FAILED)
+
+    def as_status(self) -> dict:
+        return {
+            "id": self.pk,
+            "kind": self.kind,
+            "status": self.status,
+            "processed": self.processed,
+            "progress": self.progress,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "result": self.result,
+            "error": self.error,
+            "finished": self.is_finished,
+        }
@@ -0,0 +1,106 @@
+"""
+Массовое изменение состава заказов: добавление, удаление и замена
+товаров сразу во многих заказах.
+
+Изменения выполняются несколькими запросами к промежуточной таблице
+Order.products.through (INSERT ... SELECT и DELETE по множествам)
+в одной транзакции. Вместо m2m_changed на каждый заказ отправляется
+один сигнал order_products_bulk_changed, его обработчик пересчитывает
+итоги и инвалидирует выгрузки (см. shopapp.signals)
+"""
+
+from typing import Iterable
+
+from django.db import connection, transaction
+
+from .models import Order, Product
+from .signals import order_products_bulk_changed
+
+# Заказов в одном INSERT ... SELECT (ограничение на число параметров SQL)
+BULK_INSERT_CHUNK_SIZE = 500
+
+
+def _chunks(pks: list[int], size: int):
+    for start in range(0, len(pks), size):
+        yield pks[start:start + size]
+
+
+def _insert_links(order_pks: list[int], product_pks: list[int]) -> int:
+    """
+    Добавляет связи всех заказов со всеми товарами, кроме уже
+    существующих. Несуществующие pk пропускаются
+    """
+    through = Order.products.through
+    quote = connection.ops.quote_name
+    table = quote(through._meta.db_table)
+    order_column = quote(through._meta.get_field("order").column)
+    product_column = quote(through._meta.get_field("product").column)
+    order_pk = quote(Order._meta.pk.column)
+    product_pk = quote(Product._meta.pk.column)
+    products = ", ".join(["%s"] * len(product_pks))
+
+    inserted = 0
+    with connection.cursor() as cursor:
+        for chunk in _chunks(order_pks, BULK_INSERT_CHUNK_SIZE):
+            orders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                f"INSERT INTO {table} ({order_column}, {product_column}) "
+                f"SELECT o.{order_pk}, p.{product_pk} "
+                f"FROM {quote(Order._meta.db_table)} o, {quote(Product._meta.db_table)} p "
+                f"WHERE o.{order_pk} IN ({orders}) AND p.{product_pk} IN ({products}) "
+                f"AND NOT EXISTS (SELECT 1 FROM {table} t "
+                f"WHERE t.{order_column} = o.{order_pk} AND t.{product_column} = p.{product_pk})",
+                [*chunk, *product_pks],
+            )
+            inserted += cursor.rowcount
+    return inserted
+
+
+def _change_products(
+    action: str,
+    order_pks: Iterable[int],
+    product_pks: Iterable[int],
+) -> dict:
+    order_pks = sorted(set(order_pks))
+    product_pks = sorted(set(product_pks))
+    links = Order.products.through.objects.filter(order_id__in=order_pks)
+
+    added = removed = 0
+    with transaction.atomic():
+        if action == "remove":
+            removed, _ = links.filter(product_id__in=product_pks).delete()
+        elif action == "replace":
+            removed, _ = links.exclude(product_id__in=product_pks).delete()
+        if action in ("add", "replace") and order_pks and product_pks:
+            added = _insert_links(order_pks, product_pks)
+        if added or removed:
+            order_products_bulk_changed.send(
+                sender=Order,
+                action=action,
+                order_pks=order_pks,
+                product_pks=product_pks,
+            )
+    return {"orders": len(order_pks), "added": added, "removed": removed}
+
+
+def bulk_add_products(order_pks: Iterable[int], product_pks: Iterable[int]) -> dict:
+    """
+    Добавляет товары в каждый из заказов. Возвращает количество
+    заказов и добавленных/удаленных связей
+    """
+    return _change_products("add", order_pks, product_pks)
+
+
+def bulk_remove_products(order_pks: Iterable[int], product_pks: Iterable[int]) -> dict:
+    """
+    Удаляет товары из каждого из заказов
+    """
+    return _change_products("remove", order_pks, product_pks)
+
+
+def bulk_replace_products(order_pks: Iterable[int], product_pks: Iterable[int]) -> dict:
+    """
+    Делает состав каждого из заказов равным product_pks
+    (пустой список очищает заказы)
+    """
+    return _change_products("replace", order_pks, product_pks)
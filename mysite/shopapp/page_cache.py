@@ -0,0 +1,82 @@
+from hashlib import md5
+from typing import Iterable
+
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from mysite.replicas import replica_cache_timeout
+
+from .versioning import get_version, bump_version
+
+# Время жизни закешированной страницы каталога, секунды
+PAGE_CACHE_TIMEOUT = 600
+
+CATALOG_VERSION_KEY = "catalog_version"
+
+
+def product_version_key(pk: int) -> str:
+    return f"product_version_{pk}"
+
+
+def catalog_version() -> int:
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def product_version(pk: int) -> int:
+    return get_version(product_version_key(pk))
+
+
+def bump_catalog_version() -> None:
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def bump_products_versions(pks: Iterable[int]) -> None:
+    """
+    Инвалидирует страницы указанных товаров и страницы списка каталога
+    """
+    for pk in pks:
+        bump_version(product_version_key(pk))
+    bump_catalog_version()
+
+
+class VersionedPageCacheMixin:
+    """
+    Кеширует отрендеренную страницу для анонимных GET-запросов.
+    В ключ входит версия данных (get_page_version), поэтому изменения
+    каталога сразу дают новый ключ, а попадание в кеш не обращается к БД
+    """
+
+    page_cache_timeout = PAGE_CACHE_TIMEOUT
+
+    def get_page_version(self) -> str:
+        raise NotImplementedError
+
+    def get_page_cache_key(self, request: HttpRequest) -> str:
+        path = md5(request.get_full_path().encode()).hexdigest()
+        return f"page_{self.get_page_version()}_{path}"
+
+    def dispatch(self, request: HttpRequest, *args, **kwargs):
+        if request.method != "GET" or request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        # kwargs нужны для версии страницы до вызова setup() в dispatch
+        self.kwargs = kwargs
+        cache_key = self.get_page_cache_key(request)
+        response = cache.get(cache_key)
+        if response is not None:
+            # условный GET по валидаторам закешированной страницы, без БД
+            return get_conditional_response(
+                request,
+                etag=response.get("ETag"),
+                last_modified=parse_http_date_safe(response.get("Last-Modified", "")),
+                response=response,
+            )
+
+        response: HttpResponse = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            if hasattr(response, "render"):
+                response.render()
+            cache.set(cache_key, response, replica_cache_timeout(self.page_cache_timeout))
+        return response
@@ -0,0 +1,210 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError as FieldValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# значения позиции в курсоре - только скаляры JSON
+CURSOR_VALUE_TYPES = (str, int, float, bool, type(None))
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Постраничный вывод с опциональным keyset (cursor) режимом.
+
+    По умолчанию работает как PageNumberPagination (?page=N).
+    Если в запросе есть параметр ?cursor= (в том числе пустой), страница
+    выбирается условием WHERE по значениям полей сортировки последней
+    записи предыдущей страницы: без COUNT(*) и без OFFSET, поэтому время
+    ответа не зависит от глубины листания. К сортировке всегда добавляется
+    pk, чтобы порядок был однозначным при одинаковых name/price/discount
+    """
+
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+    tie_breaker = "pk"
+
+    def is_keyset_request(self, request) -> bool:
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_keyset_request(request):
+            self.keyset = False
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.ordering = self.get_ordering(queryset)
+        position, self.reverse = self.decode_cursor(request, queryset)
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [self.invert(field) for field in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+
+        # выборка страницы (с лишней строкой - признаком следующей)
+        # для валидаторов условного GET, см. ConditionalGetMixin
+        self.page_queryset = queryset[: page_size + 1]
+        rows = list(self.page_queryset)
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if self.reverse:
+            rows.reverse()
+
+        # В прямом направлении "еще есть" означает следующую страницу,
+        # в обратном - предыдущую
+        if self.reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.first_row = rows[0] if rows else None
+        self.last_row = rows[-1] if rows else None
+        self.display_page_controls = False
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or self.last_row is None:
+            return None
+        return self.encode_cursor(self.last_row, reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or self.first_row is None:
+            return None
+        return self.encode_cursor(self.first_row, reverse=True)
+
+    def get_ordering(self, queryset: QuerySet) -> list[str]:
+        """
+        Сортировка, уже примененная OrderingFilter (или Meta.ordering модели),
+        дополненная уникальным полем для разрешения равенств. Аннотации
+        (например, search_rank поиска) допускаются: их значения есть в
+        каждой строке и сравниваются в WHERE так же, как поля
+        """
+        opts = queryset.model._meta
+        ordering = list(queryset.query.order_by or opts.ordering)
+        for field in ordering:
+            if not isinstance(field, str) or "__" in field:
+                raise ValidationError(f"Ordering by {field} is not supported with cursor")
+            name = field.lstrip("-")
+            if name in queryset.query.annotations:
+                continue
+            model_field = opts.pk if name == "pk" else opts.get_field(name)
+            if not model_field.concrete or model_field.null or model_field.many_to_many:
+                raise ValidationError(f"Ordering by {name} is not supported with cursor")
+
+        names = {field.lstrip("-") for field in ordering}
+        if not names & {self.tie_breaker, opts.pk.name}:
+            ordering.append(self.tie_breaker)
+        return ordering
+
+    @staticmethod
+    def invert(field: str) -> str:
+        return field[1:] if field.startswith("-") else "-" + field
+
+    @staticmethod
+    def after(ordering: list[str], position: list) -> Q:
+        """
+        Условие "строго после позиции" для составного ключа сортировки:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def make_cursor(self, row, reverse: bool) -> str:
+        # строки - экземпляры модели или словари values() (FastReadMixin)
+        position = [
+            self.dump_value(row[name] if isinstance(row, dict) else getattr(row, name))
+            for name in (field.lstrip("-") for field in self.ordering)
+        ]
+        payload = json.dumps({"p": position, "r": reverse}, separators=(",", ":"))
+        return urlsafe_b64encode(payload.encode()).decode()
+
+    def encode_cursor(self, row, reverse: bool) -> str:
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.make_cursor(row, reverse))
+
+    def decode_cursor(self, request, queryset: QuerySet) -> tuple[list | None, bool]:
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(cursor.encode()))
+            position, reverse = payload["p"], bool(payload["r"])
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError("Cursor position does not match ordering")
+            position = [
+                self.load_value(queryset, field, value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, KeyError, FieldValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def load_value(queryset: QuerySet, field: str, value):
+        """
+        Значение позиции, приведенное к типу поля сортировки. Поля
+        сортировки не допускают NULL, поэтому None в курсоре - ошибка
+        """
+        if not isinstance(value, CURSOR_VALUE_TYPES) or value is None:
+            raise TypeError(f"Unexpected cursor value {value!r}")
+        name = field.lstrip("-")
+        if name in queryset.query.annotations:
+            return value
+        opts = queryset.model._meta
+        model_field = opts.pk if name == "pk" else opts.get_field(name)
+        value = model_field.to_python(value)
+        if value is None:
+            raise ValueError(f"Empty cursor value for {name}")
+        return value
+
+    @staticmethod
+    def dump_value(value):
+        if isinstance(value, (Decimal, datetime)):
+            return str(value)
+        return value
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append(
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Keyset pagination cursor. Pass an empty value for the first page",
+                "schema": {"type": "string"},
+            }
+        )
+        return parameters
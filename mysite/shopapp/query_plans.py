@@ -0,0 +1,80 @@
+import re
+from typing import Callable
+
+from django.db.models import QuerySet
+
+from .models import Product, Order
+from .sitemap import ShopSitemap
+
+# Реестр горячих запросов: имя -> функция, строящая queryset
+HOT_QUERIES: dict[str, Callable[[], QuerySet]] = {}
+
+
+def hot_query(name: str):
+    """
+    Регистрирует запрос, план которого проверяет команда explain_hot_queries
+    """
+
+    def decorator(func: Callable[[], QuerySet]):
+        HOT_QUERIES[name] = func
+        return func
+
+    return decorator
+
+
+# Строки плана SQLite (explain() Django: "<id> <parent> 0 <detail>"):
+# полный перебор таблицы - "SCAN <table>" без "USING [COVERING] INDEX"
+# (поиск FTS5 - "SCAN <table> VIRTUAL TABLE", подзапрос - "SCAN (subquery-N)"),
+# сортировка всей выборки во временном B-дереве - "USE TEMP B-TREE FOR ORDER BY"
+# ("... FOR RIGHT PART OF ORDER BY" - досортировка внутри групп индекса)
+FULL_SCAN_RE = re.compile(r"\bSCAN (?!CONSTANT ROW\b)(\w+)\b(?! USING| VIRTUAL TABLE)")
+TEMP_SORT_RE = re.compile(r"\bUSE TEMP B-TREE FOR ORDER BY\b")
+
+
+def plan_problems(plan: str) -> list[str]:
+    """
+    Полные переборы таблиц и сортировки всей выборки в плане запроса
+    """
+    problems = []
+    for line in plan.splitlines():
+        if match := FULL_SCAN_RE.search(line):
+            problems.append(f"full table scan of {match.group(1)}")
+        if TEMP_SORT_RE.search(line):
+            problems.append("temp B-tree for ORDER BY")
+    return problems
+
+
+@hot_query("products_list")
+def products_list() -> QuerySet:
+    # ProductsListView
+    return Product.objects.filter(archived=False)
+
+
+@hot_query("products_api")
+def products_api() -> QuerySet:
+    # ProductViewSet, сортировка по умолчанию
+    return Product.objects.all()
+
+
+@hot_query("latest_products_feed")
+def latest_products_feed() -> QuerySet:
+    # LatestProductsFeed
+    return Product.objects.order_by("-created_at")[:3]
+
+
+@hot_query("shop_sitemap")
+def shop_sitemap() -> QuerySet:
+    # ShopSitemap, один шард
+    return ShopSitemap(shard=0).items()
+
+
+@hot_query("user_orders_list")
+def user_orders_list() -> QuerySet:
+    # UserOrdersListView
+    return Order.objects.filter(user_id=1).order_by("-created_at")
+
+
+@hot_query("orders_by_total")
+def orders_by_total() -> QuerySet:
+    # OrderViewSet: ?total_price__gte=...&ordering=-total_price
+    return Order.objects.filter(total_price__gte=100).order_by("-total_price", "pk")
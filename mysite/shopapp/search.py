@@ -0,0 +1,114 @@
+import re
+from typing import Iterable
+
+from django.db import connection
+from django.db.models import QuerySet
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from .models import Product
+
+# Полнотекстовый индекс товаров (SQLite FTS5), rowid = pk товара
+FTS_TABLE = "shopapp_product_fts"
+FTS_INDEX_BATCH_SIZE = 2000
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_available() -> bool:
+    return connection.vendor == "sqlite"
+
+
+def create_index_sql() -> str:
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "name, description, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+
+
+def build_match_query(term: str) -> str:
+    """
+    Превращает пользовательский ввод в безопасный запрос FTS5:
+    каждое слово ищется по префиксу, все слова обязательны
+    """
+    return " ".join(f'"{token}"*' for token in TOKEN_RE.findall(term))
+
+
+def index_products(products: Iterable[Product]) -> None:
+    if not fts_available():
+        return
+    rows = [(p.pk, p.name, p.description) for p in products if p.pk is not None]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {FTS_TABLE}(rowid, name, description) VALUES (%s, %s, %s)",
+            rows,
+        )
+
+
+def unindex_products(pks: Iterable[int]) -> None:
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+            [(pk,) for pk in pks],
+        )
+
+
+def rebuild_index(batch_size: int = FTS_INDEX_BATCH_SIZE) -> int:
+    """
+    Полностью пересобирает индекс по таблице товаров
+    """
+    if not fts_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(create_index_sql())
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description) "
+            f"SELECT id, name, description FROM {Product._meta.db_table}"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def search_products(queryset: QuerySet, term: str) -> QuerySet:
+    """
+    Отбирает товары по полнотекстовому индексу и сортирует по релевантности
+    (bm25, аннотация search_rank; меньше - релевантнее). Аннотация, а не
+    extra(): ее видят values() (FastReadMixin) и курсор KeysetPagination
+    """
+    match = build_match_query(term)
+    if not match:
+        return queryset
+    if not fts_available():
+        return queryset.filter(name__icontains=term) | queryset.filter(
+            description__icontains=term
+        )
+    product_table = Product._meta.db_table
+    matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+    # FTS5 находит строку по rowid вместе с MATCH без полного перебора
+    rank = RawSQL(
+        f"SELECT bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH %s AND rowid = {product_table}.id",
+        (match,),
+    )
+    return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by("search_rank", "pk")
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Поиск по параметру ?search= через полнотекстовый индекс FTS5
+    вместо LIKE '%term%' по каждому полю
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not fts_available() or queryset.model is not Product:
+            return super().filter_queryset(request, queryset, view)
+        term = " ".join(self.get_search_terms(request))
+        if not term:
+            return queryset
+        return search_products(queryset, term)
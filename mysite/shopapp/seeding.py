@@ -0,0 +1,217 @@
+"""
+Генератор синтетических данных магазина (команды seed_shop и bench).
+
+Строки вставляются пачками через bulk_create, связи заказов с товарами -
+напрямую в промежуточную таблицу Order.products.through (executemany).
+Сигналы при этом не срабатывают, поэтому итоги заказов считаются
+здесь же (в копейках, без обращений к БД), а полнотекстовый индекс
+и версии кеша обновляются в конце.
+
+Данные детерминированы: одинаковый seed дает одинаковый набор.
+Популярность товаров неравномерна (немногие товары встречаются в
+большинстве заказов), количество товаров в заказе распределено
+экспоненциально вокруг среднего
+"""
+
+from array import array
+from decimal import Decimal
+from random import Random
+from typing import Callable, Iterable
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from myauth.models import Profile
+
+from .models import Order, Product
+from .page_cache import bump_catalog_version
+from .search import rebuild_index
+from .sitemap import invalidate_sitemap_shards
+
+# Строк в одной пачке bulk_create
+SEED_BATCH_SIZE = 5000
+# Чем больше, тем сильнее заказы сосредоточены на первых товарах
+POPULARITY_SKEW = 3.0
+# Доля архивных товаров
+ARCHIVED_SHARE = 0.05
+
+ADJECTIVES = (
+    "Compact", "Classic", "Wireless", "Smart", "Portable", "Premium",
+    "Ergonomic", "Rugged", "Slim", "Modern", "Vintage", "Digital",
+)
+NOUNS = (
+    "Laptop", "Desktop", "Smartphone", "Tablet", "Monitor", "Keyboard",
+    "Mouse", "Headphones", "Speaker", "Camera", "Router", "Printer",
+)
+FEATURES = (
+    "fast charging", "long battery life", "metal body", "backlight",
+    "two year warranty", "USB-C", "water resistant", "low noise",
+)
+STREETS = ("Lenina", "Mira", "Pushkina", "Sadovaya", "Tsentralnaya", "Lesnaya")
+
+
+def insert_order_products(rows: Iterable[tuple[int, int]]) -> None:
+    """
+    Вставляет пары (заказ, товар) в промежуточную таблицу одним
+    executemany: создание миллионов экземпляров модели через ORM
+    занимает больше времени, чем сама вставка
+    """
+    through = Order.products.through
+    quote = connection.ops.quote_name
+    sql = "INSERT INTO {} ({}, {}) VALUES (%s, %s)".format(
+        quote(through._meta.db_table),
+        quote(through._meta.get_field("order").column),
+        quote(through._meta.get_field("product").column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, list(rows))
+
+
+class ShopSeeder:
+    """
+    Создает пользователей (с Profile), товары и заказы. Созданные
+    товары запоминаются в компактных массивах (pk, цена в копейках,
+    скидка), по которым строятся заказы и их итоги
+    """
+
+    def __init__(
+        self,
+        seed: int = 42,
+        batch_size: int = SEED_BATCH_SIZE,
+        prefix: str = "seed",
+        on_batch: Callable[[str, int], None] | None = None,
+    ):
+        self.random = Random(seed)
+        self.batch_size = batch_size
+        self.prefix = prefix
+        # вызывается после каждой пачки: (вид строк, создано всего)
+        self.on_batch = on_batch or (lambda kind, created: None)
+        self.user_pks = array("q")
+        self.product_pks = array("q")
+        self.product_cents = array("q")
+        self.product_discounts = array("b")
+
+    def batches(self, count: int):
+        for start in range(0, count, self.batch_size):
+            yield range(start, min(start + self.batch_size, count))
+
+    def create_users(self, count: int, password: str = "seed") -> list[User]:
+        """
+        Пользователи с профилями. Пароль хешируется один раз на всех
+        """
+        password_hash = make_password(password)
+        created = []
+        for batch in self.batches(count):
+            with transaction.atomic():
+                users = User.objects.bulk_create(
+                    User(username=f"{self.prefix}-user-{i}", password=password_hash)
+                    for i in batch
+                )
+                Profile.objects.bulk_create(Profile(user=user) for user in users)
+            self.user_pks.extend(user.pk for user in users)
+            created += users
+            self.on_batch("users", len(self.user_pks))
+        return created
+
+    def create_products(self, count: int) -> None:
+        random = self.random
+        for batch in self.batches(count):
+            products = []
+            for i in batch:
+                products.append(
+                    Product(
+                        name=f"{random.choice(ADJECTIVES)} {random.choice(NOUNS)} {i}",
+                        description=", ".join(random.sample(FEATURES, 3)).capitalize(),
+                        price=Decimal(random.randint(100, 100_000)).scaleb(-2),
+                        discount=random.choice((0, 0, 0, 5, 10, 15, 20)),
+                        archived=random.random() < ARCHIVED_SHARE,
+                    )
+                )
+            Product.objects.bulk_create(products)
+            for product in products:
+                self.product_pks.append(product.pk)
+                self.product_cents.append(int(product.price * 100))
+                self.product_discounts.append(product.discount)
+            self.on_batch("products", len(self.product_pks))
+
+    def pick_products(self, count: int) -> set[int]:
+        """
+        Индексы count разных товаров с учетом популярности
+        """
+        total = len(self.product_pks)
+        count = min(count, total)
+        if count * 2 > total:
+            # редкие товары долго выпадали бы при отборе по популярности
+            return set(self.random.sample(range(total), count))
+        picked = set()
+        while len(picked) < count:
+            picked.add(int(total * self.random.random() ** POPULARITY_SKEW))
+        return picked
+
+    def order_size(self, mean: float, limit: int) -> int:
+        if mean <= 1:
+            return 1
+        return min(limit, 1 + int(self.random.expovariate(1 / (mean - 1))))
+
+    def create_orders(
+        self,
+        count: int,
+        products_per_order: float = 3,
+        max_products_per_order: int = 20,
+    ) -> int:
+        """
+        Заказы случайных пользователей со случайным набором товаров.
+        Возвращает количество созданных связей заказ-товар
+        """
+        if not self.user_pks:
+            raise ValueError("Create users before orders")
+        random = self.random
+        links = created = 0
+        for batch in self.batches(count):
+            orders, order_products = [], []
+            for i in batch:
+                indexes = (
+                    self.pick_products(self.order_size(products_per_order, max_products_per_order))
+                    if self.product_pks
+                    else ()
+                )
+                cents = discount_cents = 0
+                for index in indexes:
+                    price = self.product_cents[index]
+                    cents += price
+                    # discount_amount() в копейках: округление половины вверх
+                    discount_cents += (price * self.product_discounts[index] + 50) // 100
+                orders.append(
+                    Order(
+                        delivery_address=f"ul {random.choice(STREETS)}, d {random.randint(1, 200)}",
+                        promocode=random.choice(("", "", "", "SALE10", "WELCOME")),
+                        user_id=random.choice(self.user_pks),
+                        total_price=Decimal(cents).scaleb(-2),
+                        total_discount=Decimal(discount_cents).scaleb(-2),
+                        item_count=len(indexes),
+                    )
+                )
+                order_products.append(indexes)
+
+            with transaction.atomic():
+                Order.objects.bulk_create(orders)
+                insert_order_products(
+                    (order.pk, self.product_pks[index])
+                    for order, indexes in zip(orders, order_products)
+                    for index in indexes
+                )
+            links += sum(map(len, order_products))
+            created += len(orders)
+            self.on_batch("orders", created)
+        return links
+
+    def finish(self) -> None:
+        """
+        Пересобирает полнотекстовый индекс, сбрасывает кеш каталога
+        и карту сайта (bulk_create не вызывает сигналы)
+        """
+        if self.product_pks:
+            rebuild_index()
+        bump_catalog_version()
+        invalidate_sitemap_shards(self.product_pks)
@@ -1,14 +1,42 @@
+from django.contrib.auth.models import User
 from rest_framework import serializers
 
-from .models import Product, Order
+from .expand import ExpandableModelSerializer
+from .models import Product, ProductImage, Order
 
+# Наибольшее количество заказов и товаров в одном запросе к bulk-методам заказов
+BULK_ORDERS_LIMIT = 10_000
+BULK_PRODUCTS_LIMIT = 1000
 
-class ProductSerializer(serializers.ModelSerializer):
+
+class ProductImageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductImage
+        fields = [
+            "pk",
+            "image",
+            "description",
+        ]
+
+
+class UserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = [
+            "pk",
+            "username",
+            "first_name",
+            "last_name",
+        ]
+
+
+class ProductSerializer(ExpandableModelSerializer):
     class Meta:
         model = Product
         fields = [
             "pk",
             "name",
+            "sku",
             "description",
             "price",
             "discount",
@@ -16,9 +44,12 @@ class ProductSerializer(serializers.ModelSerializer):
             "archived",
             "preview",
         ]
+        expandable = {
+            "images": ProductImageSerializer,
+        }
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(ExpandableModelSerializer):
     class Meta:
         model = Order
         fields = [
@@ -29,7 +60,46 @@ class OrderSerializer(serializers.ModelSerializer):
             "user",
             "products",
             "receipt",
+            "total_price",
+            "total_discount",
+            "item_count",
         ]
+        expandable = {
+            "products": ProductSerializer,
+            "user": UserSerializer,
+        }
+
+
+class OrderProductsBulkSerializer(serializers.Serializer):
+    orders = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_ORDERS_LIMIT,
+    )
+    products = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=BULK_PRODUCTS_LIMIT,
+    )
+
+    @staticmethod
+    def check_exist(model, pks: list[int]) -> list[int]:
+        # Одним запросом, а не по запросу на pk, как PrimaryKeyRelatedField
+        missing = set(pks) - set(model.objects.filter(pk__in=pks).values_list("pk", flat=True))
+        if missing:
+            raise serializers.ValidationError(f"Not found: {sorted(missing)[:20]}")
+        return pks
+
+    def validate_orders(self, value: list[int]) -> list[int]:
+        return self.check_exist(Order, value)
+
+    def validate_products(self, value: list[int]) -> list[int]:
+        return self.check_exist(Product, value)
+
+
+class OrderProductsBulkResultSerializer(serializers.Serializer):
+    orders = serializers.IntegerField()
+    added = serializers.IntegerField()
+    removed = serializers.IntegerField()
 
 
 class OrderFullSerializer(serializers.ModelSerializer):
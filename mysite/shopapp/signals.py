@@ -0,0 +1,168 @@
+from decimal import Decimal
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .exports import bump_orders_export_version
+from .jobs import enqueue
+from .models import Job, Order, Product, ProductImage
+from .page_cache import bump_products_versions
+from .search import index_products, unindex_products
+from .sitemap import invalidate_sitemap_shards
+from .totals import add_products_to_totals, recalculate_order_totals, shift_product_totals
+
+# Массовое изменение состава заказов (shopapp.order_lines), sender=Order.
+# Аргументы: action ("add", "remove", "replace"), order_pks, product_pks
+order_products_bulk_changed = Signal()
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_owner(sender, instance: Order, **kwargs):
+    # При смене владельца заказа устаревает и выгрузка прежнего пользователя
+    instance._previous_user_id = None
+    if instance.pk:
+        instance._previous_user_id = (
+            Order.objects.filter(pk=instance.pk).values_list("user_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Order)
+def invalidate_orders_export_on_save(sender, instance: Order, **kwargs):
+    bump_orders_export_version(instance.user_id)
+    previous_user_id = getattr(instance, "_previous_user_id", None)
+    if previous_user_id and previous_user_id != instance.user_id:
+        bump_orders_export_version(previous_user_id)
+
+
+@receiver(post_delete, sender=Order)
+def invalidate_orders_export_on_delete(sender, instance: Order, **kwargs):
+    bump_orders_export_version(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def on_order_products_change(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    # Состав заказа - часть его представления: меняет итоги и updated_at
+    # заказа, устаревает выгрузка заказов владельца
+    if reverse and action == "pre_clear":
+        # product.orders.clear(): после очистки связи уже не найти
+        instance._cleared_order_pks = set(instance.orders.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    now = timezone.now()
+    if not reverse:
+        if action == "post_add":
+            add_products_to_totals([instance.pk], pk_set)
+        else:
+            recalculate_order_totals([instance.pk])
+        Order.objects.filter(pk=instance.pk).update(updated_at=now)
+        bump_orders_export_version(instance.user_id)
+        return
+
+    # Изменение со стороны товара: product.orders.add(...) и т.п.
+    if action == "post_clear":
+        pk_set = instance.__dict__.pop("_cleared_order_pks", set())
+    if action == "post_add":
+        add_products_to_totals(pk_set, [instance.pk])
+    else:
+        recalculate_order_totals(pk_set)
+    orders = Order.objects.filter(pk__in=pk_set)
+    orders.update(updated_at=now)
+    for user_id in orders.values_list("user_id", flat=True).distinct():
+        bump_orders_export_version(user_id)
+
+
+@receiver(order_products_bulk_changed, sender=Order)
+def on_order_products_bulk_change(sender, order_pks: list[int], **kwargs):
+    orders = Order.objects.filter(pk__in=order_pks)
+    orders.update(updated_at=timezone.now())
+    recalculate_order_totals(order_pks)
+    for user_id in orders.values_list("user_id", flat=True).distinct():
+        bump_orders_export_version(user_id)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_price(sender, instance: Product, raw: bool, update_fields=None, **kwargs):
+    # Изменение цены или скидки переносится в итоги заказов с этим товаром
+    instance._previous_price = None
+    if raw or not instance.pk:
+        return
+    if update_fields is not None and not {"price", "discount"} & set(update_fields):
+        return
+    instance._previous_price = (
+        Product.objects.filter(pk=instance.pk).values_list("price", "discount").first()
+    )
+
+
+@receiver(post_save, sender=Product)
+def update_order_totals_on_price_change(sender, instance: Product, **kwargs):
+    previous = getattr(instance, "_previous_price", None)
+    if previous is None:
+        return
+    current = (Decimal(str(instance.price)), int(instance.discount))
+    if current != previous:
+        shift_product_totals(instance.pk, previous, current)
+
+
+@receiver(pre_save, sender=Product)
+def reset_preview_variants(sender, instance: Product, raw: bool, update_fields=None, **kwargs):
+    # Варианты прежнего превью не подходят к новому: сбрасываются при любой
+    # замене файла (формы, админка, код), новые строит post_save ниже
+    instance._preview_changed = False
+    if raw or (update_fields is not None and "preview" not in update_fields):
+        return
+    previous = None
+    if instance.pk:
+        previous = Product.objects.filter(pk=instance.pk).values_list("preview", flat=True).first()
+    if (previous or "") != (instance.preview.name or ""):
+        instance.preview_variants = {}
+        instance._preview_changed = True
+
+
+@receiver(post_save, sender=Product)
+def build_preview_variants_on_change(sender, instance: Product, **kwargs):
+    if getattr(instance, "_preview_changed", False) and instance.preview:
+        enqueue("build_image_variants", params={"product": instance.pk, "preview": True})
+
+
+@receiver(pre_delete, sender=Product)
+def remember_product_orders(sender, instance: Product, **kwargs):
+    # связи с заказами удаляются каскадом без m2m_changed
+    instance._order_pks = list(instance.orders.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def update_order_totals_on_delete(sender, instance: Product, **kwargs):
+    if getattr(instance, "_order_pks", None):
+        recalculate_order_totals(instance._order_pks)
+
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance: Product, **kwargs):
+    index_products([instance])
+    bump_products_versions([instance.pk])
+    invalidate_sitemap_shards([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product_on_delete(sender, instance: Product, **kwargs):
+    unindex_products([instance.pk])
+    bump_products_versions([instance.pk])
+    invalidate_sitemap_shards([instance.pk])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_product_page_on_image_change(sender, instance: ProductImage, **kwargs):
+    # Изображения выводятся на странице товара, поэтому меняют его updated_at
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+    bump_products_versions([instance.product_id])
+
+
+@receiver(post_delete, sender=Job)
+def delete_job_file(sender, instance: Job, **kwargs):
+    # загруженный CSV остается на диске только у невыполненных задач
+    if instance.file:
+        instance.file.delete(save=False)
@@ -1,15 +1,194 @@
+"""
+Карта сайта (sitemap) каталога, разбитая на шарды.
+
+Шард n содержит не архивные товары с pk от n * SITEMAP_SHARD_SIZE + 1
+до (n + 1) * SITEMAP_SHARD_SIZE. Состав шарда не зависит от остальных
+товаров, поэтому изменение товара делает устаревшим ровно один шард.
+Шард строится одним запросом по диапазону первичного ключа, из БД
+читаются только pk и created_at.
+
+Отрисованные шарды и индекс (sitemap index со ссылками на шарды)
+хранятся файлами в хранилище (MEDIA_ROOT/sitemaps/) и отдаются без
+обращения к БД. В имя файла входит метка из кеша: изменение товара
+меняет метки его шарда и индекса (invalidate_sitemap_shards), и
+следующий запрос заново строит только их. Метки (ключи sitemap_*)
+читаются только из общего уровня кеша, минуя локальный (см.
+LOCAL_EXCLUDE_PREFIXES в settings), иначе воркер отдавал бы устаревший
+файл. Все файлы сразу строит команда build_sitemaps
+"""
+
+import re
+from typing import Iterable
+from uuid import uuid4
+
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps.views import SitemapIndexItem
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.html import escape
 
 from .models import Product
 
+# Товаров (URL) в шарде; протокол допускает до 50 000
+SITEMAP_SHARD_SIZE = 10_000
+# Каталог файлов карты сайта в хранилище
+SITEMAP_DIR = "sitemaps"
+
+SITEMAP_INDEX_TOKEN_KEY = "sitemap_index_token"
+
+
+def shard_token_key(shard: int) -> str:
+    return f"sitemap_shard_token_{shard}"
+
+
+def shard_of(pk: int) -> int:
+    return (pk - 1) // SITEMAP_SHARD_SIZE
+
+
+def shard_count() -> int:
+    # по последнему не архивному товару: архивные в конце каталога не дают
+    # пустых шардов; обход первичного ключа с конца до первого такого товара
+    max_pk = Product.objects.filter(archived=False).order_by("-pk").values_list("pk", flat=True).first()
+    return 0 if max_pk is None else shard_of(max_pk) + 1
+
 
 class ShopSitemap(Sitemap):
     changefreq = 'monthly'
     priority = 0.9
+    limit = SITEMAP_SHARD_SIZE
+
+    def __init__(self, shard: int = 0, domain: str = ""):
+        self.shard = shard
+        self.domain = domain
 
     def items(self):
-        return Product.objects.order_by('-created_at')
+        first = self.shard * SITEMAP_SHARD_SIZE + 1
+        return (
+            Product.objects.filter(archived=False, pk__gte=first, pk__lt=first + SITEMAP_SHARD_SIZE)
+            .order_by("pk")
+            .values_list("pk", "created_at", named=True)
+        )
+
+    @property
+    def paginator(self):
+        # Шард - одна страница: список вместо COUNT(*) и выборки с OFFSET
+        return Paginator(list(self.items()), self.limit)
+
+    def get_domain(self, site=None):
+        return self.domain
+
+    def location(self, item):
+        return reverse('shopapp:product_details', kwargs={"pk": item.pk})
+
+    def lastmod(self, item):
+        return item.created_at
+
+
+def get_token(key: str) -> str:
+    token = cache.get(key)
+    if token is None:
+        cache.add(key, uuid4().hex[:12], timeout=None)
+        token = cache.get(key)
+    return token
+
+
+def _renew_tokens(keys: set[str]) -> None:
+    cache.set_many({key: uuid4().hex[:12] for key in keys}, timeout=None)
+
+
+def invalidate_sitemap_shards(pks: Iterable[int]) -> None:
+    """
+    Помечает устаревшими шарды с указанными товарами и индекс
+    (в нем могли появиться новые шарды)
+    """
+    keys = {shard_token_key(shard_of(pk)) for pk in pks if pk}
+    if not keys:
+        return
+    keys.add(SITEMAP_INDEX_TOKEN_KEY)
+    _renew_tokens(keys)
+    # Как в bump_version: до коммита другой запрос может построить
+    # шард из старых данных под новой меткой
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _renew_tokens(keys))
+
+
+def site_directory(protocol: str, domain: str) -> str:
+    # URL в карте сайта абсолютные: файлы отдельно для каждого адреса сайта
+    return f"{SITEMAP_DIR}/" + re.sub(r"[^\w.-]", "_", f"{protocol}_{domain}")
+
+
+def render_shard(shard: int, protocol: str, domain: str) -> str:
+    # XML собирается строками: шаблон sitemap.xml на каждый URL
+    # в несколько раз медленнее
+    sitemap = ShopSitemap(shard=shard, domain=domain)
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+    ]
+    for url in sitemap.get_urls(protocol=protocol):
+        lines.append(
+            f"<url><loc>{escape(url['location'])}</loc>"
+            f"<lastmod>{url['lastmod']:%Y-%m-%d}</lastmod>"
+            f"<changefreq>{url['changefreq']}</changefreq>"
+            f"<priority>{url['priority']}</priority></url>"
+        )
+    lines.append("</urlset>\n")
+    return "\n".join(lines)
+
+
+def render_index(protocol: str, domain: str) -> str:
+    sitemaps = [
+        SitemapIndexItem(f"{protocol}://{domain}" + reverse("sitemap_shard", kwargs={"shard": shard}))
+        for shard in range(shard_count())
+    ]
+    return render_to_string("sitemap_index.xml", {"sitemaps": sitemaps})
+
+
+def sitemap_file(shard: int | None, protocol: str, domain: str) -> str | None:
+    """
+    Имя файла шарда (индекса при shard=None) в хранилище. Устаревший
+    или отсутствующий файл строится заново; None - такого шарда нет
+    """
+    key = SITEMAP_INDEX_TOKEN_KEY if shard is None else shard_token_key(shard)
+    prefix = "index" if shard is None else f"products-{shard}"
+    directory = site_directory(protocol, domain)
+    name = f"{directory}/{prefix}-{get_token(key)}.xml"
+    if default_storage.exists(name):
+        return name
+
+    if shard is None:
+        content = render_index(protocol, domain)
+    elif shard < shard_count():
+        content = render_shard(shard, protocol, domain)
+    else:
+        return None
+    # одновременный запрос мог уже сохранить этот файл: тогда save()
+    # выберет другое имя, лишний файл удалится ниже
+    default_storage.save(name, ContentFile(content.encode()))
+
+    # файлы с прежними метками больше не нужны
+    current = f"{prefix}-{cache.get(key)}.xml"
+    for filename in default_storage.listdir(directory)[1]:
+        if filename.startswith(f"{prefix}-") and filename != current:
+            default_storage.delete(f"{directory}/{filename}")
+    if not default_storage.exists(name):
+        # метка сменилась во время построения
+        return sitemap_file(shard, protocol, domain)
+    return name
+
 
-    def lastmod(self, obj):
-        return obj.created_at
+def build_sitemaps(protocol: str, domain: str) -> int:
+    """
+    Строит индекс и все шарды для адреса сайта. Возвращает число шардов
+    """
+    sitemap_file(None, protocol, domain)
+    count = shard_count()
+    for shard in range(count):
+        sitemap_file(shard, protocol, domain)
+    return count
 
@@ -0,0 +1,44 @@
+from django import template
+from django.core.files.storage import default_storage
+
+register = template.Library()
+
+
+@register.inclusion_tag("shopapp/includes/responsive-image.html")
+def responsive_image(
+    file,
+    variants: dict,
+    default: str = "card",
+    sizes: str = "100vw",
+    alt: str = "",
+    lazy: bool = True,
+):
+    """
+    <picture> с srcset по вариантам изображения (WebP и JPEG).
+    Для изображений без вариантов выводится исходный файл
+    """
+    if not file:
+        return {}
+    context = {
+        "alt": alt or file.name,
+        "loading": "lazy" if lazy else "eager",
+        "src": file.url,
+    }
+    if not variants:
+        return context
+
+    ordered = sorted(variants.values(), key=lambda info: info["width"])
+    fallback = variants.get(default) or ordered[-1]
+    context.update(
+        src=default_storage.url(fallback["jpeg"]),
+        width=fallback["width"],
+        height=fallback["height"],
+        sizes=sizes,
+        webp_srcset=", ".join(
+            f"{default_storage.url(info['webp'])} {info['width']}w" for info in ordered
+        ),
+        jpeg_srcset=", ".join(
+            f"{default_storage.url(info['jpeg'])} {info['width']}w" for info in ordered
+        ),
+    )
+    return context
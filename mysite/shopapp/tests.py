@@ -1,12 +1,76 @@
+import gzip
+import os
+import sqlite3
+import json
+import re
+import tempfile
+import threading
+import time
+from base64 import urlsafe_b64encode
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 from string import ascii_letters
 from random import choices
+from uuid import UUID
+from zlib import crc32
+from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
-from django.urls import reverse
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, OperationalError, connection
+from django.db.utils import ConnectionHandler
+from django.db.models import F, QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
 
-from shopapp.models import Product
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from mysite import fastjson
+from mysite.cache import TieredCache
+from mysite.compression import CompressionMiddleware, GzipCompressor, choose_encoding, compression_stats
+from mysite.replicas import (
+    PRIMARY_COOKIE,
+    ReplicaRouter,
+    ReplicaRoutingMiddleware,
+    is_replica_view,
+    replica_cache_timeout,
+    replica_reads,
+)
+from shopapp.admin import mark_archived
+from shopapp.common import save_csv_order, save_csv_products
+from shopapp.fast_serializers import fast_serializer
+from shopapp.images import build_variants
+from shopapp.jobs import (
+    JOB_HANDLERS,
+    claim_job,
+    enqueue,
+    heartbeat,
+    job_handler,
+    requeue_stale_jobs,
+    run_job,
+    work,
+)
+from shopapp.models import Product, ProductImage, Order, Job
+from shopapp.pagination import KeysetPagination
+from shopapp.query_plans import HOT_QUERIES, plan_problems
+from shopapp.serializers import OrderFullSerializer, OrderSerializer, ProductSerializer
+from shopapp.sitemap import SITEMAP_INDEX_TOKEN_KEY, get_token
+from shopapp.totals import recalculate_order_totals
 from shopapp.utils import add_two_numbers
 
 
@@ -138,3 +202,1592 @@ class ProductsExportViewTestCase(TestCase):
             products_data["products"],
             expected_data,
         )
+
+
+class ProductsCSVExportTestCase(TestCase):
+    fixtures = [
+        'products-fixture.json',
+    ]
+
+    def test_stream_matches_buffered_export(self):
+        url = reverse('shopapp:product-download-csv')
+        buffered = self.client.get(url, {"ordering": "price"})
+        streamed = self.client.get(url, {"ordering": "price", "stream": "1"})
+        self.assertEqual(streamed.status_code, 200)
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(
+            b"".join(streamed.streaming_content).replace(b"\r\n", b"\n"),
+            buffered.content.replace(b"\r\n", b"\n"),
+        )
+
+    def test_stream_honors_search(self):
+        url = reverse('shopapp:product-download-csv')
+        response = self.client.get(url, {"search": "Smartphone", "stream": "1"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("Smartphone"))
+
+
+class UserOrdersExportTestCase(TestCase):
+    fixtures = [
+        'products-fixture.json',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='test')
+        cls.order = Order.objects.create(user=cls.user, delivery_address="ul Mira 11")
+        cls.order.products.add(2)
+
+    def setUp(self):
+        cache.clear()
+
+    def export(self, **params):
+        response = self.client.get(
+            reverse('shopapp:user_orders_export', kwargs={"user_id": self.user.pk}),
+            params,
+        )
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_export_is_cached_per_user(self):
+        data = json.loads(self.export())
+        self.assertEqual(data["orders"][0]["products"], [2])
+        with self.assertNumQueries(1):
+            self.assertEqual(json.loads(self.export()), data)
+
+    def test_products_change_invalidates_export(self):
+        self.export()
+        self.order.products.add(3)
+        data = json.loads(self.export())
+        self.assertEqual(data["orders"][0]["products"], [2, 3])
+
+    def test_gzip_export(self):
+        self.assertEqual(
+            json.loads(gzip.decompress(self.export(gzip="1"))),
+            json.loads(self.export()),
+        )
+
+
+class SaveCSVOrderTestCase(TestCase):
+    fixtures = [
+        'products-fixture.json',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='test')
+
+    def test_bulk_import_with_error_report(self):
+        data = (
+            "delivery_address,promocode,user,products\n"
+            '"ul Mira 11","SALE","buyer","1,3"\n'
+            '"ul Mira 12","","nobody","1"\n'
+            '"ul Mira 13","","buyer","999"\n'
+            '"ul Mira 14","","buyer","2"\n'
+        )
+        with self.assertNumQueries(12):
+            report = save_csv_order(BytesIO(data.encode()), "utf-8", batch_size=2)
+        self.assertEqual(report.created, 2)
+        self.assertEqual([line for line, _ in report.errors], [3, 4])
+        order = Order.objects.get(delivery_address="ul Mira 11")
+        self.assertEqual(
+            sorted(order.products.values_list("pk", flat=True)), [1, 3]
+        )
+
+    def test_invalid_fields_are_reported(self):
+        data = (
+            "delivery_address,promocode,user,products\n"
+            '"ul Mira 11","SALE","buyer","1"\n'
+            '"ul Mira 12","XXXXXXXXXXXXXXXXXXXXX","buyer","1"\n'
+        )
+        report = save_csv_order(BytesIO(data.encode()), "utf-8")
+        self.assertEqual(report.created, 1)
+        self.assertEqual([line for line, _ in report.errors], [3])
+        self.assertIn("promocode", report.errors[0][1])
+
+    def test_conflict_falls_back_to_single_rows(self):
+        bulk_create = QuerySet.bulk_create
+
+        def failing_bulk_create(queryset, objs, *args, **kwargs):
+            objs = list(objs)
+            if queryset.model is Order and (len(objs) > 1 or objs[0].delivery_address == "bad"):
+                raise IntegrityError("FOREIGN KEY constraint failed")
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        data = (
+            "delivery_address,promocode,user,products\n"
+            '"ul Mira 11","","buyer","1"\n'
+            '"bad","","buyer","2"\n'
+            '"ul Mira 13","","buyer","3"\n'
+        )
+        with patch.object(QuerySet, "bulk_create", autospec=True, side_effect=failing_bulk_create):
+            report = save_csv_order(BytesIO(data.encode()), "utf-8")
+        self.assertEqual(report.created, 2)
+        self.assertEqual([line for line, _ in report.errors], [3])
+        self.assertEqual(
+            sorted(Order.objects.values_list("delivery_address", "products")),
+            [("ul Mira 11", 1), ("ul Mira 13", 3)],
+        )
+
+
+class SaveCSVProductsTestCase(TestCase):
+    def test_batches_with_error_report(self):
+        data = (
+            "name,description,price,discount\n"
+            '"Laptop 14","A new one","2999.00",5\n'
+            '"Laptop 15","Broken","not a price",5\n'
+            '"Laptop 16","A bigger one","2699.87",7\n'
+        )
+        report = save_csv_products(BytesIO(data.encode()), "utf-8", batch_size=2)
+        self.assertEqual(report.created, 2)
+        self.assertEqual(len(report.batches), 2)
+        self.assertEqual([line for line, _ in report.errors], [3])
+        self.assertEqual(
+            list(Product.objects.order_by("name").values_list("name", flat=True)),
+            ["Laptop 14", "Laptop 16"],
+        )
+
+    def test_upsert_by_sku(self):
+        Product.objects.create(name="Old name", sku="LT-14", price="1.00")
+        data = (
+            "sku,name,price\n"
+            '"LT-14","Laptop 14","2999.00"\n'
+            '"LT-16","Laptop 16","2699.87"\n'
+        )
+        report = save_csv_products(BytesIO(data.encode()), "utf-8", upsert=True)
+        self.assertEqual(report.errors, [])
+        self.assertEqual((report.created, report.updated), (1, 1))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(Product.objects.get(sku="LT-14").name, "Laptop 14")
+
+    def test_upsert_reports_missing_and_duplicate_sku(self):
+        data = (
+            "sku,name,price\n"
+            '"LT-14","Laptop 14","2999.00"\n'
+            '"","No sku","1.00"\n'
+            '"LT-14","Laptop 14 again","1.00"\n'
+        )
+        report = save_csv_products(BytesIO(data.encode()), "utf-8", upsert=True)
+        self.assertEqual([line for line, _ in report.errors], [3, 4])
+        self.assertIn("line 2", report.errors[1][1])
+        self.assertEqual((report.created, report.updated), (1, 0))
+        self.assertEqual(list(Product.objects.values_list("name", flat=True)), ["Laptop 14"])
+
+    def test_upsert_conflict_falls_back_to_single_rows(self):
+        bulk_create = QuerySet.bulk_create
+
+        def failing_bulk_create(queryset, objs, *args, **kwargs):
+            objs = list(objs)
+            if len(objs) > 1 or objs[0].sku == "BAD":
+                raise IntegrityError("CHECK constraint failed")
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        data = 'sku,name\n"LT-14","Laptop 14"\n"BAD","Broken"\n"LT-16","Laptop 16"\n'
+        with patch.object(QuerySet, "bulk_create", autospec=True, side_effect=failing_bulk_create):
+            report = save_csv_products(BytesIO(data.encode()), "utf-8", upsert=True)
+        self.assertEqual([line for line, _ in report.errors], [3])
+        self.assertEqual(report.created, 2)
+        self.assertEqual(sorted(Product.objects.values_list("sku", flat=True)), ["LT-14", "LT-16"])
+
+    def test_upsert_requires_sku_column(self):
+        data = "name,price\nLaptop,1.00\n"
+        with self.assertRaises(ValueError):
+            save_csv_products(BytesIO(data.encode()), "utf-8", upsert=True)
+
+
+class KeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create(
+            Product(name=f"Product {i % 3}", price=i % 2, discount=i % 4)
+            for i in range(25)
+        )
+
+    def walk(self, url: str, params: dict) -> tuple[list[int], dict]:
+        seen = []
+        response = self.client.get(url, params).json()
+        self.assertNotIn("count", response)
+        seen += [product["pk"] for product in response["results"]]
+        while response["next"]:
+            last = response
+            response = self.client.get(response["next"]).json()
+            seen += [product["pk"] for product in response["results"]]
+        return seen, last
+
+    def test_cursor_walk_is_stable_for_each_ordering(self):
+        url = reverse('shopapp:product-list')
+        for ordering in ("name", "-price", "discount,-name"):
+            with self.subTest(ordering=ordering):
+                seen, _ = self.walk(url, {"cursor": "", "ordering": ordering})
+                self.assertEqual(len(seen), 25)
+                self.assertEqual(len(set(seen)), 25)
+                expected = Product.objects.order_by(*ordering.split(","), "pk")
+                self.assertEqual(seen, list(expected.values_list("pk", flat=True)))
+
+    def test_previous_link(self):
+        url = reverse('shopapp:product-list')
+        first = self.client.get(url, {"cursor": ""}).json()
+        second = self.client.get(first["next"]).json()
+        self.assertIsNone(first["previous"])
+        back = self.client.get(second["previous"]).json()
+        self.assertEqual(back["results"], first["results"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('shopapp:product-list'), {"cursor": "broken"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_cursor_values(self):
+        url = reverse('shopapp:product-list')
+        # сортировка по умолчанию: name, price, pk
+        for position in (
+            [["Product 0"], "1.00", 1],
+            ["Product 0", {"price": 1}, 1],
+            ["Product 0", "1.00", None],
+            ["Product 0", "cheap", 1],
+            ["Product 0", "1.00", "first"],
+        ):
+            with self.subTest(position=position):
+                payload = json.dumps({"p": position, "r": False})
+                cursor = urlsafe_b64encode(payload.encode()).decode()
+                response = self.client.get(url, {"cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class ProductSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(name="Gaming laptop", description="Fast laptop")
+        cls.phone = Product.objects.create(name="Phone", description="Works with a laptop")
+        Product.objects.create(name="Desktop", description="Big tower")
+
+    def test_api_search_is_ranked(self):
+        response = self.client.get(reverse('shopapp:product-list'), {"search": "lapt"})
+        pks = [product["pk"] for product in response.json()["results"]]
+        self.assertEqual(pks, [self.laptop.pk, self.phone.pk])
+
+    @patch.object(KeysetPagination, "page_size", 1)
+    def test_cursor_pages_keep_rank_order(self):
+        url = reverse('shopapp:product-list')
+        params = {"search": "lapt", "cursor": "", "fields": "pk,name"}
+        pks = []
+        while url:
+            data = self.client.get(url, params).json()
+            pks += [product["pk"] for product in data["results"]]
+            url, params = data["next"], {}
+        self.assertEqual(pks, [self.laptop.pk, self.phone.pk])
+
+    def test_index_follows_updates(self):
+        self.phone.description = "No keyboard"
+        self.phone.save()
+        response = self.client.get(reverse('shopapp:product-list'), {"search": "laptop"})
+        pks = [product["pk"] for product in response.json()["results"]]
+        self.assertEqual(pks, [self.laptop.pk])
+
+    def test_products_list_page_search(self):
+        response = self.client.get(reverse('shopapp:products_list'), {"q": "tower"})
+        self.assertEqual([p.name for p in response.context['products']], ["Desktop"])
+
+    def test_csv_import_is_indexed(self):
+        data = 'name,description,price\n"Tablet","Light slate",10\n'
+        save_csv_products(BytesIO(data.encode()), "utf-8")
+        response = self.client.get(reverse('shopapp:product-list'), {"search": "slate"})
+        self.assertEqual(response.json()["results"][0]["name"], "Tablet")
+
+
+class HotQueriesPlanTestCase(TestCase):
+    def test_no_full_table_scans(self):
+        out = StringIO()
+        call_command("explain_hot_queries", "--fail-on-scan", stdout=out)
+        self.assertIn("No full table scans or temp B-tree sorts", out.getvalue())
+
+    def test_scan_is_flagged(self):
+        plan = Product.objects.order_by("description").explain()
+        self.assertEqual(
+            plan_problems(plan),
+            ["full table scan of shopapp_product", "temp B-tree for ORDER BY"],
+        )
+        self.assertEqual(plan_problems(Product.objects.order_by("name", "price").explain()), [])
+        with patch.dict(HOT_QUERIES, {"by_description": lambda: Product.objects.order_by("description")}):
+            with self.assertRaisesMessage(CommandError, "by_description"):
+                call_command("explain_hot_queries", "--fail-on-scan", stdout=StringIO())
+
+
+class ProductPagesCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name="Cached product", price="10.00")
+
+    def setUp(self):
+        # кеш не откатывается вместе с транзакцией теста
+        cache.clear()
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        list_url = reverse('shopapp:products_list')
+        details_url = reverse('shopapp:product_details', kwargs={"pk": self.product.pk})
+        self.client.get(list_url)
+        self.client.get(details_url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(list_url), "Cached product")
+            self.assertContains(self.client.get(details_url), "Cached product")
+
+    def test_product_save_invalidates_pages(self):
+        url = reverse('shopapp:product_details', kwargs={"pk": self.product.pk})
+        self.client.get(url)
+        self.product.name = "Renamed product"
+        self.product.save()
+        self.assertContains(self.client.get(url), "Renamed product")
+
+    def test_admin_archive_action_invalidates_list(self):
+        url = reverse('shopapp:products_list')
+        self.assertContains(self.client.get(url), "Cached product")
+        mark_archived(None, None, Product.objects.filter(pk=self.product.pk))
+        self.assertNotContains(self.client.get(url), "Cached product")
+
+
+class TieredCacheTestCase(TestCase):
+    def make_cache(self, **options) -> TieredCache:
+        shared = caches["shared"]
+        shared.clear()
+        return TieredCache("", {"OPTIONS": {"SHARED_ALIAS": "shared", **options}})
+
+    def test_lru_eviction(self):
+        tiered = self.make_cache(LOCAL_MAX_ENTRIES=2)
+        for key in ("a", "b", "c"):
+            tiered.set(key, key)
+        self.assertEqual(tiered.get("a"), "a")  # из общего уровня
+        stats = tiered.stats()
+        self.assertEqual(stats["evictions"], 2)
+        self.assertEqual(stats["shared_hits"], 1)
+        self.assertEqual(tiered.get("a"), "a")
+        self.assertEqual(tiered.stats()["local_hits"], 1)
+
+    def test_local_values_are_not_shared_objects(self):
+        tiered = self.make_cache()
+        tiered.set("list", [1])
+        tiered.get("list").append(2)
+        self.assertEqual(tiered.get("list"), [1])
+
+    def test_incr_and_excluded_prefixes(self):
+        tiered = self.make_cache(LOCAL_EXCLUDE_PREFIXES=["version"])
+        tiered.set("version_1", 1, timeout=None)
+        caches["shared"].incr("version_1")
+        self.assertEqual(tiered.get("version_1"), 2)
+        self.assertEqual(tiered.incr("version_1"), 3)
+
+    def test_concurrent_misses_compute_once(self):
+        tiered = self.make_cache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return "value"
+
+        threads = [
+            threading.Thread(target=tiered.get_or_compute, args=("key", compute))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(tiered.get("key"), "value")
+
+    def test_soft_timeout_serves_stale_while_recomputing(self):
+        tiered = self.make_cache(LOCAL_MAX_ENTRIES=0)
+        tiered.get_or_compute("key", lambda: "old", soft_timeout=0)
+        caches["shared"].add("key:compute-lock", 1)
+        self.assertEqual(tiered.get_or_compute("key", lambda: "new", soft_timeout=0), "old")
+        self.assertEqual(tiered.stats()["stale_served"], 1)
+        caches["shared"].delete("key:compute-lock")
+        self.assertEqual(tiered.get_or_compute("key", lambda: "new", soft_timeout=60), "new")
+
+    def test_wait_timeout_keeps_foreign_lock(self):
+        tiered = self.make_cache(LOCK_TIMEOUT=0.1, LOCK_POLL_INTERVAL=0.01)
+        caches["shared"].add("key:compute-lock", 1)
+        self.assertEqual(tiered.get_or_compute("key", lambda: "value"), "value")
+        self.assertEqual(caches["shared"].get("key:compute-lock"), 1)
+
+    def test_waiting_releases_local_lock(self):
+        tiered = self.make_cache(LOCK_TIMEOUT=2, LOCK_POLL_INTERVAL=0.01)
+        stripe = lambda key: crc32(tiered.make_and_validate_key(key).encode()) % 64
+        other = next(f"other{i}" for i in range(10000) if stripe(f"other{i}") == stripe("key"))
+        caches["shared"].add("key:compute-lock", 1)
+        waiting = threading.Thread(target=tiered.get_or_compute, args=("key", lambda: "value"))
+        waiting.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        self.assertEqual(tiered.get_or_compute(other, lambda: "other"), "other")
+        self.assertLess(time.monotonic() - started, 1)
+        caches["shared"].delete("key:compute-lock")
+        tiered.set("key", "value")
+        waiting.join()
+
+    def test_file_lock_is_exclusive(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory.name}
+        with override_settings(CACHES={**settings.CACHES, "shared": shared}):
+            first = self.make_cache(LOCK_TIMEOUT=60)
+            second = self.make_cache(LOCK_TIMEOUT=60)
+            token = first._acquire_compute_lock("key:compute-lock", None)
+            self.assertIsNotNone(token)
+            self.assertIsNone(second._acquire_compute_lock("key:compute-lock", None))
+            first._release_compute_lock("key:compute-lock", token, None)
+            token = second._acquire_compute_lock("key:compute-lock", None)
+            self.assertIsNotNone(token)
+
+            # блокировка упавшего владельца истекает через LOCK_TIMEOUT
+            path = second._lock_file(caches["shared"], "key:compute-lock", None)
+            os.utime(path, (time.time() - 120, time.time() - 120))
+            self.assertIsNotNone(first._acquire_compute_lock("key:compute-lock", None))
+            second._release_compute_lock("key:compute-lock", token, None)
+            self.assertTrue(os.path.exists(path))
+
+    def test_file_incr_is_atomic(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory.name}
+        with override_settings(CACHES={**settings.CACHES, "shared": shared}):
+            tiered = self.make_cache(LOCK_POLL_INTERVAL=0.001)
+            tiered.set("version", 1, timeout=None)
+
+            def bump():
+                for _ in range(20):
+                    tiered.incr("version")
+
+            threads = [threading.Thread(target=bump) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(tiered.get("version"), 101)
+            # блокировки сняты
+            self.assertFalse([name for name in os.listdir(directory.name) if name.endswith(".lock")])
+
+
+class SQLiteBackendTestCase(TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "db.sqlite3")
+        # блокировка записи другим процессом
+        self.blocker = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.blocker.execute("PRAGMA journal_mode=WAL")
+        self.blocker.execute("CREATE TABLE item (id INTEGER PRIMARY KEY)")
+        self.blocker.execute("BEGIN IMMEDIATE")
+        self.addCleanup(self.blocker.close)
+
+    def get_connection(self, **options):
+        handler = ConnectionHandler({
+            "default": {
+                **settings.DATABASES["default"],
+                "NAME": self.path,
+                "OPTIONS": {**settings.DATABASES["default"]["OPTIONS"], "timeout": 0, **options},
+            },
+        })
+        self.addCleanup(handler.close_all)
+        return handler["default"]
+
+    def test_pragmas(self):
+        with self.get_connection().cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_retry_on_lock(self):
+        timer = threading.Timer(0.2, self.blocker.execute, ["COMMIT"])
+        timer.start()
+        self.addCleanup(timer.join)
+        with self.get_connection(LOCK_RETRIES=10, LOCK_RETRY_DELAY=0.02).cursor() as cursor:
+            cursor.execute("INSERT INTO item (id) VALUES (1)")
+        self.assertEqual(self.blocker.execute("SELECT count(*) FROM item").fetchone()[0], 1)
+
+    def test_no_retries(self):
+        with self.assertRaisesMessage(OperationalError, "database is locked"):
+            with self.get_connection(LOCK_RETRIES=0).cursor() as cursor:
+                cursor.execute("INSERT INTO item (id) VALUES (1)")
+        self.blocker.execute("COMMIT")
+
+
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name="Laptop", price="10.00")
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_revalidates(self, url: str):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header("Last-Modified"))
+        etag = response["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Product.objects.filter(pk=self.product.pk).update(
+            updated_at=F("updated_at") + timedelta(seconds=5)
+        )
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_products_api(self):
+        self.assert_revalidates(reverse('shopapp:product-list'))
+        self.assert_revalidates(
+            reverse('shopapp:product-detail', kwargs={"pk": self.product.pk})
+        )
+
+    def test_product_details_page(self):
+        self.assert_revalidates(
+            reverse('shopapp:product_details', kwargs={"pk": self.product.pk})
+        )
+
+    def test_latest_products_feed(self):
+        self.assert_revalidates(reverse('shopapp:products_feed'))
+
+    def test_not_modified_skips_serialization(self):
+        url = reverse('shopapp:product-list')
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(1):
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    @patch.object(KeysetPagination, "page_size", 2)
+    def test_cursor_page_without_full_aggregate(self):
+        Product.objects.bulk_create(Product(name=f"Product {number}") for number in range(5))
+        url = reverse('shopapp:product-list')
+        params = {"cursor": "", "fields": "pk,name"}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertFalse(any("COUNT(" in query["sql"] or "MAX(" in query["sql"] for query in queries))
+        self.assertFalse(response.has_header("Last-Modified"))
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # строка страницы удалена: на ее место встала следующая
+        Product.objects.filter(pk=response.json()["results"][0]["pk"]).delete()
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_orders_api_changes_with_products(self):
+        user = User.objects.create_user(username='buyer', password='test')
+        order = Order.objects.create(user=user)
+        url = reverse('shopapp:order-detail', kwargs={"pk": order.pk})
+        etag = self.client.get(url)["ETag"]
+        Order.objects.filter(pk=order.pk).update(
+            updated_at=order.updated_at - timedelta(seconds=5)
+        )
+        order.products.add(self.product)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AsyncCatalogViewsTestCase(TestCase):
+    fixtures = [
+        'products-fixture.json',
+    ]
+
+    async def test_products_list(self):
+        response = await self.async_client.get(reverse('shopapp:products_list_async'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Desktop (new)")
+        self.assertNotContains(response, ">Name: Laptop<")
+
+    async def test_product_details(self):
+        url = reverse('shopapp:product_details_async', kwargs={"pk": 2})
+        response = await self.async_client.get(url)
+        self.assertContains(response, "Desktop (new)")
+        response = await self.async_client.get(url, headers={"if-none-match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+        missing = reverse('shopapp:product_details_async', kwargs={"pk": 999})
+        self.assertEqual((await self.async_client.get(missing)).status_code, 404)
+
+    async def test_export_matches_sync_view(self):
+        response = await self.async_client.get(reverse('shopapp:products_export_async'))
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        expected = await self.async_client.get(reverse('shopapp:products-export'))
+        self.assertEqual(content, expected.content)
+
+    async def test_latest_products_feed(self):
+        response = await self.async_client.get(reverse('shopapp:products_feed_async'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "<rss")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class JobQueueTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='admin', password='test')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def upload(self, data: str) -> SimpleUploadedFile:
+        return SimpleUploadedFile("products.csv", data.encode(), content_type="text/csv")
+
+    def test_admin_import_is_queued(self):
+        data = (
+            "name,description,price,discount\n"
+            '"Laptop 14","A new one","2999.00",5\n'
+            '"Laptop 15","Broken","not a price",5\n'
+        )
+        response = self.client.post(
+            reverse('admin:import_products_csv'),
+            {"csv_file": self.upload(data)},
+        )
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('admin:shopapp_job_progress', args=[job.pk]))
+        self.assertFalse(Product.objects.exists())
+
+        call_command("run_worker", "--burst", stdout=StringIO())
+        self.assertEqual(Product.objects.get().name, "Laptop 14")
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertFalse(job.file)
+
+        status = self.client.get(reverse('admin:shopapp_job_status', args=[job.pk])).json()
+        self.assertTrue(status["finished"])
+        self.assertEqual(status["processed"], 2)
+        self.assertEqual(status["result"]["created"], 1)
+        self.assertEqual([e["line"] for e in status["result"]["errors"]], [3])
+
+    def test_job_is_claimed_once(self):
+        job = enqueue("export_products_csv")
+        self.assertEqual(claim_job("worker-1"), job)
+        self.assertIsNone(claim_job("worker-2"))
+
+    def test_heartbeat_keeps_long_job(self):
+        enqueue("export_products_csv")
+        job = claim_job("worker-1")
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=2))
+        heartbeat(job, progress=50)
+        self.assertEqual(requeue_stale_jobs(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), (Job.Status.RUNNING, 50))
+
+    def test_requeued_job_result_is_discarded(self):
+        @job_handler("slow")
+        def slow(job):
+            # воркер "завис": задачу вернули в очередь и забрал другой
+            Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=2))
+            requeue_stale_jobs()
+            claim_job("worker-2")
+            return {"ok": True}
+
+        self.addCleanup(JOB_HANDLERS.pop, "slow")
+        enqueue("slow")
+        job = run_job(claim_job("worker-1"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.Status.RUNNING, "worker-2"))
+        self.assertIsNone(job.result)
+
+    def test_retry_with_backoff(self):
+        calls = []
+
+        @job_handler("flaky")
+        def flaky(job):
+            calls.append(job.attempts)
+            if len(calls) == 1:
+                raise RuntimeError("database is locked")
+            return {"ok": True}
+
+        self.addCleanup(JOB_HANDLERS.pop, "flaky")
+        job = enqueue("flaky")
+        work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.QUEUED)
+        self.assertGreater(job.run_after, timezone.now())
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(calls, [1, 2])
+
+    def test_data_errors_are_not_retried(self):
+        job = enqueue(
+            "import_products_csv",
+            params={"upsert": True},
+            file=self.upload("name,price\nLaptop,1.00\n"),
+        )
+        work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("sku", job.error)
+
+    def test_retry_resumes_after_processed_rows(self):
+        job = enqueue(
+            "import_products_csv",
+            file=self.upload("name,price\nLaptop 14,1.00\nLaptop 16,2.00\n"),
+        )
+        Job.objects.filter(pk=job.pk).update(processed=1, result={"created": 1, "errors": [], "batches": 1})
+        work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(list(Product.objects.values_list("name", flat=True)), ["Laptop 16"])
+        self.assertEqual(job.result["created"], 2)
+
+    def test_background_export(self):
+        Product.objects.create(name="Laptop", price="1.00")
+        job = enqueue("export_products_csv")
+        work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(job.result["rows"], 1)
+
+
+def make_image(width: int, height: int, image_format: str = "PNG") -> bytes:
+    buffer = BytesIO()
+    Image.new("RGBA", (width, height), (200, 40, 40, 128)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageVariantsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_build_variants(self):
+        name = default_storage.save("products/big.png", ContentFile(make_image(2000, 1000)))
+        variants = build_variants(name)
+        self.assertEqual(
+            {variant: (info["width"], info["height"]) for variant, info in variants.items()},
+            {"thumb": (160, 80), "card": (480, 240), "full": (1200, 600)},
+        )
+        with default_storage.open(variants["card"]["jpeg"]) as file, Image.open(file) as image:
+            self.assertEqual((image.format, image.mode), ("JPEG", "RGB"))
+        with default_storage.open(variants["card"]["webp"]) as file, Image.open(file) as image:
+            self.assertEqual(image.format, "WEBP")
+
+    def test_small_image_is_not_upscaled(self):
+        name = default_storage.save("products/small.png", ContentFile(make_image(100, 50)))
+        variants = build_variants(name)
+        self.assertEqual(list(variants), ["thumb"])
+        self.assertEqual(variants["thumb"]["width"], 100)
+
+    def test_update_view_builds_variants(self):
+        product = Product.objects.create(name="Laptop", price="10.00")
+        response = self.client.post(
+            reverse('shopapp:product_update', kwargs={"pk": product.pk}),
+            {
+                "name": "Laptop",
+                "price": "10.00",
+                "description": "",
+                "discount": 0,
+                "preview": SimpleUploadedFile("preview.png", make_image(900, 600)),
+                "images": [
+                    SimpleUploadedFile("one.png", make_image(700, 700)),
+                    SimpleUploadedFile("two.png", make_image(300, 200)),
+                ],
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        # варианты строит фоновая задача, а не запрос
+        product.refresh_from_db()
+        self.assertEqual(product.preview_variants, {})
+        jobs = Job.objects.filter(kind="build_image_variants").order_by("pk")
+        self.assertEqual(
+            [(job.params["product"], job.params["preview"]) for job in jobs],
+            [(product.pk, True), (product.pk, False)],
+        )
+        work(burst=True)
+        self.assertEqual(
+            [(job.status, job.result) for job in jobs.all()],
+            [(Job.Status.DONE, {"images": 1}), (Job.Status.DONE, {"images": 2})],
+        )
+        product.refresh_from_db()
+        self.assertEqual(set(product.preview_variants), {"thumb", "card", "full"})
+        self.assertEqual(
+            [len(image.variants) for image in product.images.order_by("pk")], [3, 2]
+        )
+
+        response = self.client.get(reverse('shopapp:products_list'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, "_card.jpeg")
+        self.assertContains(response, " 480w")
+
+    def test_preview_replacement_resets_variants(self):
+        product = Product.objects.create(name="Laptop", price="10.00")
+        product.preview.save("old.png", ContentFile(make_image(400, 300)))
+        work(burst=True)
+        product.refresh_from_db()
+        self.assertEqual(set(product.preview_variants), {"thumb", "card"})
+
+        # замена превью в обход форм магазина (например, в админке)
+        product.preview.save("new.png", ContentFile(make_image(900, 600)))
+        product.refresh_from_db()
+        self.assertEqual(product.preview_variants, {})
+        self.assertEqual(
+            Job.objects.filter(kind="build_image_variants", status=Job.Status.QUEUED).count(), 1
+        )
+        product.name = "Notebook"
+        product.save()
+        self.assertEqual(
+            Job.objects.filter(kind="build_image_variants", status=Job.Status.QUEUED).count(), 1
+        )
+        work(burst=True)
+        product.refresh_from_db()
+        self.assertEqual(set(product.preview_variants), {"thumb", "card", "full"})
+        self.assertIn("new", product.preview_variants["card"]["jpeg"])
+
+    def test_backfill_command(self):
+        product = Product.objects.create(name="Laptop", price="10.00")
+        product.preview.save("preview.png", ContentFile(make_image(400, 300)))
+        self.assertEqual(product.preview_variants, {})
+        call_command("build_image_variants", "--processes", "0", stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(set(product.preview_variants), {"thumb", "card"})
+
+
+class OrderTotalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='test')
+        cls.laptop = Product.objects.create(name="Laptop", price="1000.00", discount=10)
+        cls.mouse = Product.objects.create(name="Mouse", price="19.99", discount=5)
+
+    def assertTotals(self, order: Order, total_price: str, total_discount: str, count: int):
+        order.refresh_from_db()
+        self.assertEqual(
+            (order.total_price, order.total_discount, order.item_count),
+            (Decimal(total_price), Decimal(total_discount), count),
+        )
+
+    def test_products_added_and_removed(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop, self.mouse)
+        self.assertTotals(order, "1019.99", "101.00", 2)
+        order.products.remove(self.laptop)
+        self.assertTotals(order, "19.99", "1.00", 1)
+        self.mouse.orders.add(Order.objects.create(user=self.user))
+        order.products.clear()
+        self.assertTotals(order, "0", "0", 0)
+
+    def test_product_price_change(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop, self.mouse)
+        self.laptop.price = Decimal("900.00")
+        self.laptop.discount = 20
+        self.laptop.save()
+        self.assertTotals(order, "919.99", "181.00", 2)
+        self.mouse.delete()
+        self.assertTotals(order, "900.00", "180.00", 1)
+
+    def test_csv_import_and_recalculate(self):
+        data = (
+            "delivery_address,promocode,user,products\n"
+            f'"ul Mira 11","","buyer","{self.laptop.pk},{self.mouse.pk}"\n'
+        )
+        save_csv_order(BytesIO(data.encode()), "utf-8")
+        order = Order.objects.get()
+        self.assertTotals(order, "1019.99", "101.00", 2)
+
+        Product.objects.filter(pk=self.mouse.pk).update(price="29.99")
+        call_command("recalculate_order_totals", stdout=StringIO())
+        self.assertTotals(order, "1029.99", "101.50", 2)
+
+    def test_api_filter_and_ordering_by_total(self):
+        self.client.force_login(self.user)
+        cheap = Order.objects.create(user=self.user)
+        cheap.products.add(self.mouse)
+        expensive = Order.objects.create(user=self.user)
+        expensive.products.add(self.laptop)
+        response = self.client.get(
+            reverse('shopapp:order-list'),
+            {"total_price__gte": "100", "ordering": "-total_price"},
+        )
+        self.assertEqual([order["pk"] for order in response.json()["results"]], [expensive.pk])
+        self.assertEqual(response.json()["results"][0]["total_price"], "1000.00")
+
+
+class OrderProductsBulkTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='test')
+        cls.laptop = Product.objects.create(name="Laptop", price="1000.00", discount=10)
+        cls.mouse = Product.objects.create(name="Mouse", price="19.99", discount=5)
+
+    def setUp(self) -> None:
+        self.orders = [Order.objects.create(user=self.user) for _ in range(3)]
+        self.orders[0].products.add(self.laptop)
+
+    def post(self, name: str, orders, products):
+        return self.client.post(
+            reverse(f'shopapp:order-bulk-{name}-products'),
+            {"orders": [order.pk for order in orders], "products": [p.pk for p in products]},
+            content_type="application/json",
+        )
+
+    def test_add(self):
+        response = self.post("add", self.orders, [self.laptop, self.mouse])
+        self.assertEqual(response.json(), {"orders": 3, "added": 5, "removed": 0})
+        for order in self.orders:
+            order.refresh_from_db()
+            self.assertEqual(set(order.products.all()), {self.laptop, self.mouse})
+            self.assertEqual(order.total_price, Decimal("1019.99"))
+        self.assertEqual(recalculate_order_totals(), 0)
+
+    def test_remove_and_replace(self):
+        self.post("add", self.orders, [self.mouse])
+        response = self.post("remove", self.orders, [self.laptop])
+        self.assertEqual(response.json(), {"orders": 3, "added": 0, "removed": 1})
+        response = self.post("replace", self.orders[:2], [self.laptop])
+        self.assertEqual(response.json(), {"orders": 2, "added": 2, "removed": 2})
+        self.assertEqual(list(self.orders[1].products.all()), [self.laptop])
+        self.assertEqual(list(self.orders[2].products.all()), [self.mouse])
+        self.assertEqual(recalculate_order_totals(), 0)
+
+    def test_queries_do_not_depend_on_orders_count(self):
+        with CaptureQueriesContext(connection) as few:
+            self.post("replace", self.orders, [self.mouse])
+        many = [Order.objects.create(user=self.user) for _ in range(30)]
+        with CaptureQueriesContext(connection) as more:
+            self.post("replace", many, [self.laptop, self.mouse])
+        self.assertEqual(len(few), len(more))
+
+    def test_changes_update_orders(self):
+        order = self.orders[1]
+        updated_at = order.updated_at
+        self.post("add", [order], [self.mouse])
+        order.refresh_from_db()
+        self.assertGreater(order.updated_at, updated_at)
+
+    def test_unknown_pks(self):
+        response = self.client.post(
+            reverse('shopapp:order-bulk-add-products'),
+            {"orders": [self.orders[0].pk, 999], "products": [self.mouse.pk]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("orders", response.json())
+        self.assertFalse(self.orders[0].products.filter(pk=self.mouse.pk).exists())
+
+
+class SeedShopCommandTestCase(TestCase):
+    def seed(self, **options):
+        options = {"products": 40, "users": 3, "orders": 25, "batch_size": 7, **options}
+        call_command("seed_shop", stdout=StringIO(), stderr=StringIO(), **options)
+
+    def test_seed(self):
+        self.seed()
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(User.objects.filter(profile__isnull=False).count(), 3)
+        self.assertEqual(Order.objects.count(), 25)
+        self.assertEqual(
+            Order.products.through.objects.count(),
+            sum(Order.objects.values_list("item_count", flat=True)),
+        )
+        # итоги посчитаны при генерации и совпадают с пересчетом
+        self.assertEqual(recalculate_order_totals(), 0)
+
+    def test_deterministic(self):
+        self.seed(prefix="first", orders=0)
+        first = list(Product.objects.order_by("pk").values_list("name", "price", "discount"))
+        Product.objects.all().delete()
+        self.seed(prefix="second", orders=0)
+        second = list(Product.objects.order_by("pk").values_list("name", "price", "discount"))
+        self.assertEqual(first, second)
+
+    def test_existing_prefix(self):
+        self.seed(orders=0)
+        with self.assertRaises(CommandError):
+            self.seed(orders=0)
+
+
+class BenchCommandTestCase(TestCase):
+    def test_report(self):
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command(
+                "bench",
+                "--products=20",
+                "--users=2",
+                "--orders=5",
+                "--requests=2",
+                "--warmup=1",
+                "--only=products_list",
+                f"--output={output.name}",
+                stdout=StringIO(),
+                stderr=StringIO(),
+            )
+            report = json.load(output)
+        route = report["routes"]["shopapp:products_list [anon]"]
+        self.assertEqual(route["status"], 200)
+        self.assertEqual(
+            set(route),
+            {
+                "url", "status", "requests", "rps", "p50_ms", "p95_ms", "p99_ms",
+                "queries", "peak_memory_kb",
+            },
+        )
+        # данные бенчмарка откатываются
+        self.assertFalse(Product.objects.exists())
+
+
+class ServerTimingMiddlewareTestCase(TestCase):
+    fixtures = [
+        'products-fixture.json',
+    ]
+
+    @staticmethod
+    def parse_server_timing(header: str) -> dict:
+        metrics = {}
+        for metric in header.split(", "):
+            name, *params = metric.split(";")
+            metrics[name] = dict(param.split("=", 1) for param in params)
+        return metrics
+
+    def test_header(self):
+        url = reverse('shopapp:product-detail', kwargs={"pk": 2})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        metrics = self.parse_server_timing(response["Server-Timing"])
+        self.assertEqual(set(metrics), {"app", "db", "cache"})
+        self.assertEqual(metrics["db"]["desc"], f'"{len(queries)} queries"')
+        self.assertGreaterEqual(float(metrics["app"]["dur"]), float(metrics["db"]["dur"]))
+
+    @override_settings(SERVER_TIMING_HEADER=False, INTERNAL_IPS=["127.0.0.1"])
+    def test_header_only_for_internal_ips(self):
+        url = reverse('shopapp:product-detail', kwargs={"pk": 2})
+        self.assertFalse(self.client.get(url, REMOTE_ADDR="203.0.113.5").has_header("Server-Timing"))
+        self.assertTrue(self.client.get(url, REMOTE_ADDR="127.0.0.1").has_header("Server-Timing"))
+
+    def test_cache_lookups(self):
+        url = reverse('shopapp:products_list')
+        self.client.get(url)
+        response = self.client.get(url)
+        metrics = self.parse_server_timing(response["Server-Timing"])
+        self.assertRegex(metrics["cache"]["desc"], r'^"[1-9]\d* hits / \d+ misses"$')
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_slow_request_log(self):
+        user = User.objects.create_user(username='buyer', password='test')
+        for _ in range(3):
+            Order.objects.create(user=user).products.add(2, 3)
+        with self.assertLogs("mysite.instrumentation", "WARNING") as logs:
+            self.client.get(reverse('shopapp:order-list'))
+        record = logs.records[0].slow_request
+        self.assertEqual(record["path"], reverse('shopapp:order-list'))
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["queries"], sum(item["count"] for item in record["top_queries"]))
+        self.assertNotRegex(" ".join(item["sql"] for item in record["top_queries"]), r"\d")
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=60_000)
+    def test_fast_request_not_logged(self):
+        with self.assertNoLogs("mysite.instrumentation", "WARNING"):
+            self.client.get(reverse('shopapp:products_list'))
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"], REPLICA_MAX_LAG=30)
+class ReplicaRoutingTestCase(TestCase):
+    def setUp(self) -> None:
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    @staticmethod
+    @replica_reads
+    def catalog_view(request):
+        return HttpResponse()
+
+    def route(self, request, view=None, write: bool = False) -> tuple[list, HttpResponse]:
+        """
+        Прогоняет запрос через middleware; возвращает базы, выбранные
+        роутером для чтения до и после записи
+        """
+        reads = []
+
+        def get_response(request):
+            middleware.process_view(request, view or self.catalog_view, (), {})
+            reads.append(self.router.db_for_read(Product))
+            if write:
+                self.router.db_for_write(Order)
+                reads.append(self.router.db_for_read(Product))
+            reads.append(replica_cache_timeout(300))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        response = middleware(request)
+        return reads, response
+
+    def test_replica_reads(self):
+        reads, response = self.route(self.factory.get("/"))
+        self.assertEqual(reads, ["replica1", 30])
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+        # вне запроса - основная БД
+        self.assertIsNone(self.router.db_for_read(Product))
+        self.assertEqual(replica_cache_timeout(300), 300)
+
+    def test_unsafe_method_and_unmarked_view(self):
+        reads, _ = self.route(self.factory.post("/"))
+        self.assertEqual(reads, [None, 300])
+        reads, _ = self.route(self.factory.get("/"), view=lambda request: HttpResponse())
+        self.assertEqual(reads, [None, 300])
+
+    def test_read_your_writes(self):
+        reads, response = self.route(self.factory.get("/"), write=True)
+        self.assertEqual(reads, ["replica1", None, 300])
+        cookie = response.cookies[PRIMARY_COOKIE]
+        self.assertEqual(cookie["max-age"], 30)
+        self.assertGreater(float(cookie.value), time.time())
+
+        request = self.factory.get("/")
+        request.COOKIES[PRIMARY_COOKIE] = cookie.value
+        reads, _ = self.route(request)
+        self.assertEqual(reads, [None, 300])
+
+    def test_sticky_cookie_expired(self):
+        request = self.factory.get("/")
+        request.COOKIES[PRIMARY_COOKIE] = str(int(time.time()) - 1)
+        reads, _ = self.route(request)
+        self.assertEqual(reads, ["replica1", 30])
+
+    def test_marked_views(self):
+        product_urls = [
+            reverse('shopapp:product-list'),
+            reverse('shopapp:product-detail', kwargs={"pk": 1}),
+            reverse('shopapp:products_list'),
+            reverse('shopapp:product_details', kwargs={"pk": 1}),
+            reverse('shopapp:products-export'),
+            reverse('shopapp:products_feed'),
+            reverse('shopapp:products_list_async'),
+            reverse('shopapp:products_feed_async'),
+        ]
+        for url in product_urls:
+            with self.subTest(url=url):
+                self.assertTrue(is_replica_view(resolve(url).func))
+        for url in (reverse('shopapp:order-list'), reverse('shopapp:orders_create')):
+            with self.subTest(url=url):
+                self.assertFalse(is_replica_view(resolve(url).func))
+
+    def test_no_migrations_on_replicas(self):
+        self.assertFalse(self.router.allow_migrate("replica1", "shopapp"))
+        self.assertTrue(self.router.allow_migrate("default", "shopapp"))
+
+
+@patch("shopapp.sitemap.SITEMAP_SHARD_SIZE", 2)
+class ShardedSitemapTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.products = [
+            Product.objects.create(name=f"Product {number}", archived=number == 2)
+            for number in range(5)
+        ]
+
+    def get_locations(self, url: str) -> list[str]:
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/xml")
+        return re.findall(r"<loc>([^<]+)</loc>", b"".join(response.streaming_content).decode())
+
+    def shard_url(self, product: Product) -> str:
+        return reverse('sitemap_shard', kwargs={"shard": (product.pk - 1) // 2})
+
+    def product_url(self, product: Product) -> str:
+        return "http://testserver" + product.get_absolute_url()
+
+    def test_index_and_shards(self):
+        shards = self.get_locations(reverse('sitemap'))
+        self.assertEqual(
+            shards,
+            list(dict.fromkeys("http://testserver" + self.shard_url(product) for product in self.products)),
+        )
+        locations = [location for shard in shards for location in self.get_locations(shard)]
+        self.assertEqual(
+            locations,
+            [self.product_url(product) for product in self.products if not product.archived],
+        )
+
+    def test_served_without_queries(self):
+        url = self.shard_url(self.products[0])
+        self.get_locations(url)
+        with self.assertNumQueries(0):
+            self.get_locations(url)
+            self.get_locations(url)
+
+    def test_product_change_rebuilds_its_shard(self):
+        changed, other = self.products[0], self.products[-1]
+        self.get_locations(self.shard_url(changed))
+        self.get_locations(self.shard_url(other))
+        changed.archived = True
+        changed.save()
+        with self.assertNumQueries(0):
+            self.assertIn(self.product_url(other), self.get_locations(self.shard_url(other)))
+        self.assertEqual(
+            self.get_locations(self.shard_url(changed)),
+            [
+                self.product_url(product)
+                for product in self.products
+                if not product.archived and self.shard_url(product) == self.shard_url(changed)
+            ],
+        )
+        self.assertNotIn(self.product_url(changed), self.get_locations(self.shard_url(changed)))
+        # файл с прежней меткой удален
+        directory = os.path.join(settings.MEDIA_ROOT, "sitemaps", "http_testserver")
+        prefix = f"products-{(changed.pk - 1) // 2}-"
+        self.assertEqual(len([name for name in os.listdir(directory) if name.startswith(prefix)]), 1)
+
+    def test_archived_tail_has_no_shard(self):
+        url = self.shard_url(self.products[-1])
+        self.get_locations(url)
+        for product in self.products:
+            if self.shard_url(product) == url:
+                product.archived = True
+                product.save()
+        self.assertNotIn("http://testserver" + url, self.get_locations(reverse('sitemap')))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_tokens_bypass_local_cache(self):
+        token = get_token(SITEMAP_INDEX_TOKEN_KEY)
+        self.assertEqual(get_token(SITEMAP_INDEX_TOKEN_KEY), token)
+        # метку сменил другой воркер
+        caches["shared"].set(SITEMAP_INDEX_TOKEN_KEY, "renewed", timeout=None)
+        self.assertEqual(get_token(SITEMAP_INDEX_TOKEN_KEY), "renewed")
+
+    def test_unknown_shard(self):
+        response = self.client.get(reverse('sitemap_shard', kwargs={"shard": 100}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_build_sitemaps_command(self):
+        out = StringIO()
+        call_command("build_sitemaps", "http://testserver", stdout=out)
+        self.assertIn("Built 3 sitemap shards", out.getvalue())
+        with self.assertNumQueries(0):
+            for shard in self.get_locations(reverse('sitemap')):
+                self.get_locations(shard)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FastSerializerParityTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='test')
+        cls.products = [
+            Product.objects.create(
+                name=f"Product {number}",
+                price=Decimal("10.5") * number,
+                discount=number,
+                archived=number == 3,
+                preview=f"products/preview-{number}.png" if number % 2 else None,
+            )
+            for number in range(5)
+        ]
+        cls.orders = [
+            Order.objects.create(
+                user=cls.user,
+                delivery_address=f"Street {number}",
+                promocode="SALE" if number else "",
+                receipt="orders/receipts/receipt.pdf" if number == 1 else None,
+            )
+            for number in range(4)
+        ]
+        cls.orders[0].products.set(cls.products[::-1])
+        cls.orders[1].products.set(cls.products[1:3])
+
+    def setUp(self) -> None:
+        self.client.login(username='buyer', password='test')
+
+    def assertRenderedEqual(self, serializer_class, queryset, context: dict) -> None:
+        expected = serializer_class(queryset, many=True, context=context).data
+        fast = fast_serializer(serializer_class)
+        actual = fast.to_representation(fast.values(queryset), context)
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_serializers_parity(self):
+        request = Request(RequestFactory().get("/api/"))
+        for context in ({"request": request}, {}):
+            with self.subTest(request="request" in context):
+                self.assertRenderedEqual(ProductSerializer, Product.objects.order_by("pk"), context)
+                self.assertRenderedEqual(OrderSerializer, Order.objects.order_by("pk"), context)
+                self.assertRenderedEqual(OrderFullSerializer, Order.objects.order_by("pk"), context)
+
+    def test_current_timezone(self):
+        with timezone.override("Europe/Moscow"):
+            self.assertRenderedEqual(ProductSerializer, Product.objects.order_by("pk"), {})
+
+    def test_many_to_many_in_one_query(self):
+        fast = fast_serializer(OrderSerializer)
+        rows = list(fast.values(Order.objects.all()))
+        with self.assertNumQueries(1):
+            fast.to_representation(rows)
+
+    def test_api_matches_serializer(self):
+        request = Request(RequestFactory().get("/api/"))
+        for url_name, serializer_class, model, params in (
+            ('shopapp:product-list', ProductSerializer, Product, {}),
+            ('shopapp:product-list', ProductSerializer, Product, {"ordering": "-price"}),
+            ('shopapp:product-list', ProductSerializer, Product, {"cursor": ""}),
+            ('shopapp:order-list', OrderSerializer, Order, {"ordering": "delivery_address"}),
+        ):
+            with self.subTest(url_name=url_name, params=params):
+                response = self.client.get(reverse(url_name), params).json()
+                pks = [item["pk"] for item in response["results"]]
+                objects = model.objects.in_bulk(pks)
+                expected = serializer_class([objects[pk] for pk in pks], many=True, context={"request": request})
+                self.assertEqual(response["results"], json.loads(JSONRenderer().render(expected.data)))
+
+    def test_retrieve(self):
+        for product in self.products:
+            response = self.client.get(reverse('shopapp:product-detail', kwargs={"pk": product.pk}))
+            self.assertEqual(response.json()["pk"], product.pk)
+        order = self.orders[0]
+        response = self.client.get(reverse('shopapp:order-detail', kwargs={"pk": order.pk}))
+        self.assertEqual(response.json()["products"], [product.pk for product in order.products.all()])
+        response = self.client.get(reverse('shopapp:product-detail', kwargs={"pk": 999}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_orders_export(self):
+        response = self.client.get(reverse('shopapp:user_orders_export', kwargs={"user_id": self.user.pk}))
+        orders = json.loads(b"".join(response.streaming_content))["orders"]
+        expected = OrderSerializer(Order.objects.order_by("pk"), many=True).data
+        self.assertEqual(orders, json.loads(JSONRenderer().render(expected)))
+
+
+class ExpandFieldsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='test', first_name="Ivan")
+        cls.products = [
+            Product.objects.create(name=f"Product {number}", price=number) for number in range(4)
+        ]
+        ProductImage.objects.create(product=cls.products[0], image="one.png", description="front")
+        for number in range(12):
+            order = Order.objects.create(user=cls.user, delivery_address=f"Street {number}")
+            order.products.set(cls.products[: number % 4 + 1])
+
+    def setUp(self) -> None:
+        self.client.login(username='buyer', password='test')
+
+    def get(self, url_name: str, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_fields(self):
+        results = self.get('shopapp:product-list', fields="price,pk")["results"]
+        self.assertEqual(results[0], {"pk": self.products[0].pk, "price": "0.00"})
+        results = self.get('shopapp:order-list', fields="products", ordering="pk")["results"]
+        self.assertEqual(results[0], {"products": [self.products[0].pk]})
+
+    def test_unknown_fields(self):
+        for params in ({"fields": "pk,secret"}, {"expand": "profile"}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse('shopapp:order-list'), params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_expand(self):
+        order = self.get('shopapp:order-list', expand="products,user", ordering="pk")["results"][1]
+        self.assertEqual(order["user"]["first_name"], "Ivan")
+        self.assertNotIn("password", order["user"])
+        self.assertEqual([product["name"] for product in order["products"]], ["Product 0", "Product 1"])
+        self.assertEqual(order["delivery_address"], "Street 1")
+
+        order = self.get('shopapp:order-list', expand="user", fields="pk")["results"][0]
+        self.assertEqual(set(order), {"pk", "user"})
+        product = self.get('shopapp:product-list', expand="images", fields="name")["results"][0]
+        self.assertEqual(product["images"][0]["description"], "front")
+
+    def test_queries_do_not_depend_on_page_size(self):
+        params = {"expand": "products,user", "cursor": "", "ordering": "-pk"}
+        with patch.object(KeysetPagination, "page_size", 2), CaptureQueriesContext(connection) as few:
+            small = self.get('shopapp:order-list', **params)
+        with CaptureQueriesContext(connection) as many:
+            large = self.get('shopapp:order-list', **params)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(large["results"][:2], small["results"])
+        # продолжение по курсору
+        with patch.object(KeysetPagination, "page_size", 2):
+            rest = self.client.get(small["next"]).json()["results"]
+        self.assertEqual(large["results"][2:4], rest)
+
+    def test_only_needed_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get('shopapp:order-list', expand="user", fields="pk")
+        select = next(query["sql"] for query in queries if 'FROM "shopapp_order"' in query["sql"])
+        self.assertNotIn("delivery_address", select)
+        self.assertNotIn("password", select)
+
+    def test_retrieve_expand(self):
+        order = Order.objects.order_by("pk").last()
+        response = self.client.get(
+            reverse('shopapp:order-detail', kwargs={"pk": order.pk}), {"expand": "products"}
+        )
+        self.assertEqual(len(response.json()["products"]), order.products.count())
+        self.assertFalse(response.has_header("ETag"))
+
+
+class FastJSONTestCase(TestCase):
+    def payload(self) -> dict:
+        moscow = timezone.get_fixed_timezone(180)
+        return {
+            "price": Decimal("12.50"),
+            "created_at": datetime(2024, 5, 1, 10, 30, 15, 123456, tzinfo=timezone.get_fixed_timezone(0)),
+            "local": datetime(2024, 5, 1, 10, 30, tzinfo=moscow),
+            "naive": datetime(2024, 5, 1, 10, 30, 15, 5),
+            "day": date(2024, 5, 1),
+            "time": dt_time(10, 30, 15, 250000),
+            "uuid": UUID(int=1),
+            "lazy": gettext_lazy("Products"),
+            "text": "Товар \u2028 \u2029 \"quoted\"",
+            "numbers": {1: 1.5, 2: None, 3: True},
+            "nested": [{"pk": 1, "products": [1, 2]}],
+        }
+
+    def test_renderer_matches_drf(self):
+        data = self.payload()
+        expected = JSONRenderer().render(data)
+        self.assertEqual(fastjson.FastJSONRenderer().render(data), expected)
+        with patch("mysite.fastjson.orjson", None):
+            self.assertEqual(fastjson.FastJSONRenderer().render(data), expected)
+        # orjson не кодирует целые вне 64 бит
+        data = {"big": 2 ** 70}
+        self.assertEqual(fastjson.FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_renderer_indent(self):
+        data = self.payload()
+        media_type = "application/json; indent=4"
+        self.assertEqual(
+            fastjson.FastJSONRenderer().render(data, media_type),
+            JSONRenderer().render(data, media_type),
+        )
+
+    def test_dumps_matches_django_encoder(self):
+        data = self.payload()
+        expected = json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":"), ensure_ascii=False)
+        self.assertEqual(fastjson.dumps(data), expected.encode())
+        with patch("mysite.fastjson.orjson", None):
+            self.assertEqual(fastjson.dumps(data), expected.encode())
+
+    def test_parser(self):
+        body = '{"name": "Товар", "price": 1.5, "products": [1, 2]}'.encode()
+        parsed = fastjson.FastJSONParser().parse(BytesIO(body))
+        self.assertEqual(parsed, JSONParser().parse(BytesIO(body)))
+        for broken in (b'{"name": ', b'{"price": NaN}'):
+            with self.subTest(body=broken), self.assertRaises(ParseError):
+                fastjson.FastJSONParser().parse(BytesIO(broken))
+
+    def test_api(self):
+        user = User.objects.create_superuser(username='admin', password='test')
+        self.client.force_login(user)
+        response = self.client.post(
+            reverse('shopapp:product-list'),
+            {"name": "Новый товар", "price": "9.99"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["name"], "Новый товар")
+        self.assertIn("Новый товар".encode(), response.content)
+        response = self.client.post(
+            reverse('shopapp:product-list'), b'{"name": ', content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(COMPRESSION_LEVELS={"gzip": 6}, COMPRESSION_MIN_LENGTH=200, COMPRESSION_FLUSH_BYTES=100)
+class CompressionMiddlewareTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create(
+            Product(name=f"Product {number}", description="Description " * 10) for number in range(20)
+        )
+
+    def setUp(self) -> None:
+        compression_stats.reset()
+
+    def test_choose_encoding(self):
+        encodings = ["zstd", "br", "gzip"]
+        self.assertEqual(choose_encoding("gzip, deflate, br", encodings), "br")
+        self.assertEqual(choose_encoding("br;q=0.5, gzip", encodings), "gzip")
+        self.assertEqual(choose_encoding("*;q=0.1, zstd;q=0", encodings), "br")
+        self.assertEqual(choose_encoding("gzip;q=0, identity", encodings), None)
+        self.assertEqual(choose_encoding("", encodings), None)
+        self.assertEqual(choose_encoding("br", ["gzip"]), None)
+
+    def test_json_response(self):
+        url = reverse('shopapp:product-list')
+        plain = self.client.get(url)
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", plain["Vary"])
+        response = self.client.get(url, headers={"accept-encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response["ETag"], "W/" + plain["ETag"])
+        self.assertRegex(response["Server-Timing"], r'compress;dur=[\d.]+;desc="gzip level 6, \d+ -> \d+ bytes"')
+
+        stats = compression_stats.snapshot({"gzip": 6})["gzip"]
+        self.assertEqual(stats["responses"], 1)
+        self.assertEqual(stats["bytes_in"], len(plain.content))
+        self.assertEqual(stats["bytes_out"], len(response.content))
+
+    @override_settings(COMPRESSION_MIN_LENGTH=1000)
+    def test_skipped_responses(self):
+        user = User.objects.create_user(username='buyer', password='test')
+        Order.objects.create(user=user, delivery_address="Street " * 100)
+        small = reverse('shopapp:product-detail', kwargs={"pk": Product.objects.first().pk})
+        gzipped = reverse('shopapp:user_orders_export', kwargs={"user_id": user.pk}) + "?gzip=1"
+        for url in (small, gzipped):
+            with self.subTest(url=url):
+                response = self.client.get(url, headers={"accept-encoding": "gzip"})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response.get("Content-Encoding"), "gzip")
+        self.assertEqual(compression_stats.snapshot({}), {})
+
+    def test_stream_is_compressed_incrementally(self):
+        consumed = []
+
+        def rows():
+            for number in range(50):
+                consumed.append(number)
+                yield f"row {number},{'x' * 20}\n".encode()
+
+        middleware = CompressionMiddleware(lambda request: StreamingHttpResponse(rows(), content_type="text/csv"))
+        request = RequestFactory().get("/", headers={"accept-encoding": "gzip"})
+        response = middleware(request)
+        self.assertEqual(consumed, [])
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertFalse(response.has_header("Content-Length"))
+        chunks = list(response.streaming_content)
+        # сжатые данные отдаются по ходу потока, а не одним куском в конце
+        self.assertGreater(len([chunk for chunk in chunks if chunk]), 2)
+        self.assertEqual(
+            gzip.decompress(b"".join(chunks)),
+            b"".join(f"row {number},{'x' * 20}\n".encode() for number in range(50)),
+        )
+        self.assertEqual(compression_stats.snapshot({})["gzip"]["streamed"], 1)
+
+    def test_html_gets_random_padding(self):
+        html = "<html>" + "<p>Product</p>" * 200 + "</html>"
+        middleware = CompressionMiddleware(lambda request: HttpResponse(html))
+        sizes = set()
+        for _ in range(5):
+            request = RequestFactory().get("/", headers={"accept-encoding": "gzip"})
+            response = middleware(request)
+            self.assertEqual(gzip.decompress(response.content), html.encode())
+            sizes.add(len(response.content))
+        self.assertGreater(len(sizes), 1)
+
+    @patch.dict("mysite.compression.COMPRESSORS", {"br": GzipCompressor})
+    @override_settings(COMPRESSION_LEVELS={"br": 4, "gzip": 6})
+    def test_csrf_token_pages_use_only_gzip(self):
+        middleware = CompressionMiddleware(lambda request: HttpResponse("<p>Form</p>" * 200))
+        request = RequestFactory().get("/", headers={"accept-encoding": "br, gzip"})
+        self.assertEqual(middleware(request)["Content-Encoding"], "br")
+        request = RequestFactory().get("/", headers={"accept-encoding": "br, gzip"})
+        request.META["CSRF_COOKIE_USED"] = True
+        self.assertEqual(middleware(request)["Content-Encoding"], "gzip")
+
+    async def test_async_stream(self):
+        url = reverse('shopapp:products_export_async')
+        response = await self.async_client.get(url, headers={"accept-encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        plain = await self.async_client.get(url)
+        expected = b"".join([chunk async for chunk in plain.streaming_content])
+        self.assertEqual(gzip.decompress(content), expected)
@@ -0,0 +1,116 @@
+"""
+Денормализованные итоги заказа: Order.total_price (сумма цен товаров),
+Order.total_discount (сумма скидок, discount товара - проценты) и
+Order.item_count.
+
+Добавление товаров и изменение цены/скидки товара меняют итоги на разницу
+одним UPDATE. Удаление товаров из заказа редкое, после него итоги
+пересчитываются по составу заказа (recalculate_order_totals)
+"""
+
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Iterable
+
+from django.db.models import F
+from django.utils import timezone
+
+from .exports import bump_orders_export_version
+from .models import Order, Product
+
+CENT = Decimal("0.01")
+# Количество заказов, пересчитываемых за один раз
+RECALCULATE_BATCH_SIZE = 1000
+
+
+def discount_amount(price: Decimal, discount: int) -> Decimal:
+    return (Decimal(price) * discount / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def products_totals(rows: Iterable[tuple[Decimal, int]]) -> tuple[Decimal, Decimal, int]:
+    """
+    Итоги по (цена, скидка) товаров: сумма цен, сумма скидок, количество
+    """
+    total_price = total_discount = Decimal("0.00")
+    count = 0
+    for price, discount in rows:
+        total_price += price
+        total_discount += discount_amount(price, discount)
+        count += 1
+    return total_price, total_discount, count
+
+
+def add_products_to_totals(order_pks: Iterable[int], product_pks: Iterable[int]) -> None:
+    """
+    Прибавляет товары product_pks к итогам каждого из заказов order_pks
+    """
+    rows = Product.objects.filter(pk__in=product_pks).values_list("price", "discount")
+    total_price, total_discount, count = products_totals(rows)
+    if not count:
+        return
+    Order.objects.filter(pk__in=order_pks).update(
+        total_price=F("total_price") + total_price,
+        total_discount=F("total_discount") + total_discount,
+        item_count=F("item_count") + count,
+    )
+
+
+def shift_product_totals(
+    product_pk: int,
+    old: tuple[Decimal, int],
+    new: tuple[Decimal, int],
+) -> None:
+    """
+    Переносит изменение цены/скидки товара в итоги заказов с этим товаром
+    """
+    price_delta = new[0] - old[0]
+    discount_delta = discount_amount(*new) - discount_amount(*old)
+    if not price_delta and not discount_delta:
+        return
+    orders = Order.objects.filter(products=product_pk)
+    orders.update(
+        total_price=F("total_price") + price_delta,
+        total_discount=F("total_discount") + discount_delta,
+        updated_at=timezone.now(),
+    )
+    for user_id in orders.values_list("user_id", flat=True).distinct():
+        bump_orders_export_version(user_id)
+
+
+def recalculate_order_totals(order_pks: Iterable[int] | None = None) -> int:
+    """
+    Пересчитывает итоги заказов (всех, если order_pks не задан)
+    по их составу. Возвращает количество исправленных заказов
+    """
+    if order_pks is None:
+        fixed = last_pk = 0
+        pks = Order.objects.order_by("pk").values_list("pk", flat=True)
+        while batch := list(pks.filter(pk__gt=last_pk)[:RECALCULATE_BATCH_SIZE]):
+            fixed += recalculate_order_totals(batch)
+            last_pk = batch[-1]
+        return fixed
+
+    order_pks = list(order_pks)
+    rows: dict[int, list[tuple[Decimal, int]]] = {}
+    links = Order.products.through.objects.filter(order_id__in=order_pks)
+    for order_id, price, discount in links.values_list(
+        "order_id", "product__price", "product__discount"
+    ):
+        rows.setdefault(order_id, []).append((price, discount))
+
+    changed = []
+    now = timezone.now()
+    orders = Order.objects.filter(pk__in=order_pks).only(
+        "pk", "user_id", "total_price", "total_discount", "item_count"
+    )
+    for order in orders:
+        totals = products_totals(rows.get(order.pk, ()))
+        if totals != (order.total_price, order.total_discount, order.item_count):
+            order.total_price, order.total_discount, order.item_count = totals
+            order.updated_at = now
+            changed.append(order)
+    Order.objects.bulk_update(
+        changed, ["total_price", "total_discount", "item_count", "updated_at"]
+    )
+    for user_id in {order.user_id for order in changed}:
+        bump_orders_export_version(user_id)
+    return len(changed)
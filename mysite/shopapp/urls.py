@@ -1,6 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from .async_views import (
+    products_list_async,
+    product_details_async,
+    products_export_async,
+    latest_products_feed_async,
+)
 from .views import (
     ShopIndexView,
     ProductDetailsView,
@@ -52,4 +58,21 @@ urlpatterns = [
     ),
     path("orders/<int:pk>/", OrderDetailView.as_view(), name="order_details"),
     path("orders/create/", order_create, name="orders_create"),
+    # асинхронные варианты страниц каталога (для запуска под ASGI)
+    path("async/products/", products_list_async, name="products_list_async"),
+    path(
+        "async/products/export/",
+        products_export_async,
+        name="products_export_async",
+    ),
+    path(
+        "async/products/latest/feed/",
+        latest_products_feed_async,
+        name="products_feed_async",
+    ),
+    path(
+        "async/products/<int:pk>/",
+        product_details_async,
+        name="product_details_async",
+    ),
 ]
@@ -0,0 +1,26 @@
+from django.core.cache import cache
+from django.db import connection, transaction
+
+
+def get_version(key: str) -> int:
+    """
+    Текущая версия (счетчик) по ключу. Версии хранятся в кеше без срока
+    годности и входят в ключи кешированных данных: увеличение версии
+    делает старые записи недостижимыми, они просто истекают по таймауту
+    """
+    return cache.get_or_set(key, 1, timeout=None)
+
+
+def _incr_version(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, timeout=None)
+
+
+def bump_version(key: str) -> None:
+    _incr_version(key)
+    # Внутри транзакции другой запрос может успеть закешировать старые
+    # данные под новой версией до коммита, поэтому повторяем после коммита
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _incr_version(key))
@@ -1,12 +1,15 @@
 import logging
-import json
 from csv import DictWriter
 
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.models import User
-from django.core.cache import cache
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse
+from django.http import (
+    HttpResponse,
+    HttpRequest,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render, reverse, redirect, get_object_or_404
 from django.contrib.syndication.views import Feed
 from django.urls import reverse_lazy
@@ -24,28 +27,66 @@ from drf_spectacular.utils import (
     extend_schema,
     OpenApiResponse,
     OpenApiExample,
+    OpenApiParameter,
 )
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.request import Request
 from rest_framework.parsers import MultiPartParser
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
+from mysite.fastjson import dumps
+from mysite.replicas import replica_reads
+
 from .forms import ProductForm, OrderForm
-from .common import save_csv_products
+from .common import save_csv_products, iter_csv_rows
+from .exports import iter_user_orders_json, gzip_chunks
+from .fast_serializers import FastReadMixin
 from .models import Product, Order, ProductImage
+from .jobs import enqueue
+from .conditional import (
+    ConditionalGetMixin,
+    conditional_response,
+    queryset_validators,
+    set_validators,
+)
+from .page_cache import (
+    VersionedPageCacheMixin,
+    catalog_version,
+    product_version,
+)
+from .pagination import KeysetPagination
+from .search import ProductSearchFilter, search_products
+from .order_lines import bulk_add_products, bulk_remove_products, bulk_replace_products
 from .serializers import (
     ProductSerializer,
     OrderSerializer,
     DetailSerializer,
     OrderFullSerializer,
+    OrderProductsBulkSerializer,
+    OrderProductsBulkResultSerializer,
 )
 
 log = logging.getLogger(__name__)
 
 
+def shape_parameters(serializer_class) -> list[OpenApiParameter]:
+    """
+    Параметры ?fields= и ?expand= (см. shopapp.expand) для схемы API
+    """
+    return [
+        OpenApiParameter("fields", str, description="Поля ответа через запятую"),
+        OpenApiParameter(
+            "expand",
+            str,
+            description="Связи, которые выводятся объектами, а не pk: "
+            + ", ".join(serializer_class.Meta.expandable),
+        ),
+    ]
+
+
 class UserOrdersListView(LoginRequiredMixin, ListView):
     template_name = "shopapp/orders-list-users.html"
 
@@ -59,6 +100,7 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
             Order.objects.select_related("user")
             .prefetch_related("products")
             .filter(user=self.owner)
+            .order_by("-created_at")
         )
 
     def get_context_data(self, **kwargs):
@@ -69,38 +111,19 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
         return context
 
 
+@replica_reads
 def export_user_orders_json(request: Request, user_id: int):
-    # проверка данных кеша по ключу
-    cache_key = f"orders_data_{user_id}"
-    orders_json = cache.get(cache_key)
-
-    if orders_json is None:
-        user: User = get_object_or_404(User, pk=user_id)
-
-        queryset = (
-            Order.objects.select_related("user")
-            .prefetch_related("products")
-            .filter(user=user)
-            .order_by("pk")
-        )
-        serializer = OrderSerializer(queryset, many=True)
-        orders_json = json.dumps(
-            {"orders": serializer.data},
-            indent=4,
-        )
-
-        # сохранение данных кеша по ключу
-        cache.set("cache_key", orders_json, 300)
-
-    # создаем файл с данными
-    file_name = f"orders-export-{user_id}.json"
-    with open(file_name, "w") as outfile:
-        outfile.write(orders_json)
-
-    # читаем файл для отправки клиенту
+    # Выгрузка отдается потоком из кеша (ключ версионируется по пользователю
+    # и сбрасывается сигналами при изменении заказов) либо сериализуется на лету
+    get_object_or_404(User, pk=user_id)
+    chunks = iter_user_orders_json(user_id)
     file_name_out = "orders-export.json"
-    with open(file_name, "r") as fh:
-        response = HttpResponse(fh.read(), content_type="application/json")
+
+    if request.GET.get("gzip") in ("1", "true"):
+        response = StreamingHttpResponse(gzip_chunks(chunks), content_type="application/gzip")
+        file_name_out += ".gz"
+    else:
+        response = StreamingHttpResponse(chunks, content_type="application/json")
 
     response["Content-Disposition"] = f"attachment; filename={file_name_out}"
 
@@ -111,6 +134,7 @@ def export_user_orders_json(request: Request, user_id: int):
 @extend_schema_view(
     list=extend_schema(
         summary="Получить список имеющихся товаров",
+        parameters=shape_parameters(ProductSerializer),
     ),
     update=extend_schema(
         summary="Изменение товара",
@@ -172,6 +196,7 @@ def export_user_orders_json(request: Request, user_id: int):
     ),
     retrieve=extend_schema(
         summary="Детальная информация о товаре",
+        parameters=shape_parameters(ProductSerializer),
         responses={
             status.HTTP_200_OK: ProductSerializer,
             status.HTTP_400_BAD_REQUEST: DetailSerializer,
@@ -182,9 +207,11 @@ def export_user_orders_json(request: Request, user_id: int):
         },
     ),
 )
-class ProductViewSet(ModelViewSet):
+@replica_reads
+class ProductViewSet(ConditionalGetMixin, FastReadMixin, ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
     filterset_fields = [
         "name",
         "description",
@@ -193,7 +220,7 @@ class ProductViewSet(ModelViewSet):
         "archived",
     ]
     filter_backends = [
-        SearchFilter,
+        ProductSearchFilter,
         OrderingFilter,
     ]
     search_fields = [
@@ -218,9 +245,7 @@ class ProductViewSet(ModelViewSet):
 
     @action(methods=["get"], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type="text/csv")
         file_name = "products-export.csv"
-        response["Content-Disposition"] = f"attachment; filename={file_name}"
         # Фильтрация результатов фильтрами, указанными в данном классе
         queryset = self.filter_queryset(self.get_queryset())
         fields = [
@@ -229,6 +254,19 @@ class ProductViewSet(ModelViewSet):
             "price",
             "discount",
         ]
+
+        # Потоковая выгрузка (?stream=1): строки отдаются клиенту по мере
+        # чтения из БД, весь файл в памяти не собирается
+        if request.query_params.get("stream") in ("1", "true"):
+            response = StreamingHttpResponse(
+                iter_csv_rows(queryset, fields),
+                content_type="text/csv",
+            )
+            response["Content-Disposition"] = f"attachment; filename={file_name}"
+            return response
+
+        response = HttpResponse(content_type="text/csv")
+        response["Content-Disposition"] = f"attachment; filename={file_name}"
         # Загрузка только указанных полей
         queryset = queryset.only(*fields)
 
@@ -245,18 +283,23 @@ class ProductViewSet(ModelViewSet):
 
     @action(methods=["post"], detail=False, parser_classes=[MultiPartParser])
     def upload_csv(self, request: Request):
-        products = save_csv_products(
-            request.FILES["file"].file,
-            encoding=request.encoding,
-        )
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        # ?upsert=1 - обновление существующих товаров по артикулу (sku)
+        try:
+            report = save_csv_products(
+                request.FILES["file"].file,
+                encoding=request.encoding or "utf-8",
+                upsert=request.query_params.get("upsert") in ("1", "true"),
+            )
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict())
 
 
 @extend_schema(tags=["Orders"])
 @extend_schema_view(
     list=extend_schema(
         summary="Получить список имеющихся заказов",
+        parameters=shape_parameters(OrderSerializer),
         responses={
             status.HTTP_200_OK: OrderFullSerializer,
             status.HTTP_400_BAD_REQUEST: DetailSerializer,
@@ -324,6 +367,7 @@ class ProductViewSet(ModelViewSet):
     ),
     retrieve=extend_schema(
         summary="Детальная информация о заказе",
+        parameters=shape_parameters(OrderSerializer),
         responses={
             status.HTTP_200_OK: OrderFullSerializer,
             status.HTTP_400_BAD_REQUEST: DetailSerializer,
@@ -334,15 +378,18 @@ class ProductViewSet(ModelViewSet):
         },
     ),
 )
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ConditionalGetMixin, FastReadMixin, ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
-    filterset_fields = [
-        "delivery_address",
-        "promocode",
-        "user",
-        "products",
-    ]
+    pagination_class = KeysetPagination
+    filterset_fields = {
+        "delivery_address": ["exact"],
+        "promocode": ["exact"],
+        "user": ["exact"],
+        "products": ["exact"],
+        "total_price": ["exact", "gte", "lte"],
+        "item_count": ["exact", "gte", "lte"],
+    }
     filter_backends = [
         DjangoFilterBackend,
         OrderingFilter,
@@ -351,6 +398,9 @@ class OrderViewSet(ModelViewSet):
         "delivery_address",
         "promocode",
         "products",
+        "created_at",
+        "total_price",
+        "item_count",
     ]
 
     @extend_schema(
@@ -359,6 +409,40 @@ class OrderViewSet(ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    def change_products(self, request: Request, change) -> Response:
+        serializer = OrderProductsBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = change(serializer.validated_data["orders"], serializer.validated_data["products"])
+        return Response(OrderProductsBulkResultSerializer(result).data)
+
+    @extend_schema(
+        summary="Добавление товаров во многие заказы",
+        request=OrderProductsBulkSerializer,
+        responses={status.HTTP_200_OK: OrderProductsBulkResultSerializer},
+    )
+    @action(methods=["post"], detail=False, url_path="bulk/add-products")
+    def bulk_add_products(self, request: Request):
+        return self.change_products(request, bulk_add_products)
+
+    @extend_schema(
+        summary="Удаление товаров из многих заказов",
+        request=OrderProductsBulkSerializer,
+        responses={status.HTTP_200_OK: OrderProductsBulkResultSerializer},
+    )
+    @action(methods=["post"], detail=False, url_path="bulk/remove-products")
+    def bulk_remove_products(self, request: Request):
+        return self.change_products(request, bulk_remove_products)
+
+    @extend_schema(
+        summary="Замена состава многих заказов",
+        description="Состав каждого из заказов становится равным products",
+        request=OrderProductsBulkSerializer,
+        responses={status.HTTP_200_OK: OrderProductsBulkResultSerializer},
+    )
+    @action(methods=["post"], detail=False, url_path="bulk/replace-products")
+    def bulk_replace_products(self, request: Request):
+        return self.change_products(request, bulk_replace_products)
+
 
 class ShopIndexView(View):
     def get(self, request: HttpRequest) -> HttpResponse:
@@ -367,25 +451,51 @@ class ShopIndexView(View):
         return render(request, "shopapp/shop-index.html", context=context)
 
 
-class ProductDetailsView(DetailView):
+@replica_reads
+class ProductDetailsView(VersionedPageCacheMixin, DetailView):
     template_name = "shopapp/products-details.html"
     queryset = Product.objects.prefetch_related("images")
     context_object_name = "product"
 
+    def get_page_version(self) -> str:
+        return f"product_{self.kwargs['pk']}_v{product_version(self.kwargs['pk'])}"
+
+    def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        etag, last_modified = queryset_validators(Product.objects.filter(pk=kwargs["pk"]))
+        if last_modified is not None:
+            not_modified = conditional_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+        response = super().get(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
+
     def get_context_data(self, **kwargs):
         log.info("Show details of %s", self.object.name)
         context = super().get_context_data(**kwargs)
         return context
 
 
-class ProductsListView(ListView):
+@replica_reads
+class ProductsListView(VersionedPageCacheMixin, ListView):
     template_name = "shopapp/products-list.html"
     context_object_name = "products"
     queryset = Product.objects.filter(archived=False)
 
+    def get_page_version(self) -> str:
+        return f"catalog_v{catalog_version()}"
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        query = self.request.GET.get("q", "").strip()
+        if query:
+            log.debug("Search products by %r", query)
+            queryset = search_products(queryset, query)
+        return queryset
+
     def get_context_data(self, **kwargs):
         log.info("Show products list (only not archived)")
         context = super().get_context_data(**kwargs)
+        context["query"] = self.request.GET.get("q", "")
         return context
 
 
@@ -416,11 +526,25 @@ class ProductUpdateView(UpdateView):
     def form_valid(self, form):
         response = super().form_valid(form)
         log.debug("Add images for product")
-        for image in form.files.getlist("images"):
+        images = [
             ProductImage.objects.create(
                 product=self.object,
                 image=image,
             )
+            for image in form.files.getlist("images")
+        ]
+        if images:
+            # масштабирование - в фоновой задаче, не в процессе веб-сервера;
+            # варианты нового превью ставит в очередь сигнал post_save товара
+            enqueue(
+                "build_image_variants",
+                params={
+                    "product": self.object.pk,
+                    "images": [image.pk for image in images],
+                    "preview": False,
+                },
+                user=self.request.user,
+            )
 
         return response
 
@@ -461,8 +585,9 @@ class OrderDetailView(PermissionRequiredMixin, DetailView):
         return context
 
 
+@replica_reads
 class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
+    def get(self, request: HttpRequest) -> HttpResponse:
         products = Product.objects.order_by("pk").all()
         products_data = [
             {
@@ -473,7 +598,7 @@ class ProductsDataExportView(View):
             }
             for product in products
         ]
-        return JsonResponse({"products": products_data})
+        return HttpResponse(dumps({"products": products_data}), content_type="application/json")
 
 
 def order_create(request: HttpRequest) -> HttpResponse:
@@ -491,11 +616,20 @@ def order_create(request: HttpRequest) -> HttpResponse:
     return render(request, "shopapp/create-order.html", context=context)
 
 
+@replica_reads
 class LatestProductsFeed(Feed):
     title = "Shop - list products"
     link = reverse_lazy("shopapp:products_list")
     description = "Products in the shop."
 
+    def __call__(self, request, *args, **kwargs):
+        etag, last_modified = queryset_validators(self.items())
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        response = super().__call__(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
+
     def items(self):
         return Product.objects.order_by("-created_at")[:3]
 